@@ -1,7 +1,7 @@
 # 核心模块
 from .fingerprint import FingerprintGenerator, BehaviorAnalyzer
 from .identity_chain import IdentityChainManager
-from .log_monitor import NginxLogParser, LogMonitor, BatchLogProcessor
+from .log_monitor import NginxLogParser, LogMonitor, InotifyLogMonitor, MultiLogMonitor, BatchLogProcessor
 from .threat_detector import ThreatDetector
 from .firewall import FirewallExecutor
 from .scoring_system import ThreatScoringSystem
@@ -17,6 +17,8 @@ __all__ = [
     'IdentityChainManager',
     'NginxLogParser',
     'LogMonitor',
+    'InotifyLogMonitor',
+    'MultiLogMonitor',
     'BatchLogProcessor',
     'ThreatDetector',
     'FirewallExecutor',
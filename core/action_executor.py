@@ -0,0 +1,339 @@
+"""
+处置动作执行器
+封禁（iptables子进程）、告警（SMTP/HTTP）和审计日志由独立的工作线程执行，
+日志处理线程只把动作放入有界优先队列，检测吞吐不再受处置耗时影响
+"""
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional
+
+from .write_buffer import LatencyHistogram
+
+
+class _Action:
+    """队列中的一个动作"""
+    
+    __slots__ = ('priority', 'seq', 'kind', 'key', 'func', 'args', 'kwargs', 'enqueued_at')
+    
+    def __init__(self, priority: int, seq: int, kind: str, key: Optional[str],
+                 func: Callable, args: tuple, kwargs: Dict):
+        self.priority = priority
+        self.seq = seq
+        self.kind = kind
+        self.key = key
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.time()
+    
+    def __lt__(self, other: '_Action') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+def _covers(banned: Optional[int], requested: Optional[int]) -> bool:
+    """已执行的封禁时长是否覆盖新请求的时长（None表示永久）"""
+    if banned is None:
+        return True
+    return requested is not None and banned >= requested
+
+
+def _longer(current: Optional[int], requested: Optional[int]) -> Optional[int]:
+    """两个封禁时长中较长的一个（None表示永久）"""
+    if current is None or requested is None:
+        return None
+    return max(current, requested)
+
+
+class ActionExecutor:
+    """
+    处置动作执行器
+    
+    动作按优先级执行（封禁 > 审计 > 告警），同一优先级按提交顺序执行；
+    同一IP尚未执行的封禁请求合并为一次（取最长时长、最新原因），
+    刚成功封禁过的IP在去重窗口内再次请求不超过已执行时长的封禁时直接跳过；
+    同一IP的封禁不会在多个工作线程中同时执行，正在执行时取到的封禁等其完成后再放回队列
+    
+    队列满时，新动作优先级高于队列中最低优先级的动作则挤掉后者，否则丢弃新动作；
+    workers为0时在调用线程中立即执行（回放时保证结果可重现）
+    """
+    
+    PRIORITY_BAN = 0
+    PRIORITY_AUDIT = 1
+    PRIORITY_ALERT = 2
+    
+    def __init__(self, workers: int = 2, max_queue: int = 10000,
+                 ban_dedupe_seconds: float = 60, clock=None):
+        """
+        Args:
+            workers: 工作线程数（0表示同步执行）
+            max_queue: 队列中最多等待的动作数
+            ban_dedupe_seconds: 同一IP封禁成功后的去重窗口（秒）
+            clock: 时钟（去重窗口按该时钟计算，None表示系统时钟）
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.ban_dedupe = timedelta(seconds=ban_dedupe_seconds)
+        self.clock = clock
+        
+        self._queue = []
+        self._seq = itertools.count()
+        # ip -> 尚未执行的封禁动作
+        self._pending_bans: Dict[str, _Action] = {}
+        # 正在执行封禁的IP，以及等待其完成的下一次封禁
+        self._banning = set()
+        self._deferred_bans: Dict[str, _Action] = {}
+        # ip -> (封禁成功时间, 封禁时长)
+        self._recent_bans: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._running = False
+        self._threads = []
+        self._active = 0
+        
+        self.stats = {
+            'submitted': 0,
+            'executed': 0,
+            'failed': 0,
+            'dropped': 0,           # 队列满时丢弃的动作
+            'coalesced': 0,         # 合并到等待中封禁的请求
+            'deduplicated': 0,      # 去重窗口内跳过的封禁请求
+            'max_queue_depth': 0,
+        }
+        # kind -> {'submitted', 'executed', 'failed', 'dropped', 'wait': 直方图, 'run': 直方图}
+        self._kinds: Dict[str, Dict] = {}
+    
+    def _now(self) -> datetime:
+        return self.clock.now() if self.clock else datetime.now()
+    
+    def _kind_stats(self, kind: str) -> Dict:
+        stats = self._kinds.get(kind)
+        if stats is None:
+            stats = self._kinds[kind] = {
+                'submitted': 0, 'executed': 0, 'failed': 0, 'dropped': 0,
+                'wait': LatencyHistogram(), 'run': LatencyHistogram(),
+            }
+        return stats
+    
+    def start(self):
+        """启动工作线程"""
+        if self.workers <= 0 or self._running:
+            return
+        self._running = True
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'action-executor-{index}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def close(self, timeout: float = 30.0):
+        """执行完队列中剩余的动作后停止工作线程"""
+        with self._lock:
+            self._running = False
+            self._not_empty.notify_all()
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.time()))
+        self._threads = []
+        # 没有工作线程（或线程已超时退出）时在当前线程中执行剩余动作
+        while True:
+            with self._lock:
+                if not self._queue and self._deferred_bans:
+                    for action in self._deferred_bans.values():
+                        heapq.heappush(self._queue, action)
+                    self._deferred_bans.clear()
+                if not self._queue:
+                    break
+                action = self._pop()
+            self._execute(action)
+    
+    def submit(self, kind: str, func: Callable, *args,
+               priority: int = PRIORITY_ALERT, **kwargs) -> bool:
+        """
+        提交动作
+        
+        Args:
+            kind: 动作类型（统计按类型分开，如 'alert'、'audit'）
+            func: 执行函数，以 *args/**kwargs 调用
+            priority: 优先级（越小越先执行）
+        
+        Returns:
+            是否已接受（队列满被丢弃时返回False）
+        """
+        action = _Action(priority, next(self._seq), kind, None, func, args, kwargs)
+        return self._enqueue(action)
+    
+    def submit_ban(self, ip: str, func: Callable, duration: Optional[int] = None,
+                   on_success: Optional[Callable] = None, **params) -> bool:
+        """
+        提交封禁
+        
+        Args:
+            ip: IP地址
+            func: 封禁函数，以 func(ip, duration, **params) 调用，返回是否成功
+            duration: 封禁时长（秒），None表示永久
+            on_success: 封禁成功后调用 on_success(ip, duration, **params)
+            **params: 封禁原因、威胁事件ID等（合并时取最新的值）
+        
+        Returns:
+            是否已接受（合并到等待中的封禁也返回True；去重跳过或被丢弃时返回False）
+        """
+        with self._lock:
+            recent = self._recent_bans.get(ip)
+            if recent and self._now() - recent[0] < self.ban_dedupe and _covers(recent[1], duration):
+                self.stats['deduplicated'] += 1
+                return False
+            
+            pending = self._pending_bans.get(ip)
+            if pending is not None:
+                pending.kwargs['duration'] = _longer(pending.kwargs['duration'], duration)
+                pending.kwargs['params'].update(params)
+                if on_success is not None:
+                    pending.kwargs['on_success'] = on_success
+                self.stats['coalesced'] += 1
+                return True
+            
+            action = _Action(self.PRIORITY_BAN, next(self._seq), 'ban', ip, self._run_ban, (ip,),
+                             {'func': func, 'duration': duration, 'on_success': on_success, 'params': params})
+            # 查找和登记在同一次加锁内完成，并发提交的同一IP封禁只会入队一次
+            if self.workers > 0:
+                return self._push(action)
+        return self._enqueue(action)
+    
+    def _run_ban(self, ip: str, func: Callable, duration: Optional[int],
+                 on_success: Optional[Callable], params: Dict):
+        if not func(ip, duration, **params):
+            return False
+        with self._lock:
+            self._recent_bans[ip] = (self._now(), duration)
+            if len(self._recent_bans) > self.max_queue:
+                self._prune_recent_bans()
+        if on_success is not None:
+            on_success(ip, duration, **params)
+        return True
+    
+    def _prune_recent_bans(self):
+        """移除去重窗口之外的封禁记录（调用方持有锁）"""
+        threshold = self._now() - self.ban_dedupe
+        for ip in [ip for ip, (banned_at, _) in self._recent_bans.items() if banned_at < threshold]:
+            del self._recent_bans[ip]
+    
+    def _enqueue(self, action: _Action) -> bool:
+        if self.workers <= 0:
+            with self._lock:
+                self.stats['submitted'] += 1
+                self._kind_stats(action.kind)['submitted'] += 1
+            self._execute(action)
+            return True
+        
+        with self._lock:
+            return self._push(action)
+    
+    def _push(self, action: _Action) -> bool:
+        """放入队列（调用方持有锁）"""
+        self.stats['submitted'] += 1
+        self._kind_stats(action.kind)['submitted'] += 1
+        if len(self._queue) >= self.max_queue:
+            worst = max(self._queue)
+            if not action < worst:
+                self._drop(action)
+                return False
+            # 挤掉队列中优先级最低、提交最晚的动作
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            if worst.key is not None:
+                self._pending_bans.pop(worst.key, None)
+            self._drop(worst)
+        
+        heapq.heappush(self._queue, action)
+        if action.key is not None:
+            self._pending_bans[action.key] = action
+        if len(self._queue) > self.stats['max_queue_depth']:
+            self.stats['max_queue_depth'] = len(self._queue)
+        self._not_empty.notify()
+        return True
+    
+    def _drop(self, action: _Action):
+        """记录丢弃的动作（调用方持有锁）"""
+        self.stats['dropped'] += 1
+        self._kind_stats(action.kind)['dropped'] += 1
+    
+    def _pop(self) -> _Action:
+        """取出优先级最高的动作（调用方持有锁）"""
+        action = heapq.heappop(self._queue)
+        if action.key is not None and self._pending_bans.get(action.key) is action:
+            del self._pending_bans[action.key]
+        return action
+    
+    def _worker(self):
+        while True:
+            with self._lock:
+                while True:
+                    while self._running and not self._queue:
+                        self._not_empty.wait()
+                    if not self._queue:
+                        return
+                    action = self._pop()
+                    if action.key is None or action.key not in self._banning:
+                        break
+                    # 同一IP的封禁正在执行，完成后再放回队列（期间的新请求仍合并到这里）
+                    self._deferred_bans[action.key] = action
+                    self._pending_bans[action.key] = action
+                if action.key is not None:
+                    self._banning.add(action.key)
+                self._active += 1
+            try:
+                self._execute(action)
+            finally:
+                with self._lock:
+                    self._active -= 1
+                    if action.key is not None:
+                        self._banning.discard(action.key)
+                        deferred = self._deferred_bans.pop(action.key, None)
+                        if deferred is not None:
+                            heapq.heappush(self._queue, deferred)
+                            self._not_empty.notify()
+    
+    def _execute(self, action: _Action):
+        started = time.time()
+        try:
+            result = action.func(*action.args, **action.kwargs)
+            failed = result is False
+        except Exception as e:
+            failed = True
+            print(f"✗ 执行{action.kind}动作失败: {e}")
+        finished = time.time()
+        
+        with self._lock:
+            stats = self._kind_stats(action.kind)
+            stats['wait'].record((started - action.enqueued_at) * 1000)
+            stats['run'].record((finished - started) * 1000)
+            if failed:
+                stats['failed'] += 1
+                self.stats['failed'] += 1
+            else:
+                stats['executed'] += 1
+                self.stats['executed'] += 1
+    
+    def get_stats(self) -> Dict:
+        """获取执行统计（含每种动作的排队和执行延迟）"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['queue_depth'] = len(self._queue)
+            stats['pending_bans'] = len(self._pending_bans)
+            stats['active'] = self._active
+            stats['workers'] = self.workers
+            stats['max_queue'] = self.max_queue
+            stats['kinds'] = {
+                kind: {
+                    'submitted': item['submitted'],
+                    'executed': item['executed'],
+                    'failed': item['failed'],
+                    'dropped': item['dropped'],
+                    'wait_latency': item['wait'].get_stats(),
+                    'run_latency': item['run'].get_stats(),
+                }
+                for kind, item in self._kinds.items()
+            }
+        return stats
@@ -6,18 +6,21 @@ import smtplib
 import requests
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 import json
 
+from .clock import Clock, SYSTEM_CLOCK
+
 
 class AlertManager:
     """告警管理器"""
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, clock: Optional[Clock] = None):
         self.config = config
         self.alert_config = config.get('alerts', {})
         self.enabled = self.alert_config.get('enabled', False)
+        self.clock = clock or SYSTEM_CLOCK
         
         if self.enabled:
             print("✓ 告警系统已启用")
@@ -45,7 +48,7 @@ class AlertManager:
         # 防止告警风暴
         last_alert = self._alert_history.get(ip)
         if last_alert:
-            elapsed = (datetime.now() - last_alert).total_seconds()
+            elapsed = (self.clock.now() - last_alert).total_seconds()
             if elapsed < self.min_alert_interval:
                 return False
         
@@ -67,7 +70,7 @@ class AlertManager:
             return
         
         # 记录告警时间
-        self._alert_history[ip] = datetime.now()
+        self._alert_history[ip] = self.clock.now()
         
         # 构建告警消息
         message = self._build_alert_message(ip, threat_type, severity, description, details)
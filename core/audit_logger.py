@@ -187,8 +187,10 @@ class AuditLogger:
         except Exception as e:
             print(f"✗ 审计日志轮转失败: {e}")
     
-    def _format_duration(self, seconds: int) -> str:
-        """格式化时长"""
+    def _format_duration(self, seconds: Optional[int]) -> str:
+        """格式化时长（None表示永久）"""
+        if seconds is None:
+            return "永久"
         if seconds < 60:
             return f"{seconds}秒"
         elif seconds < 3600:
@@ -0,0 +1,374 @@
+"""
+行为多样性统计草图
+每个基础指纹维护一份流式统计：访问次数、不同行为指纹数、不同路径模式数和状态码计数。
+不同值的数量在阈值以内精确计数，超过阈值后转为HyperLogLog近似计数，
+每条日志O(1)更新，不再为每条日志查询该指纹最近的1000条访问日志
+"""
+import base64
+import hashlib
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+# 路径模式：数字ID、UUID、长哈希替换为占位符
+_NUMERIC_ID = re.compile(r'/\d+')
+_UUID = re.compile(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.IGNORECASE)
+_LONG_HASH = re.compile(r'/[0-9a-f]{32,}', re.IGNORECASE)
+
+
+def extract_path_pattern(path: str) -> str:
+    """提取路径模式（将数字、UUID等替换为占位符）"""
+    path = (path or '').split('?', 1)[0]
+    path = _NUMERIC_ID.sub('/{id}', path)
+    path = _UUID.sub('/{uuid}', path)
+    return _LONG_HASH.sub('/{hash}', path)
+
+
+def hash64(value: str) -> int:
+    """64位哈希（进程间稳定，用于精确集合和HyperLogLog）"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HyperLogLog:
+    """
+    HyperLogLog基数估计
+    
+    precision=10时使用1024个寄存器（1KB），标准误差约3.2%
+    """
+    
+    def __init__(self, precision: int = 10, registers: Optional[bytearray] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.size)
+        self._rest_bits = 64 - precision
+        self._rest_mask = (1 << self._rest_bits) - 1
+    
+    def add_hash(self, value: int):
+        """加入一个64位哈希值"""
+        index = value >> self._rest_bits
+        rest = value & self._rest_mask
+        rank = self._rest_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def count(self) -> int:
+        """估计不同值的数量"""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        total = 0.0
+        zeros = 0
+        for rank in self.registers:
+            total += 2.0 ** -rank
+            if rank == 0:
+                zeros += 1
+        estimate = alpha * m * m / total
+        # 小基数时用线性计数修正
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+    
+    def encode(self) -> str:
+        return base64.b64encode(bytes(self.registers)).decode('ascii')
+    
+    @classmethod
+    def decode(cls, data: str, precision: int) -> 'HyperLogLog':
+        return cls(precision, bytearray(base64.b64decode(data)))
+
+
+class DistinctCounter:
+    """不同值计数：阈值以内保存精确的64位哈希集合，超过后转为HyperLogLog"""
+    
+    def __init__(self, exact_limit: int = 256, precision: int = 10):
+        self.exact_limit = exact_limit
+        self.precision = precision
+        self.exact = set()
+        self.hll: Optional[HyperLogLog] = None
+    
+    def add(self, value: str):
+        hashed = hash64(value)
+        if self.hll is not None:
+            self.hll.add_hash(hashed)
+            return
+        self.exact.add(hashed)
+        if len(self.exact) > self.exact_limit:
+            self.hll = HyperLogLog(self.precision)
+            for item in self.exact:
+                self.hll.add_hash(item)
+            self.exact = set()
+    
+    def count(self) -> int:
+        if self.hll is not None:
+            return self.hll.count()
+        return len(self.exact)
+    
+    def to_dict(self) -> Dict:
+        if self.hll is not None:
+            return {'hll': self.hll.encode(), 'p': self.precision}
+        return {'exact': [format(item, 'x') for item in self.exact]}
+    
+    @classmethod
+    def from_dict(cls, data: Dict, exact_limit: int, precision: int) -> 'DistinctCounter':
+        counter = cls(exact_limit, precision)
+        if 'hll' in data:
+            counter.precision = data.get('p', precision)
+            counter.hll = HyperLogLog.decode(data['hll'], counter.precision)
+        else:
+            counter.exact = {int(item, 16) for item in data.get('exact', [])}
+        return counter
+
+
+class BehaviorSketch:
+    """单个基础指纹的行为统计草图"""
+    
+    VERSION = 1
+    
+    def __init__(self, exact_limit: int = 256, precision: int = 10):
+        self.count = 0
+        self.behaviors = DistinctCounter(exact_limit, precision)
+        self.paths = DistinctCounter(exact_limit, precision)
+        self.status_codes: Dict[int, int] = {}
+    
+    def add(self, behavior_hash: str, request_path: str, status_code):
+        """记录一次访问"""
+        self.count += 1
+        self.behaviors.add(behavior_hash)
+        self.paths.add(extract_path_pattern(request_path))
+        if status_code is not None:
+            self.status_codes[status_code] = self.status_codes.get(status_code, 0) + 1
+    
+    @property
+    def unique_behaviors(self) -> int:
+        # 近似计数不超过访问次数
+        return min(self.behaviors.count(), self.count)
+    
+    @property
+    def unique_paths(self) -> int:
+        return min(self.paths.count(), self.count)
+    
+    def to_json(self) -> str:
+        return json.dumps({
+            'v': self.VERSION,
+            'n': self.count,
+            'b': self.behaviors.to_dict(),
+            'p': self.paths.to_dict(),
+            's': {str(code): count for code, count in self.status_codes.items()},
+        }, separators=(',', ':'))
+    
+    @classmethod
+    def from_json(cls, data: str, exact_limit: int = 256, precision: int = 10) -> Optional['BehaviorSketch']:
+        """解析持久化的草图（格式无效或版本不符时返回None）"""
+        try:
+            item = json.loads(data)
+            if item.get('v') != cls.VERSION:
+                return None
+            sketch = cls(exact_limit, precision)
+            sketch.count = item['n']
+            sketch.behaviors = DistinctCounter.from_dict(item['b'], exact_limit, precision)
+            sketch.paths = DistinctCounter.from_dict(item['p'], exact_limit, precision)
+            sketch.status_codes = {int(code): count for code, count in item.get('s', {}).items()}
+            return sketch
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+
+class BehaviorSketchStore:
+    """
+    行为草图存储
+    
+    内存中保存最近使用的指纹草图（LRU），首次使用时从Fingerprint.behavior_sketch加载；
+    旧数据没有草图时用该指纹已有的访问日志初始化一次。修改过的草图与unique_behaviors
+    一起定期用一条executemany UPDATE写回指纹表
+    """
+    
+    def __init__(self, engine, exact_limit: int = 256, precision: int = 10,
+                 max_size: int = 10000, bootstrap_limit: int = 1000,
+                 flush_interval: Optional[float] = 1.0, max_dirty: int = 1000):
+        """
+        Args:
+            engine: SQLAlchemy引擎
+            exact_limit: 不同值数量超过该值后改用HyperLogLog
+            precision: HyperLogLog精度（寄存器数为2^precision）
+            max_size: 内存中最多保存的草图数
+            bootstrap_limit: 初始化草图时最多读取的历史访问日志条数
+            flush_interval: 定期写回的间隔（秒），None表示只按数量写回
+            max_dirty: 待写回的草图数达到该值时立即写回
+        """
+        from sqlalchemy import bindparam, update
+        from models.database import Fingerprint
+        
+        self.engine = engine
+        self.exact_limit = exact_limit
+        self.precision = precision
+        self.max_size = max_size
+        self.bootstrap_limit = bootstrap_limit
+        self.flush_interval = flush_interval
+        self.max_dirty = max_dirty
+        table = Fingerprint.__table__
+        self._update = update(table).where(
+            table.c.base_hash == bindparam('_base_hash')
+        ).values(
+            behavior_sketch=bindparam('_sketch'),
+            unique_behaviors=bindparam('_unique_behaviors'),
+            # 写回草图不是访问，避免last_seen的onupdate改为当前时间
+            last_seen=table.c.last_seen,
+        )
+        
+        self._sketches: 'OrderedDict[str, BehaviorSketch]' = OrderedDict()
+        self._dirty = set()
+        # 被淘汰但尚未写回的草图（已序列化）
+        self._evicted: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        
+        self.stats = {
+            'observed': 0,
+            'loaded': 0,            # 从指纹表加载的草图数
+            'bootstrapped': 0,      # 由历史访问日志初始化的草图数
+            'evictions': 0,
+            'flushes': 0,
+            'rows_flushed': 0,
+            'flush_errors': 0,
+        }
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._sketches)
+            stats['dirty'] = len(self._dirty) + len(self._evicted)
+        stats['max_size'] = self.max_size
+        return stats
+    
+    def start(self):
+        """启动定期写回线程"""
+        if self.flush_interval:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name='behavior-sketch-store', daemon=True)
+            self._thread.start()
+    
+    def close(self):
+        """停止写回线程并写回所有修改过的草图"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        self.flush()
+    
+    def forget_all(self):
+        """写回并清空内存中的草图（清理任务删除指纹后调用）"""
+        self.flush()
+        with self._lock:
+            for base_hash in self._dirty:
+                self._evicted[base_hash] = self._row(base_hash, self._sketches[base_hash])
+            self._dirty = set()
+            self._sketches.clear()
+    
+    def observe(self, base_hash: str, log_data: Dict, db_session) -> BehaviorSketch:
+        """
+        把一条日志计入该指纹的草图
+        
+        Args:
+            base_hash: 基础指纹哈希
+            log_data: 日志（使用behavior_hash、request_path、status_code）
+            db_session: 草图不在内存中时用于加载的会话
+        
+        Returns:
+            更新后的草图（调用方只读）
+        """
+        with self._lock:
+            sketch = self._sketches.get(base_hash)
+            if sketch is not None:
+                self._sketches.move_to_end(base_hash)
+        if sketch is None:
+            sketch = self._load(base_hash, log_data, db_session)
+        
+        with self._lock:
+            sketch.add(log_data.get('behavior_hash'), log_data.get('request_path'), log_data.get('status_code'))
+            self._dirty.add(base_hash)
+            self.stats['observed'] += 1
+            full = len(self._dirty) >= self.max_dirty
+        if full:
+            self.flush()
+        return sketch
+    
+    def _load(self, base_hash: str, log_data: Dict, db_session) -> BehaviorSketch:
+        """从指纹表加载草图，没有时由历史访问日志初始化"""
+        from models.database import AccessLog, Fingerprint, to_db_time
+        
+        with self._lock:
+            pending = self._evicted.get(base_hash)
+        data = pending['_sketch'] if pending else db_session.query(Fingerprint.behavior_sketch).filter(
+            Fingerprint.base_hash == base_hash
+        ).scalar()
+        sketch = BehaviorSketch.from_json(data, self.exact_limit, self.precision) if data else None
+        
+        if sketch is not None:
+            self.stats['loaded'] += 1
+        else:
+            # 只统计当前日志之前的访问，当前日志由调用方计入
+            sketch = BehaviorSketch(self.exact_limit, self.precision)
+            rows = db_session.query(
+                AccessLog.behavior_hash, AccessLog.request_path, AccessLog.status_code
+            ).filter(
+                AccessLog.base_hash == base_hash,
+                AccessLog.timestamp < to_db_time(log_data['timestamp'])
+            ).order_by(AccessLog.timestamp.desc()).limit(self.bootstrap_limit).all()
+            for behavior_hash, request_path, status_code in rows:
+                sketch.add(behavior_hash, request_path, status_code)
+            self.stats['bootstrapped'] += 1
+        
+        with self._lock:
+            self._sketches[base_hash] = sketch
+            while len(self._sketches) > self.max_size:
+                evicted_hash, evicted = self._sketches.popitem(last=False)
+                self.stats['evictions'] += 1
+                if evicted_hash in self._dirty:
+                    self._dirty.discard(evicted_hash)
+                    self._evicted[evicted_hash] = self._row(evicted_hash, evicted)
+        return sketch
+    
+    @staticmethod
+    def _row(base_hash: str, sketch: BehaviorSketch) -> Dict:
+        return {
+            '_base_hash': base_hash,
+            '_sketch': sketch.to_json(),
+            '_unique_behaviors': sketch.unique_behaviors,
+        }
+    
+    def flush(self):
+        """把修改过的草图写回指纹表"""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._evicted.values())
+                rows.extend(self._row(base_hash, self._sketches[base_hash]) for base_hash in self._dirty)
+                self._dirty = set()
+                self._evicted = {}
+            if not rows:
+                return
+            
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(self._update, rows)
+            except Exception as e:
+                with self._lock:
+                    for row in rows:
+                        if row['_base_hash'] in self._sketches:
+                            self._dirty.add(row['_base_hash'])
+                        else:
+                            self._evicted.setdefault(row['_base_hash'], row)
+                    self.stats['flush_errors'] += 1
+                print(f"✗ 写回行为草图失败: {e}")
+                return
+            
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['rows_flushed'] += len(rows)
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
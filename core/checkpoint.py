@@ -0,0 +1,115 @@
+"""
+日志读取位置检查点
+记录每个日志文件的 (设备号, inode, 偏移, 最后一行哈希)，重启后从断点继续读取
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+
+def hash_line(line: bytes) -> str:
+    """计算日志行的哈希（用于校验断点位置是否仍然有效）"""
+    return hashlib.sha1(line.rstrip(b'\r\n')).hexdigest()
+
+
+class OffsetCheckpoint:
+    """
+    偏移检查点文件
+
+    文件内容为JSON: {日志路径: {device, inode, offset, line_hash, updated_at}}
+    写入时先写临时文件并fsync，再原子替换，保证崩溃时不会留下损坏的检查点
+    """
+
+    def __init__(self, path: str, interval: float = 5.0):
+        """
+        Args:
+            path: 检查点文件路径
+            interval: 定期写盘的最小间隔（秒）
+        """
+        self.path = path
+        self.interval = interval
+        self._positions: Dict[str, Dict] = {}
+        self._dirty = False
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """从磁盘加载检查点"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                self._positions = data
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"⚠ 读取检查点失败，将忽略: {e}")
+
+    def get(self, log_file: str) -> Optional[Dict]:
+        """获取指定日志文件的断点"""
+        with self._lock:
+            position = self._positions.get(os.path.abspath(log_file))
+            return dict(position) if position else None
+
+    def update(self, log_file: str, device: int, inode: int, offset: int,
+               line_hash: Optional[str]):
+        """更新断点（仅更新内存，由flush()写盘）"""
+        with self._lock:
+            self._positions[os.path.abspath(log_file)] = {
+                'device': device,
+                'inode': inode,
+                'offset': offset,
+                'line_hash': line_hash,
+                'updated_at': time.time()
+            }
+            self._dirty = True
+
+    @property
+    def dirty(self) -> bool:
+        """是否有尚未写盘的更新"""
+        return self._dirty
+
+    def flush(self, force: bool = False) -> bool:
+        """
+        写盘
+
+        Args:
+            force: 忽略写盘间隔立即写入（用于关闭时）
+
+        Returns:
+            是否实际写入了文件
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            if not force and time.time() - self._last_flush < self.interval:
+                return False
+
+            tmp_path = f"{self.path}.tmp"
+            try:
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self._positions, f)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+
+                # 同步目录项，确保rename本身落盘
+                dir_fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            except OSError as e:
+                print(f"⚠ 写入检查点失败: {e}")
+                return False
+
+            self._dirty = False
+            self._last_flush = time.time()
+            return True
@@ -0,0 +1,66 @@
+"""
+时钟抽象
+检测、评分、规则等模块通过注入的时钟获取当前时间，
+实时运行时使用系统时钟，回放历史日志时使用由日志时间驱动的虚拟时钟
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Optional
+
+
+class Clock(ABC):
+    """时钟接口"""
+    
+    @abstractmethod
+    def time(self) -> float:
+        """当前时间（Unix时间戳，同time.time()）"""
+    
+    def now(self) -> datetime:
+        """当前本地时间（naive datetime，同datetime.now()）"""
+        return datetime.fromtimestamp(self.time())
+
+
+class SystemClock(Clock):
+    """系统时钟（默认）"""
+    
+    def time(self) -> float:
+        return time.time()
+    
+    def now(self) -> datetime:
+        return datetime.now()
+
+
+class VirtualClock(Clock):
+    """
+    虚拟时钟
+    
+    时间只由advance()推进，回放时设置为每条日志自身的时间，
+    同一份日志无论以多快的速度回放，各模块看到的时间都相同
+    """
+    
+    def __init__(self, start: Optional[float] = None):
+        """
+        Args:
+            start: 初始时间戳（默认为0，即第一条日志到来之前）
+        """
+        self._now = start or 0.0
+        self._lock = threading.Lock()
+    
+    def time(self) -> float:
+        return self._now
+    
+    def advance(self, timestamp: float):
+        """
+        将时钟推进到指定时间
+        
+        时钟不会倒退：乱序到达的较早日志不改变当前时间
+        """
+        with self._lock:
+            if timestamp > self._now:
+                self._now = timestamp
+
+
+# 未注入时钟时各模块共用的系统时钟
+SYSTEM_CLOCK = SystemClock()
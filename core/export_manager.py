@@ -123,7 +123,9 @@ class ExportManager:
                 'severity': r.severity,
                 'description': r.description,
                 'handled': r.handled,
-                'action_taken': r.action_taken
+                'action_taken': r.action_taken,
+                'occurrence_count': r.occurrence_count or 1,
+                'last_seen': (r.last_seen or r.timestamp).strftime('%Y-%m-%d %H:%M:%S')
             } for r in records]
             
             if not output_file:
@@ -435,10 +437,12 @@ class ExportManager:
             
             # 威胁统计
             summary.append("【威胁统计】")
-            threats_24h = session.query(func.count(ThreatEvent.id)).filter(
+            # 聚合的威胁事件按命中次数统计
+            occurrences = func.coalesce(func.sum(func.coalesce(ThreatEvent.occurrence_count, 1)), 0)
+            threats_24h = session.query(occurrences).filter(
                 ThreatEvent.timestamp >= cutoff_24h
             ).scalar()
-            threats_7d = session.query(func.count(ThreatEvent.id)).filter(
+            threats_7d = session.query(occurrences).filter(
                 ThreatEvent.timestamp >= cutoff_7d
             ).scalar()
             summary.append(f"  24小时内威胁: {threats_24h}")
@@ -3,10 +3,12 @@
 """
 import hashlib
 import json
-from datetime import datetime
 from typing import Dict, List, Optional
 from urllib.parse import parse_qs, urlparse
 
+from .behavior_sketch import extract_path_pattern
+from .clock import Clock, SYSTEM_CLOCK
+
 
 class FingerprintGenerator:
     """指纹生成器"""
@@ -109,19 +111,34 @@ class FingerprintGenerator:
 class BehaviorAnalyzer:
     """行为分析器 - 检测行为模式变化"""
     
-    def __init__(self, config: Dict):
+    def __init__(self, config: Dict, clock: Optional[Clock] = None, sketch_store=None):
+        """
+        Args:
+            config: 系统配置
+            clock: 时钟
+            sketch_store: 行为草图存储（BehaviorSketchStore，传入时按草图增量分析，不再查询访问日志）
+        """
         self.config = config
+        self.clock = clock or SYSTEM_CLOCK
+        self.sketch_store = sketch_store
         self.threshold_config = config.get('fingerprint', {}).get('identity_chain_threshold', {})
         self.same_base_count = self.threshold_config.get('same_base_count', 10)
         self.behavior_change_rate = self.threshold_config.get('behavior_change_rate', 0.3)
     
-    def analyze_behavior_change(self, base_hash: str, db_session) -> Dict:
+    def analyze_behavior_change(self, base_hash: str, db_session, log_data: Optional[Dict] = None) -> Dict:
         """
         分析指定基础指纹的行为变化
         返回是否需要创建身份链以及相关信息
+        
+        Args:
+            base_hash: 基础指纹哈希
+            db_session: 数据库会话
+            log_data: 当前日志（配置了草图存储时计入草图，由草图得出结果）
         """
-        from models.database import AccessLog, Fingerprint
-        from sqlalchemy import func
+        if self.sketch_store is not None and log_data is not None:
+            return self._analyze_sketch(self.sketch_store.observe(base_hash, log_data, db_session))
+        
+        from models.database import AccessLog
         
         # 获取该基础指纹的所有访问记录
         logs = db_session.query(AccessLog).filter(
@@ -164,26 +181,34 @@ class BehaviorAnalyzer:
             'status_codes': list(status_codes)
         }
     
+    def _analyze_sketch(self, sketch) -> Dict:
+        """由行为草图得出分析结果（字段同analyze_behavior_change，路径和状态码为计数）"""
+        if sketch.count < self.same_base_count:
+            return {
+                'should_create_chain': False,
+                'reason': 'insufficient_data',
+                'log_count': sketch.count
+            }
+        
+        unique_behaviors = sketch.unique_behaviors
+        behavior_diversity = unique_behaviors / sketch.count
+        should_create = behavior_diversity >= self.behavior_change_rate
+        
+        return {
+            'should_create_chain': should_create,
+            'reason': 'behavior_evolution_detected' if should_create else 'normal_behavior',
+            'log_count': sketch.count,
+            'unique_behaviors': unique_behaviors,
+            'behavior_diversity': behavior_diversity,
+            'unique_paths': sketch.unique_paths,
+            'status_codes': dict(sketch.status_codes)
+        }
+    
     def _extract_path_pattern(self, path: str) -> str:
         """
         提取路径模式（将数字、UUID等替换为占位符）
         """
-        import re
-        
-        # 移除查询参数
-        if '?' in path:
-            path = path.split('?')[0]
-        
-        # 替换数字ID
-        path = re.sub(r'/\d+', '/{id}', path)
-        
-        # 替换UUID
-        path = re.sub(r'/[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', '/{uuid}', path, flags=re.IGNORECASE)
-        
-        # 替换哈希值
-        path = re.sub(r'/[0-9a-f]{32,}', '/{hash}', path, flags=re.IGNORECASE)
-        
-        return path
+        return extract_path_pattern(path)
     
     def calculate_threat_score(self, base_hash: str, db_session) -> int:
         """
@@ -195,7 +220,7 @@ class BehaviorAnalyzer:
         from datetime import timedelta
         
         score = 0
-        cutoff_time = datetime.now() - timedelta(hours=24)
+        cutoff_time = self.clock.now() - timedelta(hours=24)
         
         # 获取24小时内的访问记录
         logs = db_session.query(AccessLog).filter(
@@ -224,7 +249,9 @@ class BehaviorAnalyzer:
             score += min(25, int((unique_paths - 20) / 2))
         
         # 4. 历史威胁事件 (最高25分)
-        threat_count = db_session.query(func.count(ThreatEvent.id)).filter(
+        threat_count = db_session.query(
+            func.coalesce(func.sum(func.coalesce(ThreatEvent.occurrence_count, 1)), 0)
+        ).filter(
             ThreatEvent.base_hash == base_hash,
             ThreatEvent.timestamp >= cutoff_time
         ).scalar()
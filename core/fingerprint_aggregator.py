@@ -0,0 +1,204 @@
+"""
+指纹访问统计聚合
+已存在的指纹每次访问只需要累加visit_count、更新last_seen，
+这些增量先在内存中按base_hash合并，定期用一条UPSERT语句批量写入
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import func
+
+
+class FingerprintAggregator:
+    """
+    指纹访问增量聚合器
+    
+    record()把已知指纹的访问合并为 (次数增量, 最早first_seen, 最晚last_seen)；
+    flush()按数据库方言生成UPSERT（SQLite/PostgreSQL: ON CONFLICT，MySQL: ON DUPLICATE KEY），
+    对所有待写指纹执行一次executemany。指纹在两次刷新之间被清理任务删除时，UPSERT会重新插入
+    
+    首次出现的指纹仍由调用方同步插入（评分、封禁等阶段需要立即读到该记录），
+    插入后调用mark_known()，之后的访问才进入聚合
+    """
+    
+    def __init__(self, engine, flush_interval: Optional[float] = 1.0,
+                 max_pending: int = 10000, max_known: int = 100000):
+        """
+        Args:
+            engine: SQLAlchemy引擎
+            flush_interval: 定期刷新的间隔（秒），None表示只按数量刷新
+            max_pending: 待写指纹数达到该值时立即刷新
+            max_known: 记住"数据库中已存在"的指纹数量上限（超出时淘汰最早的）
+        """
+        from models.database import Fingerprint
+        
+        self.engine = engine
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_known = max_known
+        self._table = Fingerprint.__table__
+        self._upsert = self._build_upsert(engine.dialect.name)
+        
+        # base_hash -> {'ip', 'user_agent', 'first_seen', 'last_seen', 'visit_count'}
+        self._pending: Dict[str, Dict] = {}
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        
+        self.stats = {
+            'recorded': 0,          # 合并到聚合器的访问次数
+            'flushes': 0,
+            'rows_flushed': 0,      # UPSERT写入的指纹行数
+            'flush_errors': 0,
+            'flush_ms_total': 0.0,
+            'flush_ms_max': 0.0,
+        }
+    
+    def _build_upsert(self, dialect: str):
+        """生成方言对应的UPSERT语句（executemany时每行一组参数）"""
+        table = self._table
+        if dialect == 'mysql':
+            from sqlalchemy.dialects.mysql import insert
+            stmt = insert(table)
+            new = stmt.inserted
+        elif dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table)
+            new = stmt.excluded
+        else:
+            raise ValueError(f"不支持的数据库类型: {dialect}")
+        
+        # SQLite的多参数max()/min()即GREATEST/LEAST；任一参数为NULL时结果为NULL，先用coalesce兜底
+        greatest, least = (func.max, func.min) if dialect == 'sqlite' else (func.greatest, func.least)
+        values = {
+            'visit_count': func.coalesce(table.c.visit_count, 0) + new.visit_count,
+            'first_seen': least(func.coalesce(table.c.first_seen, new.first_seen), new.first_seen),
+            'last_seen': greatest(func.coalesce(table.c.last_seen, new.last_seen), new.last_seen),
+        }
+        if dialect == 'mysql':
+            return stmt.on_duplicate_key_update(**values)
+        return stmt.on_conflict_do_update(index_elements=[table.c.base_hash], set_=values)
+    
+    def get_stats(self) -> Dict:
+        """获取聚合统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+            stats['known'] = len(self._known)
+        flushes = stats['flushes']
+        stats['flush_ms_avg'] = stats['flush_ms_total'] / flushes if flushes else 0.0
+        stats['rows_per_flush'] = stats['rows_flushed'] / flushes if flushes else 0.0
+        return stats
+    
+    def start(self):
+        """启动定期刷新线程"""
+        if self.flush_interval:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name='fingerprint-aggregator', daemon=True)
+            self._thread.start()
+    
+    def close(self):
+        """停止刷新线程并写入剩余的增量"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        self.flush()
+    
+    def mark_known(self, base_hash: str):
+        """记录该指纹已存在于数据库中"""
+        with self._lock:
+            self._known[base_hash] = True
+            self._known.move_to_end(base_hash)
+            if len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+    
+    def forget_all(self):
+        """清空已知指纹（清理任务删除指纹后调用，之后首次访问重新同步插入）"""
+        with self._lock:
+            self._known.clear()
+    
+    def record(self, base_hash: str, ip: str, user_agent: str, timestamp: datetime) -> bool:
+        """
+        合并一次访问
+        
+        Returns:
+            True表示已合并；False表示该指纹未知（调用方需要同步插入或更新，然后调用mark_known）
+        """
+        with self._lock:
+            if base_hash not in self._known:
+                return False
+            
+            item = self._pending.get(base_hash)
+            if item is None:
+                self._pending[base_hash] = {
+                    'base_hash': base_hash,
+                    'ip': ip,
+                    'user_agent': user_agent,
+                    'first_seen': timestamp,
+                    'last_seen': timestamp,
+                    'visit_count': 1,
+                }
+            else:
+                item['visit_count'] += 1
+                if timestamp < item['first_seen']:
+                    item['first_seen'] = timestamp
+                if timestamp > item['last_seen']:
+                    item['last_seen'] = timestamp
+            self.stats['recorded'] += 1
+            full = len(self._pending) >= self.max_pending
+        if full:
+            self.flush()
+        return True
+    
+    def flush(self):
+        """把待写增量用一条UPSERT语句写入数据库"""
+        with self._flush_lock:
+            with self._lock:
+                rows = list(self._pending.values())
+                self._pending = {}
+            if not rows:
+                return
+            
+            started = time.time()
+            try:
+                with self.engine.begin() as conn:
+                    conn.execute(self._upsert, rows)
+            except Exception as e:
+                # 写入失败时把增量合并回去，下次刷新重试
+                self._merge_back(rows)
+                with self._lock:
+                    self.stats['flush_errors'] += 1
+                print(f"✗ 批量更新指纹失败: {e}")
+                return
+            
+            elapsed_ms = (time.time() - started) * 1000
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['rows_flushed'] += len(rows)
+                self.stats['flush_ms_total'] += elapsed_ms
+                if elapsed_ms > self.stats['flush_ms_max']:
+                    self.stats['flush_ms_max'] = elapsed_ms
+    
+    def _merge_back(self, rows):
+        with self._lock:
+            for row in rows:
+                item = self._pending.get(row['base_hash'])
+                if item is None:
+                    self._pending[row['base_hash']] = row
+                    continue
+                item['visit_count'] += row['visit_count']
+                item['first_seen'] = min(item['first_seen'], row['first_seen'])
+                item['last_seen'] = max(item['last_seen'], row['last_seen'])
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
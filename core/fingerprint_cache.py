@@ -0,0 +1,143 @@
+"""
+指纹状态缓存
+地理位置、身份链、评分、封禁判断等阶段反复读取同一指纹的少数几个字段，
+这些字段以精简记录的形式保存在进程内的LRU缓存中，命中时无需查询数据库
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+class FingerprintState:
+    """
+    指纹的精简状态（只包含处理流程需要读写的字段）
+    
+    属性名与Fingerprint模型一致，评分衰减等按属性读取的代码可以直接使用；
+    extra为已解码的extra_data
+    """
+    
+    __slots__ = ('id', 'base_hash', 'threat_score', 'last_score_update', 'identity_chain_id', 'extra')
+    
+    def __init__(self, id, base_hash, threat_score=0, last_score_update=None,
+                 identity_chain_id=None, extra=None):
+        self.id = id
+        self.base_hash = base_hash
+        self.threat_score = threat_score or 0
+        self.last_score_update = last_score_update
+        self.identity_chain_id = identity_chain_id
+        self.extra = extra if extra is not None else {}
+    
+    @classmethod
+    def from_model(cls, fingerprint) -> 'FingerprintState':
+        """从Fingerprint记录创建"""
+        extra = fingerprint.extra_data
+        if isinstance(extra, str):
+            try:
+                extra = json.loads(extra)
+            except ValueError:
+                extra = {}
+        return cls(fingerprint.id, fingerprint.base_hash, fingerprint.threat_score,
+                   fingerprint.last_score_update, fingerprint.identity_chain_id, extra)
+    
+    def copy(self) -> 'FingerprintState':
+        return FingerprintState(self.id, self.base_hash, self.threat_score, self.last_score_update,
+                                self.identity_chain_id, dict(self.extra))
+    
+    def apply(self, values: Dict):
+        """应用对Fingerprint列的修改（extra_data为JSON字符串）"""
+        for column, value in values.items():
+            if column == 'extra_data':
+                self.extra = json.loads(value) if value else {}
+            elif column in self.__slots__:
+                setattr(self, column, value)
+
+
+class FingerprintCache:
+    """
+    指纹状态LRU缓存
+    
+    只保存已提交的状态：工作单元提交成功后写入（write-through），回滚时不写入；
+    不经过工作单元修改指纹的代码调用invalidate()。get()返回副本，调用方修改不影响缓存
+    
+    每次invalidate()递增代数（generation）。工作单元开始时记录代数，写回时代数已变化则放弃写入，
+    避免把invalidate()之前读取的旧状态写回缓存
+    """
+    
+    def __init__(self, max_size: int = 10000):
+        """
+        Args:
+            max_size: 最多缓存的指纹数（超出时淘汰最久未使用的）
+        """
+        self.max_size = max_size
+        self._items: 'OrderedDict[str, FingerprintState]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'puts': 0,
+            'stale_puts': 0,    # 读取后缓存已失效、放弃写入的次数
+            'evictions': 0,
+            'invalidations': 0,
+        }
+    
+    def get(self, base_hash: str) -> Optional[FingerprintState]:
+        """获取指纹状态（未缓存返回None）"""
+        with self._lock:
+            state = self._items.get(base_hash)
+            if state is None:
+                self.stats['misses'] += 1
+                return None
+            self._items.move_to_end(base_hash)
+            self.stats['hits'] += 1
+            return state.copy()
+    
+    def put(self, state: FingerprintState, generation: Optional[int] = None):
+        """
+        写入指纹状态（已提交到数据库的值）
+        
+        Args:
+            state: 指纹状态
+            generation: 读取该状态前记录的代数；之后调用过invalidate()时不写入
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stats['stale_puts'] += 1
+                return
+            self._items[state.base_hash] = state.copy()
+            self._items.move_to_end(state.base_hash)
+            self.stats['puts'] += 1
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, base_hash: Optional[str] = None) -> int:
+        """
+        使缓存失效
+        
+        Args:
+            base_hash: 指纹哈希，None表示清空全部
+        
+        Returns:
+            移除的条数
+        """
+        with self._lock:
+            self.generation += 1
+            if base_hash is None:
+                removed = len(self._items)
+                self._items.clear()
+            else:
+                removed = 1 if self._items.pop(base_hash, None) is not None else 0
+            self.stats['invalidations'] += removed
+            return removed
+    
+    def get_stats(self) -> Dict:
+        """获取缓存统计（含命中率）"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['size'] = len(self._items)
+        stats['max_size'] = self.max_size
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -5,6 +5,7 @@
 import subprocess
 import ipaddress
 import platform
+import threading
 import json
 import re
 from datetime import datetime, timedelta
@@ -12,6 +13,9 @@ from typing import List, Optional, Dict, Tuple
 from dataclasses import dataclass
 import logging
 
+from .clock import Clock, SYSTEM_CLOCK
+from .ip_matcher import IPRangeSet, parse_network
+
 logger = logging.getLogger(__name__)
 
 
@@ -35,10 +39,11 @@ class FirewallExecutor:
     RATE_LIMIT_CHAIN = "FIREWALL_RATE_LIMIT"
     PORT_RULES_CHAIN = "FIREWALL_PORT_RULES"
     
-    def __init__(self, db, config: Dict):
+    def __init__(self, db, config: Dict, clock: Optional[Clock] = None):
         self.db = db
         self.config = config
         self.firewall_config = config.get('firewall', {})
+        self.clock = clock or SYSTEM_CLOCK
         
         # 检测操作系统
         os_type = self.firewall_config.get('os', 'auto')
@@ -50,6 +55,10 @@ class FirewallExecutor:
         self.enabled = self.firewall_config.get('enabled', True)
         self.whitelist = set(self.firewall_config.get('whitelist', []))
         self.blacklist = set(self.firewall_config.get('blacklist', []))
+        # 配置文件和数据库名单编译后的 (白名单, 黑名单)，由reload_lists()整体替换
+        self._lists = (IPRangeSet(self.whitelist), IPRangeSet(self.blacklist))
+        self._lists_lock = threading.Lock()
+        self.reload_lists()
         
         # 如果是Linux，初始化iptables自定义链
         if self.enabled and self.os_type == 'linux':
@@ -72,48 +81,168 @@ class FirewallExecutor:
     # ==================== 白名单/黑名单检查 ====================
     
     def is_whitelisted(self, ip: str) -> bool:
-        """检查IP是否在白名单中"""
-        # 检查配置文件白名单
-        if ip in self.whitelist:
-            return True
+        """检查IP是否在白名单中（配置文件和数据库中的IP/CIDR，不查询数据库）"""
+        return self._lists[0].contains(ip)
+    
+    def is_blacklisted(self, ip: str) -> bool:
+        """检查IP是否在黑名单中（配置文件和数据库中有效的IP/CIDR，不查询数据库）"""
+        return self._lists[1].contains(ip)
+    
+    def reload_lists(self) -> Dict:
+        """
+        从配置文件和数据库重新编译白名单/黑名单，并整体替换
+        
+        Returns:
+            {'whitelist': 区间数, 'blacklist': 区间数, 'invalid': [无效条目]}
+        """
+        from models.database import Whitelist, Blacklist
         
-        # 检查CIDR范围
+        # 串行执行重新加载，避免较早读取的名单覆盖较新的
+        with self._lists_lock:
+            whitelist_entries = list(self.whitelist)
+            blacklist_entries = list(self.blacklist)
+            session = self.db.get_session()
+            try:
+                for ip, cidr in session.query(Whitelist.ip, Whitelist.cidr):
+                    whitelist_entries.append(cidr or ip)
+                for ip, cidr in session.query(Blacklist.ip, Blacklist.cidr).filter(
+                    Blacklist.is_active == True
+                ):
+                    blacklist_entries.append(cidr or ip)
+            except Exception as e:
+                # 数据库不可用时保留当前名单
+                logger.error(f"加载白名单/黑名单失败: {e}")
+                return self.get_list_stats()
+            finally:
+                session.close()
+            
+            lists = (IPRangeSet(whitelist_entries), IPRangeSet(blacklist_entries))
+            self._lists = lists
+        
+        invalid = lists[0].invalid + lists[1].invalid
+        if invalid:
+            logger.warning(f"白名单/黑名单中有无效条目，已忽略: {', '.join(map(str, invalid))}")
+        return self.get_list_stats()
+    
+    def get_list_stats(self) -> Dict:
+        """白名单/黑名单的条目数、合并后的区间数和无效条目"""
+        whitelist, blacklist = self._lists
+        return {
+            'whitelist': {'entries': whitelist.entries, 'ranges': len(whitelist)},
+            'blacklist': {'entries': blacklist.entries, 'ranges': len(blacklist)},
+            'invalid': whitelist.invalid + blacklist.invalid,
+        }
+    
+    def list_entries(self, list_type: str) -> List[Dict]:
+        """
+        获取数据库中的白名单或黑名单条目
+        
+        Args:
+            list_type: whitelist / blacklist
+        """
+        model = self._list_model(list_type)
+        session = self.db.get_session()
         try:
-            ip_obj = ipaddress.ip_address(ip)
-            for cidr in self.whitelist:
-                if '/' in cidr:
-                    network = ipaddress.ip_network(cidr, strict=False)
-                    if ip_obj in network:
-                        return True
-        except:
-            pass
+            items = []
+            for entry in session.query(model).order_by(model.added_at.desc()):
+                item = {
+                    'id': entry.id,
+                    'ip': entry.ip,
+                    'cidr': entry.cidr,
+                    'added_at': entry.added_at.isoformat() if entry.added_at else None,
+                }
+                if list_type == 'whitelist':
+                    item['description'] = entry.description
+                else:
+                    item['reason'] = entry.reason
+                    item['is_active'] = entry.is_active
+                items.append(item)
+            return items
+        finally:
+            session.close()
+    
+    def add_list_entry(self, list_type: str, entry: str, note: str = None) -> str:
+        """
+        向数据库白名单或黑名单添加IP/CIDR，并重新编译名单
+        
+        Args:
+            list_type: whitelist / blacklist
+            entry: IP或CIDR
+            note: 白名单的说明或黑名单的原因
+        
+        Returns:
+            规范化后的条目
+        
+        Raises:
+            ValueError: 无效的名单类型或IP/CIDR
+        """
+        model = self._list_model(list_type)
+        network = parse_network(entry)
+        is_cidr = '/' in str(entry) and network.num_addresses > 1
+        value = str(network) if is_cidr else str(network.network_address)
         
-        # 检查数据库白名单
-        from models.database import Whitelist
         session = self.db.get_session()
         try:
-            exists = session.query(Whitelist).filter(
-                Whitelist.ip == ip
-            ).first()
-            return exists is not None
+            record = session.query(model).filter(model.ip == value).first()
+            if record is None:
+                record = model(ip=value)
+                session.add(record)
+            record.cidr = value if is_cidr else None
+            if list_type == 'whitelist':
+                record.description = note
+            else:
+                record.reason = note
+                record.is_active = True
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
         finally:
             session.close()
+        
+        self.reload_lists()
+        return value
     
-    def is_blacklisted(self, ip: str) -> bool:
-        """检查IP是否在黑名单中"""
-        if ip in self.blacklist:
-            return True
+    def remove_list_entry(self, list_type: str, entry: str) -> bool:
+        """
+        从数据库白名单或黑名单删除条目，并重新编译名单
+        
+        Returns:
+            是否找到并删除了条目
+        
+        Raises:
+            ValueError: 无效的名单类型
+        """
+        model = self._list_model(list_type)
+        try:
+            network = parse_network(entry)
+            is_cidr = '/' in str(entry) and network.num_addresses > 1
+            value = str(network) if is_cidr else str(network.network_address)
+        except ValueError:
+            value = entry
         
-        from models.database import Blacklist
         session = self.db.get_session()
         try:
-            exists = session.query(Blacklist).filter(
-                Blacklist.ip == ip,
-                Blacklist.is_active == True
-            ).first()
-            return exists is not None
+            deleted = session.query(model).filter(model.ip == value).delete()
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
         finally:
             session.close()
+        
+        if deleted:
+            self.reload_lists()
+        return bool(deleted)
+    
+    @staticmethod
+    def _list_model(list_type: str):
+        from models.database import Whitelist, Blacklist
+        if list_type == 'whitelist':
+            return Whitelist
+        if list_type == 'blacklist':
+            return Blacklist
+        raise ValueError(f"未知的名单类型: {list_type}（可选: whitelist, blacklist）")
     
     # ==================== 初始化 ====================
     
@@ -182,7 +311,8 @@ class FirewallExecutor:
     
     def ban_ip(self, ip: str, reason: str = "Manual ban", 
                duration_seconds: Optional[int] = None,
-               threat_event_id: Optional[int] = None) -> bool:
+               threat_event_id: Optional[int] = None,
+               uow=None) -> bool:
         """
         封禁IP地址（兼容新旧接口）
         
@@ -191,6 +321,7 @@ class FirewallExecutor:
             reason: 封禁原因
             duration_seconds: 封禁时长（秒），None表示永久
             threat_event_id: 威胁事件ID（可选）
+            uow: 工作单元（传入时封禁记录由工作单元统一提交）
             
         Returns:
             是否成功
@@ -202,7 +333,7 @@ class FirewallExecutor:
         
         if not self.enabled:
             logger.info(f"防火墙未启用，仅记录数据库: {ip}")
-            self._save_ban_record(ip, reason, duration_seconds, threat_event_id)
+            self._save_ban_record(ip, reason, duration_seconds, threat_event_id, uow)
             return True
         
         try:
@@ -225,7 +356,7 @@ class FirewallExecutor:
             
             if success:
                 # 保存到数据库
-                self._save_ban_record(ip, reason, duration_seconds, threat_event_id)
+                self._save_ban_record(ip, reason, duration_seconds, threat_event_id, uow)
                 print(f"✓ 成功封禁 IP: {ip} (原因: {reason})")
                 return True
             else:
@@ -768,19 +899,21 @@ class FirewallExecutor:
         """格式化iptables注释"""
         comment = f"Firewall: {reason[:40]}"
         if duration:
-            expires_at = datetime.now() + timedelta(seconds=duration)
+            expires_at = self.clock.now() + timedelta(seconds=duration)
             comment += f" | Expires: {expires_at.strftime('%Y-%m-%d %H:%M')}"
         return comment
     
-    def _save_ban_record(self, ip: str, reason: str, duration: Optional[int], threat_event_id: Optional[int] = None):
-        """保存封禁记录到数据库"""
+    def _save_ban_record(self, ip: str, reason: str, duration: Optional[int], threat_event_id: Optional[int] = None,
+                         uow=None):
+        """保存封禁记录到数据库（传入工作单元时不单独提交）"""
         from models.database import BanRecord
         
-        session = self.db.get_session()
+        session = uow.session if uow else self.db.get_session()
         try:
+            now = self.clock.now()
             ban_until = None
             if duration:
-                ban_until = datetime.now() + timedelta(seconds=duration)
+                ban_until = now + timedelta(seconds=duration)
             
             # 检查是否已有活跃的封禁记录
             existing_ban = session.query(BanRecord).filter(
@@ -792,7 +925,7 @@ class FirewallExecutor:
                 # 更新现有记录
                 existing_ban.ban_count += 1
                 existing_ban.reason = reason
-                existing_ban.banned_at = datetime.now()
+                existing_ban.banned_at = now
                 existing_ban.ban_until = ban_until
                 if threat_event_id:
                     existing_ban.threat_event_id = threat_event_id
@@ -801,7 +934,7 @@ class FirewallExecutor:
                 ban_record = BanRecord(
                     ip=ip,
                     reason=reason,
-                    banned_at=datetime.now(),
+                    banned_at=now,
                     ban_until=ban_until,
                     is_permanent=(duration is None),
                     is_active=True,
@@ -810,12 +943,16 @@ class FirewallExecutor:
                 )
                 session.add(ban_record)
             
-            session.commit()
+            if not uow:
+                session.commit()
         except Exception as e:
+            if uow:
+                raise
             logger.error(f"保存封禁记录失败: {e}")
             session.rollback()
         finally:
-            session.close()
+            if not uow:
+                session.close()
     
     def _update_ban_record(self, ip: str, unbanned: bool = False):
         """更新封禁记录"""
@@ -831,7 +968,7 @@ class FirewallExecutor:
             if ban_record:
                 if unbanned:
                     ban_record.is_active = False
-                    ban_record.unbanned_at = datetime.now()
+                    ban_record.unbanned_at = self.clock.now()
                 
                 session.commit()
         except Exception as e:
@@ -886,7 +1023,7 @@ class FirewallExecutor:
             expired_bans = session.query(BanRecord).filter(
                 BanRecord.is_active == True,
                 BanRecord.is_permanent == False,
-                BanRecord.ban_until < datetime.now()
+                BanRecord.ban_until < self.clock.now()
             ).all()
             
             for ban in expired_bans:
@@ -92,10 +92,15 @@ class GeoAnalyzer:
             print(f"地理位置查询失败 ({ip}): {e}")
             return None
     
-    def check_geo_anomaly(self, ip: str, base_hash: str) -> Tuple[bool, Optional[str], Optional[int]]:
+    def check_geo_anomaly(self, ip: str, base_hash: str, uow=None) -> Tuple[bool, Optional[str], Optional[int]]:
         """
         检测地理位置异常
         
+        Args:
+            ip: IP地址
+            base_hash: 基础指纹哈希
+            uow: 工作单元（传入时使用缓存的指纹状态）
+        
         Returns:
             (is_anomaly, reason, score)
         """
@@ -112,18 +117,24 @@ class GeoAnalyzer:
         
         # 获取历史地理位置
         from models.database import Fingerprint
-        session = self.db.get_session()
+        session = None if uow else self.db.get_session()
         try:
-            fingerprint = session.query(Fingerprint).filter(
-                Fingerprint.base_hash == base_hash
-            ).first()
+            if uow:
+                state = uow.get_state(base_hash)
+                extra_data = state.extra if state else None
+            else:
+                import json
+                fingerprint = session.query(Fingerprint).filter(
+                    Fingerprint.base_hash == base_hash
+                ).first()
+                extra_data = fingerprint.extra_data if fingerprint else None
+                if isinstance(extra_data, str):
+                    extra_data = json.loads(extra_data)
             
-            if not fingerprint or not fingerprint.extra_data:
+            if not extra_data:
                 # 首次访问，保存地理位置
                 return False, None, None
             
-            import json
-            extra_data = json.loads(fingerprint.extra_data) if isinstance(fingerprint.extra_data, str) else fingerprint.extra_data
             last_location = extra_data.get('last_location')
             
             if not last_location:
@@ -151,7 +162,8 @@ class GeoAnalyzer:
             return False, None, None
             
         finally:
-            session.close()
+            if session:
+                session.close()
     
     def _calculate_distance(self, lat1, lon1, lat2, lon2) -> Optional[float]:
         """计算两点之间的距离（km）"""
@@ -173,11 +185,20 @@ class GeoAnalyzer:
         
         return R * c
     
-    def update_location_metadata(self, base_hash: str, location: Dict):
-        """更新指纹的地理位置元数据"""
+    def update_location_metadata(self, base_hash: str, location: Dict, uow=None):
+        """更新指纹的地理位置元数据（传入工作单元时由工作单元统一提交）"""
         from models.database import Fingerprint
         import json
         
+        if uow:
+            state = uow.get_state(base_hash)
+            if state:
+                extra_data = dict(state.extra)
+                extra_data['last_location'] = location
+                extra_data['location_updated_at'] = datetime.now().isoformat()
+                uow.update_state(base_hash, extra_data=json.dumps(extra_data))
+            return
+        
         session = self.db.get_session()
         try:
             fingerprint = session.query(Fingerprint).filter(
@@ -190,6 +211,7 @@ class GeoAnalyzer:
                 extra_data['location_updated_at'] = datetime.now().isoformat()
                 fingerprint.extra_data = json.dumps(extra_data)
                 session.commit()
+                self.db.invalidate_fingerprint_cache(base_hash)
         except Exception as e:
             session.rollback()
             print(f"更新地理位置元数据失败: {e}")
@@ -3,10 +3,11 @@
 管理指纹的演变和关联关系
 """
 import json
-from datetime import datetime
 from typing import List, Dict, Optional, Any
 from models.database import IdentityChain, Fingerprint, AccessLog
 
+from .clock import Clock, SYSTEM_CLOCK
+
 
 class IdentityChainManager:
     """
@@ -18,18 +19,20 @@ class IdentityChainManager:
     3. 维护身份链的演变历史
     """
     
-    def __init__(self, db, config: Dict, fingerprint_gen):
+    def __init__(self, db, config: Dict, fingerprint_gen, clock: Optional[Clock] = None):
         self.db = db
         self.config = config
         self.fingerprint_gen = fingerprint_gen
+        self.clock = clock or SYSTEM_CLOCK
     
-    def check_and_create_chain(self, base_hash: str, behavior_analysis: Dict) -> Optional[int]:
+    def check_and_create_chain(self, base_hash: str, behavior_analysis: Dict, uow=None) -> Optional[int]:
         """
         检查是否需要为该基础指纹创建身份链
         
         Args:
             base_hash: 基础指纹哈希
             behavior_analysis: 行为分析结果
+            uow: 工作单元（传入时复用其会话和缓存的指纹状态，由工作单元统一提交）
             
         Returns:
             创建的身份链ID，如果不需要创建则返回None
@@ -37,45 +40,70 @@ class IdentityChainManager:
         if not behavior_analysis.get('should_create_chain'):
             return None
         
-        session = self.db.get_session()
+        session = uow.session if uow else self.db.get_session()
+        created = False
         try:
             # 检查该指纹是否已经属于某个身份链
-            fingerprint = session.query(Fingerprint).filter(
-                Fingerprint.base_hash == base_hash
-            ).first()
+            if uow:
+                fingerprint = uow.get_state(base_hash)
+            else:
+                fingerprint = session.query(Fingerprint).filter(
+                    Fingerprint.base_hash == base_hash
+                ).first()
             
             if fingerprint and fingerprint.identity_chain_id:
                 # 已经在身份链中，更新该链
-                return self._update_existing_chain(
+                chain_id = self._update_existing_chain(
                     session, 
                     fingerprint.identity_chain_id,
                     base_hash,
                     behavior_analysis
                 )
             else:
-                # 创建新的身份链
-                return self._create_new_chain(
+                # 创建新的身份链（需要修改完整的指纹记录）
+                if uow:
+                    fingerprint = uow.get_fingerprint(base_hash)
+                chain_id = self._create_new_chain(
                     session,
                     base_hash,
-                    behavior_analysis
+                    behavior_analysis,
+                    fingerprint
                 )
+                created = True
+            
+            # 启用写缓冲时，新建链与访问日志的关联在提交后由写入器完成（包括缓冲中尚未写入的行）
+            writer = getattr(self.db, 'access_log_writer', None) if created else None
+            log_values = {'identity_chain_id': chain_id}
+            if uow:
+                if writer is not None:
+                    uow.after_commit(writer.update_rows, 'base_hash', base_hash, log_values)
+            else:
+                session.commit()
+                self.db.invalidate_fingerprint_cache(base_hash)
+                if writer is not None:
+                    writer.update_rows('base_hash', base_hash, log_values)
+            return chain_id
         finally:
-            session.close()
+            if not uow:
+                session.close()
     
-    def _create_new_chain(self, session, base_hash: str, analysis: Dict) -> int:
-        """创建新的身份链"""
+    def _create_new_chain(self, session, base_hash: str, analysis: Dict, fingerprint=None) -> int:
+        """创建新的身份链（由调用方提交）"""
         
         # 生成身份链的根哈希
         root_hash = self.fingerprint_gen.generate_identity_hash([base_hash])
+        now = self.clock.now()
         
         # 创建身份链记录
         chain = IdentityChain(
             root_hash=root_hash,
+            created_at=now,
+            updated_at=now,
             fingerprint_count=1,
             total_visits=analysis.get('log_count', 0),
             evolution_history=json.dumps([{
                 'hash': base_hash,
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': now.isoformat(),
                 'reason': analysis.get('reason'),
                 'unique_behaviors': analysis.get('unique_behaviors'),
                 'behavior_diversity': analysis.get('behavior_diversity')
@@ -86,9 +114,10 @@ class IdentityChainManager:
         session.flush()  # 获取ID
         
         # 更新指纹记录，关联到身份链
-        fingerprint = session.query(Fingerprint).filter(
-            Fingerprint.base_hash == base_hash
-        ).first()
+        if fingerprint is None:
+            fingerprint = session.query(Fingerprint).filter(
+                Fingerprint.base_hash == base_hash
+            ).first()
         
         if fingerprint:
             fingerprint.identity_chain_id = chain.id
@@ -114,17 +143,16 @@ class IdentityChainManager:
                 )
                 session.add(new_fingerprint)
         
-        # 更新相关的访问日志
-        session.query(AccessLog).filter(
-            AccessLog.base_hash == base_hash
-        ).update({'identity_chain_id': chain.id})
-        
-        session.commit()
+        # 更新相关的访问日志（启用写缓冲时由调用方在提交后通过写入器更新）
+        if getattr(self.db, 'access_log_writer', None) is None:
+            session.query(AccessLog).filter(
+                AccessLog.base_hash == base_hash
+            ).update({'identity_chain_id': chain.id})
         
         return chain.id
     
     def _update_existing_chain(self, session, chain_id: int, new_hash: str, analysis: Dict) -> int:
-        """更新现有的身份链"""
+        """更新现有的身份链（由调用方提交）"""
         
         chain = session.query(IdentityChain).filter(
             IdentityChain.id == chain_id
@@ -137,7 +165,7 @@ class IdentityChainManager:
         history = json.loads(chain.evolution_history) if chain.evolution_history else []
         history.append({
             'hash': new_hash,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': self.clock.now().isoformat(),
             'reason': 'behavior_continued_evolution',
             'unique_behaviors': analysis.get('unique_behaviors'),
             'behavior_diversity': analysis.get('behavior_diversity')
@@ -151,11 +179,9 @@ class IdentityChainManager:
         chain.root_hash = new_root_hash
         chain.evolution_history = json.dumps(history)
         chain.fingerprint_count = len(all_hashes)
-        chain.updated_at = datetime.now()
+        chain.updated_at = self.clock.now()
         chain.description = f"身份链更新: {len(all_hashes)}个关联指纹"
         
-        session.commit()
-        
         return chain.id
     
     def get_chain_info(self, chain_id: int) -> Optional[Dict]:
@@ -235,7 +261,7 @@ class IdentityChainManager:
             chain1.fingerprint_count = len(all_hashes)
             chain1.total_visits = chain1.total_visits + chain2.total_visits
             chain1.threat_score = max(chain1.threat_score, chain2.threat_score)
-            chain1.updated_at = datetime.now()
+            chain1.updated_at = self.clock.now()
             chain1.description = f"合并身份链: {len(all_hashes)}个关联指纹"
             
             # 将第二个链的所有指纹和日志转移到第一个链
@@ -256,6 +282,11 @@ class IdentityChainManager:
             session.delete(chain2)
             
             session.commit()
+            self.db.invalidate_fingerprint_cache()
+            # 写缓冲中尚未写入的访问日志也转移到第一个链
+            writer = getattr(self.db, 'access_log_writer', None)
+            if writer is not None:
+                writer.update_rows('identity_chain_id', chain_id2, {'identity_chain_id': chain_id1})
             return chain1.id
         except Exception as e:
             session.rollback()
@@ -0,0 +1,212 @@
+"""
+日志接入队列
+在日志读取与处理流程之间加入有界队列：数据库等下游变慢时读取不会被拖住，
+队列满时按配置的策略施加背压或丢弃正常流量，可疑日志始终保留
+"""
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+
+# 过载策略
+POLICY_BLOCK = 'block'              # 队列满时阻塞读取（背压），不丢弃任何日志
+POLICY_DROP_BENIGN = 'drop_benign'  # 队列满时丢弃正常日志，可疑日志阻塞等待入队
+POLICY_SAMPLE = 'sample'            # 队列超过高水位时按比例采样正常日志
+
+POLICIES = (POLICY_BLOCK, POLICY_DROP_BENIGN, POLICY_SAMPLE)
+
+
+class IngestQueue:
+    """
+    有界日志接入队列
+    
+    读取线程调用put()放入解析后的日志，处理线程将积压的日志合并成批交给下游；
+    is_protected判定为可疑的日志（4xx/5xx、命中恶意UA等）在任何策略下都不会被丢弃
+    """
+    
+    def __init__(self, batch_callback: Callable,
+                 max_size: int = 50000,
+                 policy: str = POLICY_BLOCK,
+                 sample_rate: float = 0.1,
+                 high_watermark: float = 0.8,
+                 max_batch: int = 5000,
+                 is_protected: Optional[Callable[[Dict], bool]] = None):
+        """
+        Args:
+            batch_callback: 下游批量处理函数，接收日志列表
+            max_size: 队列中最多等待处理的日志条数
+            policy: 过载策略 block / drop_benign / sample
+            sample_rate: sample策略下超过高水位后正常日志的保留比例（0~1）
+            high_watermark: sample策略开始采样的队列深度（占max_size的比例）
+            max_batch: 每次交给下游的最大条数
+            is_protected: 判断日志是否可疑（不可丢弃）的函数，None表示全部视为正常
+        
+        Raises:
+            ValueError: 未知的过载策略
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"未知的接入队列策略: {policy}（可选: {', '.join(POLICIES)}）")
+        
+        self.batch_callback = batch_callback
+        self.max_size = max_size
+        self.policy = policy
+        self.sample_rate = sample_rate
+        self.high_watermark = int(max_size * high_watermark)
+        self.max_batch = max_batch
+        self.is_protected = is_protected
+        self.running = False
+        
+        # 开始丢弃或采样正常日志的队列深度（block策略从不丢弃）
+        if policy == POLICY_SAMPLE:
+            self._shed_depth = self.high_watermark
+        elif policy == POLICY_DROP_BENIGN:
+            self._shed_depth = max_size
+        else:
+            self._shed_depth = float('inf')
+        
+        # 队列元素: (入队时间, 日志)
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        
+        self.stats = {
+            'enqueued': 0,          # 入队的日志条数
+            'processed': 0,         # 已交给下游的日志条数
+            'batches': 0,           # 交给下游的批次数
+            'dropped': 0,           # 队列满被丢弃的正常日志条数
+            'sampled_out': 0,       # 采样时被丢弃的正常日志条数
+            'protected': 0,         # 过载时因可疑而保留的日志条数
+            'max_depth': 0,         # 队列最大深度
+            'blocked_count': 0,     # 读取线程因队列满而等待的次数
+            'blocked_ms_total': 0.0,
+            'blocked_ms_max': 0.0,
+            'wait_samples': 0,
+            'wait_ms_total': 0.0,   # 日志在队列中的等待时间（累计）
+            'wait_ms_max': 0.0,
+        }
+    
+    def get_stats(self) -> Dict:
+        """获取队列统计（含当前深度和平均等待时间）"""
+        with self._cond:
+            stats = dict(self.stats)
+            stats['depth'] = len(self._queue)
+        stats['capacity'] = self.max_size
+        stats['policy'] = self.policy
+        samples = stats['wait_samples']
+        stats['wait_ms_avg'] = stats['wait_ms_total'] / samples if samples else 0.0
+        blocked = stats['blocked_count']
+        stats['blocked_ms_avg'] = stats['blocked_ms_total'] / blocked if blocked else 0.0
+        return stats
+    
+    def start(self):
+        """启动处理线程"""
+        self.running = True
+        self._thread = threading.Thread(target=self._process_loop, name='ingest-worker', daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout: float = 10.0):
+        """
+        停止处理线程（先处理完队列中剩余的日志）
+        
+        Args:
+            timeout: 等待剩余日志处理完成的最长时间（秒）
+        """
+        self.running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+    
+    # ==================== 入队（读取线程） ====================
+    
+    def put(self, entries: List[Dict]):
+        """
+        放入一批解析后的日志
+        
+        block策略下队列满时阻塞直到有空间；其他策略下只有可疑日志会等待，
+        正常日志按策略丢弃或采样
+        """
+        now = time.time()
+        added = 0
+        with self._cond:
+            for entry in entries:
+                if len(self._queue) >= self._shed_depth and not self._admit(entry):
+                    continue
+                if len(self._queue) >= self.max_size:
+                    now = self._wait_for_room()
+                self._queue.append((now, entry))
+                added += 1
+            
+            self.stats['enqueued'] += added
+            if len(self._queue) > self.stats['max_depth']:
+                self.stats['max_depth'] = len(self._queue)
+            self._cond.notify_all()
+    
+    def put_one(self, entry: Dict):
+        """放入单条日志（非分块读取模式）"""
+        self.put([entry])
+    
+    def _admit(self, entry: Dict) -> bool:
+        """过载时决定是否保留一条日志（调用时持有锁）"""
+        if self.is_protected and self.is_protected(entry):
+            self.stats['protected'] += 1
+            return True
+        
+        # 正常日志过载时不等待：sample按比例保留（队列满时同样丢弃），drop_benign直接丢弃
+        if self.policy == POLICY_SAMPLE:
+            if len(self._queue) < self.max_size and random.random() < self.sample_rate:
+                return True
+            self.stats['sampled_out'] += 1
+            return False
+        
+        self.stats['dropped'] += 1
+        return False
+    
+    def _wait_for_room(self) -> float:
+        """等待队列出现空间（调用时持有锁），返回等待结束的时间"""
+        started = time.time()
+        while len(self._queue) >= self.max_size and self.running:
+            self._cond.wait(0.5)
+        now = time.time()
+        
+        blocked_ms = (now - started) * 1000
+        self.stats['blocked_count'] += 1
+        self.stats['blocked_ms_total'] += blocked_ms
+        if blocked_ms > self.stats['blocked_ms_max']:
+            self.stats['blocked_ms_max'] = blocked_ms
+        return now
+    
+    # ==================== 处理（工作线程） ====================
+    
+    def _process_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and self.running:
+                    self._cond.wait(0.5)
+                if not self._queue:
+                    return
+                
+                count = min(len(self._queue), self.max_batch)
+                items = [self._queue.popleft() for _ in range(count)]
+                self._cond.notify_all()
+            
+            self._record_wait(items)
+            try:
+                self.batch_callback([entry for _, entry in items])
+            except Exception as e:
+                print(f"批量处理日志时出错: {e}")
+            
+            self.stats['processed'] += count
+            self.stats['batches'] += 1
+    
+    def _record_wait(self, items: list):
+        """记录日志在队列中的等待时间"""
+        now = time.time()
+        wait_ms = (now - items[0][0]) * 1000
+        self.stats['wait_samples'] += len(items)
+        self.stats['wait_ms_total'] += sum((now - queued) * 1000 for queued, _ in items)
+        if wait_ms > self.stats['wait_ms_max']:
+            self.stats['wait_ms_max'] = wait_ms
@@ -0,0 +1,134 @@
+"""
+Linux inotify封装
+通过ctypes直接调用libc，不依赖第三方库
+"""
+import ctypes
+import ctypes.util
+import errno
+import math
+import os
+import select
+import struct
+import sys
+from typing import List, Optional, Tuple
+
+
+# 事件掩码（见 <sys/inotify.h>）
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_libc = None
+
+
+def _load_libc():
+    """加载libc并声明inotify函数签名"""
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+
+def is_available() -> bool:
+    """当前平台是否支持inotify"""
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        libc = _load_libc()
+        return hasattr(libc, 'inotify_init1')
+    except (OSError, AttributeError):
+        return False
+
+
+class Inotify:
+    """inotify实例，持有一个inotify文件描述符"""
+
+    def __init__(self):
+        libc = _load_libc()
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1失败: {os.strerror(err)}")
+        self.fd = fd
+        self._libc = libc
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """添加监视，返回watch描述符"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch失败 ({path}): {os.strerror(err)}")
+        return wd
+
+    def rm_watch(self, wd: int):
+        """移除监视（监视已失效时忽略错误）"""
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: Optional[float] = None,
+                    extra_fds: Tuple[int, ...] = ()) -> List[Tuple[int, int, int, str]]:
+        """
+        等待并读取事件
+
+        Args:
+            timeout: 超时时间（秒），None表示一直等待
+            extra_fds: 额外等待的文件描述符（可读时同样唤醒，用于停止信号）
+
+        Returns:
+            事件列表 [(wd, mask, cookie, name), ...]，超时或被额外fd唤醒时可能为空
+        """
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        for fd in extra_fds:
+            poller.register(fd, select.POLLIN)
+
+        try:
+            ready = poller.poll(None if timeout is None else math.ceil(timeout * 1000))
+        except InterruptedError:
+            return []
+
+        if not any(fd == self.fd for fd, _ in ready):
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_len = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos:pos + name_len].rstrip(b'\0').decode('utf-8', errors='ignore')
+            pos += name_len
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
@@ -0,0 +1,101 @@
+"""
+IP地址集合匹配
+把IP和CIDR条目编译为按起始地址排序、互不重叠的整数区间，
+查询时对IPv4/IPv6各自的区间做二分查找，时间复杂度O(log n)
+"""
+import ipaddress
+from bisect import bisect_right
+from typing import Iterable, List, Optional, Tuple, Union
+
+
+def parse_network(entry: str):
+    """
+    解析IP或CIDR条目
+    
+    Args:
+        entry: 如 '10.0.0.1'、'10.0.0.0/8'、'2001:db8::/32'（CIDR的主机位会被忽略）
+    
+    Returns:
+        ipaddress.IPv4Network / IPv6Network
+    
+    Raises:
+        ValueError: 无效的IP或CIDR
+    """
+    return ipaddress.ip_network(str(entry).strip(), strict=False)
+
+
+class IPRangeSet:
+    """
+    不可变的IP区间集合
+    
+    构建后不再修改；名单变化时构建新的集合整体替换（引用赋值是原子的，
+    查询线程总是看到完整的旧集合或新集合）
+    """
+    
+    __slots__ = ('_starts', '_ends', 'entries', 'invalid')
+    
+    def __init__(self, entries: Iterable[str] = ()):
+        """
+        Args:
+            entries: IP或CIDR条目（无效条目被跳过，记录在invalid中）
+        """
+        ranges = {4: [], 6: []}
+        self.entries = 0
+        self.invalid: List[str] = []
+        for entry in entries:
+            if not entry:
+                continue
+            try:
+                network = parse_network(entry)
+            except ValueError:
+                self.invalid.append(entry)
+                continue
+            ranges[network.version].append(
+                (int(network.network_address), int(network.broadcast_address))
+            )
+            self.entries += 1
+        
+        self._starts = {}
+        self._ends = {}
+        for version, items in ranges.items():
+            self._starts[version], self._ends[version] = self._merge(items)
+    
+    @staticmethod
+    def _merge(ranges: List[Tuple[int, int]]) -> Tuple[List[int], List[int]]:
+        """合并重叠或相邻的区间"""
+        starts, ends = [], []
+        for start, end in sorted(ranges):
+            if ends and start <= ends[-1] + 1:
+                if end > ends[-1]:
+                    ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+        return starts, ends
+    
+    def __len__(self) -> int:
+        """合并后的区间数"""
+        return len(self._starts[4]) + len(self._starts[6])
+    
+    def __contains__(self, ip: str) -> bool:
+        return self.contains(ip)
+    
+    def contains(self, ip: str) -> bool:
+        """IP是否落在集合中（无效IP返回False）"""
+        address = self._parse_address(ip)
+        if address is None:
+            return False
+        starts = self._starts[address.version]
+        index = bisect_right(starts, int(address)) - 1
+        return index >= 0 and int(address) <= self._ends[address.version][index]
+    
+    @staticmethod
+    def _parse_address(ip: str) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        # IPv4映射的IPv6地址（::ffff:1.2.3.4）按IPv4匹配
+        if address.version == 6 and address.ipv4_mapped:
+            return address.ipv4_mapped
+        return address
@@ -4,11 +4,24 @@ Nginx日志监控模块
 """
 import re
 import os
+import glob
+import fnmatch
 import time
-from datetime import datetime
-from typing import Dict, Optional, Callable
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Callable
 from urllib.parse import urlparse, parse_qs
 import json
+import weakref
+
+from . import inotify
+from .checkpoint import OffsetCheckpoint, hash_line
+from .log_source import expand_log_paths, PipelinedLineReader
+from .log_format import CompiledLogFormat, JsonLogFormat
+
+
+MONTHS = {name: i for i, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
 
 
 class NginxLogParser:
@@ -29,12 +42,38 @@ class NginxLogParser:
         r'(?P<request_time>[\d\.]+)'
     )
     
-    def __init__(self, log_format: str = 'combined'):
+    # 时间戳缓存上限（日志按时间顺序到达，同一秒的日志共享一次解析结果）
+    TIME_CACHE_SIZE = 1024
+    
+    def __init__(self, log_format: str = 'combined', json_fields: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            log_format: 'combined'、'custom'、'json'（nginx escape=json输出），
+                        或nginx配置中的log_format字符串（包含$变量时在此编译为字段提取器）
+            json_fields: json格式下输出字段到JSON键的映射（默认JSON键为nginx变量名）
+        """
         self.log_format = log_format
         if log_format == 'custom':
             self.pattern = self.CUSTOM_PATTERN
         else:
             self.pattern = self.COMBINED_PATTERN
+        
+        if log_format == 'json':
+            self.compiled = JsonLogFormat(json_fields)
+        elif '$' in log_format:
+            self.compiled = CompiledLogFormat(log_format)
+        else:
+            self.compiled = None
+        self._time_cache = OrderedDict()
+        self._last_time = None
+        
+        # 解析统计
+        self.stats = {
+            'timestamp_fallbacks': 0,   # 时间无法解析、沿用上一条日志时间的行数
+        }
+        if self.compiled:
+            self.stats['unmatched_lines'] = 0                           # 与log_format不匹配的行数
+            self.stats['field_failures'] = self.compiled.field_failures  # 各变量类型转换失败次数
     
     def parse_line(self, line: str) -> Optional[Dict]:
         """
@@ -51,17 +90,128 @@ class NginxLogParser:
             - referer: Referer
             - response_size: 响应大小
             - request_time: 请求时间（如果有）
-            - timestamp: 时间戳
+            - timestamp: 时间戳（UTC，带时区）
+            - epoch: 时间戳对应的epoch秒数
+            - time_estimated: 日志时间无法解析、使用估计时间时为True（不推进检测的水位线）
             - raw_log: 原始日志行
         """
-        match = self.pattern.match(line.strip())
+        line = line.strip()
+        if self.compiled:
+            fields = self.compiled.extract(line)
+            if fields is None:
+                if line:
+                    self.stats['unmatched_lines'] += 1
+                return None
+            return self._build_from_fields(line, fields)
+        
+        fields = self._split_fields(line)
+        if fields is None:
+            # 快速切分无法处理的行（字段中含有分隔符等），交给正则解析
+            return self.parse_line_regex(line)
+        return self._build_entry(line, *fields)
+    
+    def parse_line_regex(self, line: str) -> Optional[Dict]:
+        """使用正则表达式解析单行日志（快速切分的后备，也用于校验其结果）"""
+        line = line.strip()
+        match = self.pattern.match(line)
         if not match:
             return None
         
         data = match.groupdict()
+        return self._build_entry(line, data.get('ip'), data.get('time', ''), data.get('request', ''),
+                                 data.get('status', '0'), data.get('size', '0'), data.get('referer', ''),
+                                 data.get('user_agent', ''), data.get('request_time'))
+    
+    def _split_fields(self, line: str) -> Optional[tuple]:
+        """
+        按固定分隔符切分combined/custom格式的日志行，不使用回溯正则
+        
+        Returns:
+            (ip, time, request, status, size, referer, user_agent, request_time)，
+            行结构不是常规形式时返回None（由正则解析兜底）
+        """
+        # 常规行恰好有6个引号：按引号切分一次即可得到全部字段
+        parts = line.split('"')
+        if len(parts) == 7 and parts[4] == ' ':
+            head, request, middle, referer, _, user_agent, tail = parts
+            end = head.find(' - ')
+            start = head.find(' [', end + 3)
+            numbers = middle[1:-1].split(' ')
+            if (end > 0 and start > 0 and head[-2:] == '] ' and middle[:1] == ' '
+                    and middle[-1:] == ' ' and len(numbers) == 2):
+                ip = head[:end]
+                status, size = numbers
+                if (not ip.strip('0123456789.') and status.isdecimal()
+                        and (size == '-' or size.isdecimal())):
+                    if self.log_format != 'custom':
+                        return ip, head[start + 2:-2], request, status, size, referer, user_agent, None
+                    if tail[:1] == ' ':
+                        request_time = tail[1:].split(' ', 1)[0]
+                        if request_time and not request_time.strip('0123456789.'):
+                            return (ip, head[start + 2:-2], request, status, size, referer,
+                                    user_agent, request_time)
+        # 不是常规形式时按分隔符逐个查找（常规行两种方式的结果相同）
+        return self._scan_fields(line)
+    
+    def _scan_fields(self, line: str) -> Optional[tuple]:
+        """按分隔符逐个查找切分日志行（字段中含有引号等情况）"""
+        end = line.find(' - ')
+        if end <= 0:
+            return None
+        ip = line[:end]
+        if ip.strip('0123456789.'):
+            return None
+        
+        start = line.find(' [', end + 3)
+        if start < 0:
+            return None
+        end = line.find('] "', start + 2)
+        if end < 0:
+            return None
+        time_str = line[start + 2:end]
+        
+        # 请求行中可能含有引号，取第一个后面紧跟 "状态码 大小 "" 的引号
+        start = end + 3
+        end = line.find('" ', start)
+        if end < 0:
+            return None
+        request = line[start:end]
         
+        rest = line[end + 2:].split(' ', 2)
+        if len(rest) < 3:
+            return None
+        status, size, rest = rest
+        if not status.isdecimal() or not (size == '-' or size.isdecimal()) or rest[:1] != '"':
+            return None
+        
+        end = rest.find('" "', 1)
+        if end < 0:
+            return None
+        referer = rest[1:end]
+        
+        start = end + 3
+        if self.log_format == 'custom':
+            end = rest.find('" ', start)
+            if end < 0:
+                return None
+            user_agent = rest[start:end]
+            request_time = rest[end + 2:].split(' ', 1)[0]
+            if not request_time or request_time.strip('0123456789.'):
+                return None
+        else:
+            end = rest.find('"', start)
+            if end < 0:
+                return None
+            user_agent = rest[start:end]
+            request_time = None
+        
+        return ip, time_str, request, status, size, referer, user_agent, request_time
+    
+    def _build_entry(self, line: str, ip: str, time_str: str, request: str, status: str,
+                     size: str, referer: str, user_agent: str,
+                     request_time: Optional[str]) -> Dict:
+        """根据切分出的字段构建日志字典"""
         # 解析请求行
-        request = data.get('request', '')
         request_parts = request.split(' ', 2)
         
         if len(request_parts) >= 2:
@@ -72,54 +222,284 @@ class NginxLogParser:
             full_path = request
         
         # 分离路径和查询参数
-        parsed_url = urlparse(full_path)
-        path = parsed_url.path
-        query_params = dict(parse_qs(parsed_url.query))
-        
-        # 解析时间
-        time_str = data.get('time', '')
-        try:
-            # Nginx时间格式: 17/Oct/2025:18:30:00 +0800
-            timestamp = datetime.strptime(time_str.split(' ')[0], '%d/%b/%Y:%H:%M:%S')
-        except:
-            timestamp = datetime.now()
-        
-        # 处理响应大小
-        size = data.get('size', '0')
-        if size == '-':
-            size = 0
-        else:
-            size = int(size)
+        path, query = self._split_url(full_path)
+        query_params = dict(parse_qs(query)) if query else None
+        timestamp, epoch, time_estimated = self._parse_time(time_str)
         
         return {
-            'ip': data.get('ip'),
-            'user_agent': data.get('user_agent', ''),
+            'ip': ip,
+            'user_agent': user_agent,
             'request_method': method,
             'request_path': path,
             'query_params': json.dumps(query_params) if query_params else '',
-            'status_code': int(data.get('status', 0)),
-            'referer': data.get('referer', ''),
-            'response_size': size,
-            'request_time': float(data.get('request_time', 0)) if 'request_time' in data else 0,
+            'status_code': int(status),
+            'referer': referer,
+            'response_size': 0 if size == '-' else int(size),
+            'request_time': float(request_time) if request_time is not None else 0,
             'timestamp': timestamp,
-            'raw_log': line.strip()
+            'epoch': epoch,
+            'time_estimated': time_estimated,
+            'raw_log': line
         }
+    
+    def _build_from_fields(self, line: str, fields: Dict) -> Dict:
+        """根据log_format提取出的字段构建日志字典（格式中的额外变量原样保留）"""
+        request = fields.pop('request', None)
+        if request is not None:
+            request_parts = request.split(' ', 2)
+            if len(request_parts) >= 2:
+                method = request_parts[0]
+                path, query = self._split_url(request_parts[1])
+            else:
+                method = 'UNKNOWN'
+                path, query = self._split_url(request)
+        else:
+            method = fields.get('request_method', 'UNKNOWN')
+            if 'uri' in fields:
+                # 已分别记录$uri和$args时无需再解析URL
+                path = fields['uri']
+                query = fields.get('args', '')
+                if query == '-':
+                    query = ''
+            else:
+                path, query = self._split_url(fields.get('request_uri', ''))
+        
+        query_params = dict(parse_qs(query)) if query else None
+        time_str = fields.pop('time', None)
+        time_estimated = False
+        if time_str:
+            timestamp, epoch, time_estimated = self._parse_time(time_str)
+        elif fields.get('msec'):
+            epoch = fields['msec']
+            timestamp = datetime.fromtimestamp(epoch, timezone.utc)
+        else:
+            # 格式中没有时间变量：日志实时写入，当前时间就是事件时间
+            timestamp, epoch = self._now()
+        
+        entry = fields
+        entry.update({
+            'ip': fields.get('ip'),
+            'user_agent': fields.get('user_agent', ''),
+            'request_method': method,
+            'request_path': path,
+            'query_params': json.dumps(query_params) if query_params else '',
+            'status_code': fields.get('status_code', 0),
+            'referer': fields.get('referer', ''),
+            'response_size': fields.get('response_size', 0),
+            'request_time': fields.get('request_time', 0),
+            'timestamp': timestamp,
+            'epoch': epoch,
+            'time_estimated': time_estimated,
+            'raw_log': line
+        })
+        return entry
+    
+    @staticmethod
+    def _split_url(full_path: str) -> tuple:
+        """
+        分离路径和查询字符串
+        常规的 /path?query 形式直接切分，其余情况（绝对URL、;params等）交给urlparse
+        """
+        if (full_path[:1] == '/' and full_path[1:2] != '/'
+                and ';' not in full_path and full_path.isprintable()):
+            path, _, query = full_path.partition('#')[0].partition('?')
+            return path, query
+        parsed_url = urlparse(full_path)
+        return parsed_url.path, parsed_url.query
+    
+    def _parse_time(self, time_str: str) -> tuple:
+        """
+        解析日志时间（LRU缓存，日志按时间顺序到达，每秒只需解析一次）
+        
+        Returns:
+            (UTC时间, epoch秒数, 是否为估计时间)
+        """
+        cache = self._time_cache
+        cached = cache.get(time_str)
+        if cached is not None:
+            # 与上一条日志同一秒时已位于LRU末尾
+            if cached is not self._last_time:
+                cache.move_to_end(time_str)
+                self._last_time = cached
+            return cached
+        
+        timestamp = self._convert_time(time_str)
+        if timestamp is None:
+            # 无法解析时沿用上一条日志的时间，避免历史日志被标记为当前时间
+            self.stats['timestamp_fallbacks'] += 1
+            timestamp, epoch = self._last_time[:2] if self._last_time else self._now()
+            return timestamp, epoch, True
+        
+        cached = (timestamp, timestamp.timestamp(), False)
+        cache[time_str] = cached
+        if len(cache) > self.TIME_CACHE_SIZE:
+            cache.popitem(last=False)
+        self._last_time = cached
+        return cached
+    
+    @staticmethod
+    def _now() -> tuple:
+        now = datetime.now(timezone.utc)
+        return now, now.timestamp()
+    
+    @staticmethod
+    def _convert_time(time_str: str) -> Optional[datetime]:
+        """
+        将Nginx时间转换为UTC时间
+        格式: 17/Oct/2025:18:30:00 +0800；没有时区时按本地时间处理
+        """
+        try:
+            # 固定宽度格式直接按位置切分，比strptime快得多（分隔符或数字不在固定位置时交给strptime）
+            if len(time_str) == 26 and time_str[11:21:3] == '::: ':
+                sign = time_str[21]
+                digits = (time_str[0:2] + time_str[7:11] + time_str[12:14] + time_str[15:17]
+                          + time_str[18:20] + time_str[22:26])
+                if sign in '+-' and digits.isdigit() and digits.isascii():
+                    offset = timedelta(hours=int(time_str[22:24]), minutes=int(time_str[24:26]))
+                    timestamp = datetime(int(time_str[7:11]), MONTHS[time_str[3:6]], int(time_str[0:2]),
+                                         int(time_str[12:14]), int(time_str[15:17]), int(time_str[18:20]),
+                                         tzinfo=timezone(-offset if sign == '-' else offset))
+                    return timestamp.astimezone(timezone.utc)
+            
+            if len(time_str) > 10 and time_str[10] == 'T':
+                # $time_iso8601: 2025-10-17T18:30:00+08:00
+                return datetime.fromisoformat(time_str).astimezone(timezone.utc)
+            if ' ' in time_str:
+                return datetime.strptime(time_str, '%d/%b/%Y:%H:%M:%S %z').astimezone(timezone.utc)
+            return datetime.strptime(time_str, '%d/%b/%Y:%H:%M:%S').astimezone(timezone.utc)
+        except (ValueError, KeyError):
+            return None
+    
+    def parse_lines(self, lines: List[str]) -> List[Dict]:
+        """
+        批量解析日志行
+        
+        Returns:
+            解析成功的日志列表（无法解析的行被跳过）
+        """
+        parse_line = self.parse_line
+        parsed = []
+        for line in lines:
+            if not line:
+                continue
+            entry = parse_line(line)
+            if entry:
+                parsed.append(entry)
+        return parsed
+
+
+class ChunkedLineReader:
+    """
+    分块行读取器
+    
+    每次从文件读取一大块数据并切分为完整的行，
+    末尾不完整的行保留到下一次读取时拼接
+    """
+    
+    def __init__(self, f, chunk_size: int = 1024 * 1024):
+        """
+        Args:
+            f: 以二进制模式打开的文件对象
+            chunk_size: 每次读取的字节数
+        """
+        self.f = f
+        self.chunk_size = chunk_size
+        self._partial = b''
+        self.last_line = b''  # 最近读到的一个完整行（用于检查点校验）
+    
+    @property
+    def offset(self) -> int:
+        """已完整消费的字节偏移（不含未完成的半行）"""
+        return self.f.tell() - len(self._partial)
+    
+    def read_lines(self) -> Optional[List[str]]:
+        """
+        读取一块数据
+        
+        Returns:
+            完整行的列表；文件没有新数据时返回None
+        """
+        data = self.f.read(self.chunk_size)
+        if not data:
+            return None
+        
+        if self._partial:
+            data = self._partial + data
+        
+        end = data.rfind(b'\n')
+        if end == -1:
+            # 整块都没有换行符，全部留到下次
+            self._partial = data
+            return []
+        
+        self._partial = data[end + 1:]
+        self.last_line = data[data.rfind(b'\n', 0, end) + 1:end]
+        return data[:end].decode('utf-8', errors='ignore').split('\n')
+    
+    def seek(self, offset: int, align: bool = False):
+        """
+        跳转到指定偏移并丢弃未完成的半行
+        
+        Args:
+            align: 偏移可能落在行中间时，跳到下一行的行首
+        """
+        self.f.seek(offset)
+        self._partial = b''
+        if align and offset > 0:
+            self.f.seek(offset - 1)
+            if self.f.read(1) != b'\n':
+                self.f.readline()
 
 
 class LogMonitor:
     """日志监控器 - 实时监控日志文件"""
     
-    def __init__(self, log_file: str, parser: NginxLogParser, callback: Callable):
+    def __init__(self, log_file: str, parser: NginxLogParser, callback: Callable,
+                 batch_callback: Optional[Callable] = None,
+                 chunk_size: int = 1024 * 1024,
+                 checkpoint: Optional[OffsetCheckpoint] = None,
+                 catchup_max_bytes: Optional[int] = None,
+                 source: Optional[str] = None):
         """
         Args:
             log_file: 日志文件路径
             parser: 日志解析器
             callback: 回调函数，处理解析后的日志行
+            batch_callback: 批量回调函数，接收解析后的日志列表（设置后优先于callback）
+            chunk_size: 每次从文件读取的字节数
+            checkpoint: 偏移检查点（None表示不记录，启动时从文件末尾开始）
+            catchup_max_bytes: 从检查点恢复时最多补读的字节数（None表示不限制）
+            source: 写入每条日志source字段的来源标识（默认为日志路径）
         """
         self.log_file = log_file
         self.parser = parser
         self.callback = callback
+        self.batch_callback = batch_callback
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.catchup_max_bytes = catchup_max_bytes
+        self.source = source or log_file
         self.running = False
+        
+        # 当前打开的文件、读取器及其 (设备号, inode)
+        self._file = None
+        self._reader = None
+        self._file_id = None
+        
+        # 运行统计
+        self.stats = {
+            'wakeups': 0,       # 空闲时被唤醒检查文件的次数
+            'rotations': 0,     # 检测到的日志轮转次数
+            'batches': 0,       # 分发的批次数
+            'entries': 0,       # 解析成功的日志条数
+            'catchup_bytes': 0, # 从检查点恢复时补读的字节数
+        }
+    
+    def get_stats(self) -> Dict:
+        """获取运行统计（含解析器统计）"""
+        stats = dict(self.stats)
+        stats.update(self.parser.stats)
+        return stats
     
     def start(self):
         """开始监控日志文件"""
@@ -132,43 +512,740 @@ class LogMonitor:
             while not os.path.exists(self.log_file) and self.running:
                 time.sleep(1)
         
-        # 打开文件并跳到末尾（只处理新的日志）
-        with open(self.log_file, 'r', encoding='utf-8', errors='ignore') as f:
-            # 跳到文件末尾
+        # 首次打开时从检查点恢复（没有检查点则跳到末尾，只处理新的日志）
+        while self.running and not self.open(resume=True):
+            time.sleep(1)
+        
+        try:
+            self._run()
+        finally:
+            self.close()
+    
+    def _run(self):
+        """轮询方式的主循环：没有新数据时每100ms检查一次"""
+        while self.running:
+            if self.read_available():
+                continue
+            
+            # 没有新数据，等待一下
+            time.sleep(0.1)
+            self.stats['wakeups'] += 1
+            self._flush_checkpoint()
+            
+            # 检查文件是否被截断或轮转
+            self.check_rotation()
+    
+    # ==================== 文件读取 ====================
+    
+    def open(self, resume: bool = False) -> bool:
+        """
+        打开日志文件并定位读取位置
+        
+        Args:
+            resume: True时从检查点恢复（没有检查点则跳到文件末尾）；
+                    False时从头读取（轮转后的新文件、运行中新出现的文件）
+            
+        Returns:
+            是否成功打开
+        """
+        start_offset = self._resume() if resume else 0
+        try:
+            f = open(self.log_file, 'rb')
+        except OSError:
+            return False
+        
+        reader = ChunkedLineReader(f, self.chunk_size)
+        if start_offset is None:
             f.seek(0, 2)
+        else:
+            reader.seek(start_offset, align=True)
+        
+        st = os.fstat(f.fileno())
+        self._file = f
+        self._reader = reader
+        self._file_id = (st.st_dev, st.st_ino)
+        print(f"开始监控日志文件: {self.log_file}")
+        return True
+    
+    def close(self):
+        """关闭当前文件并将检查点写盘"""
+        self._flush_checkpoint(force=True)
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._reader = None
+    
+    def read_available(self) -> int:
+        """读取并分发当前所有可读的完整行，返回行数"""
+        if not self._reader:
+            return 0
+        return self._drain(self._reader)
+    
+    def check_rotation(self) -> bool:
+        """
+        检查日志是否被截断或轮转
+        轮转时先读完旧文件剩余的数据，再从头打开新文件
+        
+        Returns:
+            是否切换到了新文件
+        """
+        if not self._file:
+            # 上次轮转后新文件还没有出现
+            return self.open()
+        
+        self._handle_truncation()
+        if not self._is_rotated():
+            return False
+        
+        self._drain(self._reader)
+        self.stats['rotations'] += 1
+        print("检测到日志轮转，重新打开文件...")
+        self.close()
+        return self.open()
+    
+    def _is_rotated(self) -> bool:
+        """日志路径是否已指向另一个文件（或已被删除）"""
+        if not self._file:
+            return True
+        try:
+            return os.stat(self.log_file).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+    
+    def _handle_truncation(self):
+        """处理copytruncate方式的轮转：文件变短时从头读取"""
+        if not self._file:
+            return
+        try:
+            size = os.fstat(self._file.fileno()).st_size
+        except OSError:
+            return
+        if size < self._reader.offset:
+            print("检测到日志被截断，从头读取...")
+            self._reader.seek(0)
+    
+    # ==================== 检查点 ====================
+    
+    def _resume(self) -> Optional[int]:
+        """
+        根据检查点确定当前日志文件的起始偏移
+        如果检查点记录的文件已被轮转，先补读完旧文件（如access.log.1）
+        
+        Returns:
+            起始偏移，None表示从文件末尾开始
+        """
+        if not self.checkpoint:
+            return None
+        
+        position = self.checkpoint.get(self.log_file)
+        if not position:
+            return None
+        
+        try:
+            st = os.stat(self.log_file)
+        except OSError:
+            return None
+        
+        if (st.st_dev, st.st_ino) == (position['device'], position['inode']):
+            offset = position['offset']
+            if offset > st.st_size or not self._verify_position(
+                    self.log_file, offset, position.get('line_hash')):
+                print("⚠ 检查点与日志内容不一致，从文件开头读取")
+                return 0
+            print(f"从检查点恢复: {self.log_file} @ {offset}")
+            return self._bound_catchup(offset, st.st_size)
+        
+        rotated_file = self._find_rotated_file(position['device'], position['inode'])
+        if rotated_file:
+            print(f"日志已轮转，先补读旧文件: {rotated_file} @ {position['offset']}")
+            self._catch_up(rotated_file, position)
+        else:
+            print("⚠ 未找到检查点对应的已轮转日志，停机期间的部分日志可能丢失")
+        return 0
+    
+    def _bound_catchup(self, offset: int, size: int) -> int:
+        """限制补读量，避免积压过多时追赶时间过长"""
+        if self.catchup_max_bytes and size - offset > self.catchup_max_bytes:
+            skipped = size - offset - self.catchup_max_bytes
+            print(f"⚠ 待补读日志过多，跳过最早的 {skipped} 字节")
+            offset = size - self.catchup_max_bytes
+        self.stats['catchup_bytes'] += size - offset
+        return offset
+    
+    def _find_rotated_file(self, device: int, inode: int) -> Optional[str]:
+        """在同目录下查找inode与检查点一致的已轮转日志（未压缩）"""
+        candidates = [f"{self.log_file}.1"] + sorted(glob.glob(f"{glob.escape(self.log_file)}.*"))
+        for candidate in candidates:
+            try:
+                st = os.stat(candidate)
+            except OSError:
+                continue
+            if (st.st_dev, st.st_ino) == (device, inode):
+                return candidate
+        return None
+    
+    def _verify_position(self, path: str, offset: int, line_hash: Optional[str]) -> bool:
+        """校验偏移之前的最后一行是否与检查点记录的哈希一致"""
+        if not line_hash or offset == 0:
+            return True
+        try:
+            with open(path, 'rb') as f:
+                start = max(0, offset - 64 * 1024)
+                f.seek(start)
+                data = f.read(offset - start)
+        except OSError:
+            return False
+        if not data.endswith(b'\n'):
+            return False
+        last_line = data[:-1].rsplit(b'\n', 1)[-1]
+        return hash_line(last_line) == line_hash
+    
+    def _catch_up(self, path: str, position: Dict):
+        """通过批量路径读完已轮转的旧文件"""
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            print(f"⚠ 无法打开已轮转日志 {path}: {e}")
+            return
+        
+        with f:
+            st = os.fstat(f.fileno())
+            offset = position['offset']
+            if offset > st.st_size or not self._verify_position(path, offset, position.get('line_hash')):
+                offset = 0
+            offset = self._bound_catchup(offset, st.st_size)
+            
+            reader = ChunkedLineReader(f, self.chunk_size)
+            reader.seek(offset, align=True)
+            self._file_id = (st.st_dev, st.st_ino)
+            try:
+                self._drain(reader)
+            finally:
+                self._flush_checkpoint(force=True)
+    
+    def _record_position(self, reader: ChunkedLineReader):
+        """记录已处理到的位置"""
+        if not self.checkpoint or not self._file_id:
+            return
+        line_hash = hash_line(reader.last_line) if reader.last_line else None
+        self.checkpoint.update(self.log_file, self._file_id[0], self._file_id[1],
+                               reader.offset, line_hash)
+        self.checkpoint.flush()
+    
+    def _flush_checkpoint(self, force: bool = False):
+        """将检查点写盘（默认按间隔节流）"""
+        if self.checkpoint:
+            self.checkpoint.flush(force=force)
+    
+    def _drain(self, reader: ChunkedLineReader) -> int:
+        """读取并分发当前所有可读数据，返回读取的行数"""
+        count = 0
+        lines = reader.read_lines()
+        while lines is not None:
+            count += len(lines)
+            self._consume(reader, lines)
+            lines = reader.read_lines()
+        return count
+    
+    def _consume(self, reader: ChunkedLineReader, lines: List[str]):
+        """分发一批行，处理完成后记录读取位置"""
+        self._dispatch(lines)
+        self._record_position(reader)
+    
+    def _dispatch(self, lines: List[str]):
+        """解析一批日志行并交给回调处理"""
+        entries = self.parser.parse_lines(lines)
+        if not entries:
+            return
+        
+        self.stats['batches'] += 1
+        self.stats['entries'] += len(entries)
+        
+        source = self.source
+        for entry in entries:
+            entry['source'] = source
+        
+        if self.batch_callback:
+            try:
+                self.batch_callback(entries)
+            except Exception as e:
+                print(f"批量处理日志时出错: {e}")
+            return
+        
+        for parsed in entries:
+            try:
+                self.callback(parsed)
+            except Exception as e:
+                print(f"处理日志行时出错: {e}")
+    
+    def stop(self):
+        """停止监控"""
+        self.running = False
+
+
+class _Waker:
+    """
+    自管道唤醒器：让阻塞在poll上的事件循环能被stop()立即唤醒
+    
+    管道两端只属于创建它的进程：fork出的子进程（如并行批处理的进程池）启动后立即关闭继承的两端，
+    避免文件描述符泄漏到子进程中
+    """
+    
+    _instances = weakref.WeakSet()
+    
+    def __init__(self):
+        self.fd, self._write_fd = os.pipe()
+        os.set_blocking(self.fd, False)
+        _Waker._instances.add(self)
+    
+    def wake(self):
+        try:
+            os.write(self._write_fd, b'x')
+        except OSError:
+            pass
+    
+    def clear(self):
+        """清除上一次stop()留下的唤醒信号"""
+        try:
+            while os.read(self.fd, 64):
+                pass
+        except BlockingIOError:
+            pass
+    
+    def close(self):
+        """关闭管道两端（关闭后wake()不再有效果）"""
+        for fd in (self.fd, self._write_fd):
+            if fd >= 0:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.fd = self._write_fd = -1
+    
+    @classmethod
+    def _close_inherited(cls):
+        """fork后在子进程中关闭继承的全部唤醒管道"""
+        for waker in list(cls._instances):
+            waker.close()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_Waker._close_inherited)
+
+
+def _record_latency(stats: Dict, f):
+    """记录从文件最后一次写入到被唤醒的延迟"""
+    try:
+        mtime = os.fstat(f.fileno()).st_mtime
+    except (OSError, ValueError):
+        return
+    latency_ms = max(0.0, (time.time() - mtime) * 1000)
+    stats['latency_samples'] += 1
+    stats['latency_ms_total'] += latency_ms
+    if latency_ms > stats['latency_ms_max']:
+        stats['latency_ms_max'] = latency_ms
+
+
+def _latency_stats(stats: Dict) -> Dict:
+    """补充平均延迟"""
+    stats = dict(stats)
+    samples = stats['latency_samples']
+    stats['latency_ms_avg'] = stats['latency_ms_total'] / samples if samples else 0.0
+    return stats
+
+
+_LATENCY_STATS = {
+    'events': 0,              # 收到的inotify事件数
+    'latency_samples': 0,
+    'latency_ms_total': 0.0,  # 文件写入到被唤醒的延迟（累计）
+    'latency_ms_max': 0.0,
+}
+
+
+class InotifyLogMonitor(LogMonitor):
+    """
+    基于inotify的日志监控器（仅Linux）
+    
+    只在文件被写入、移动或目录中出现新日志文件时唤醒，
+    全程只持有一个打开的文件描述符，并自行处理日志轮转
+    """
+    
+    FILE_MASK = inotify.IN_MODIFY | inotify.IN_MOVE_SELF | inotify.IN_DELETE_SELF
+    DIR_MASK = inotify.IN_CREATE | inotify.IN_MOVED_TO
+    
+    def __init__(self, log_file: str, parser: NginxLogParser, callback: Callable,
+                 batch_callback: Optional[Callable] = None,
+                 chunk_size: int = 1024 * 1024,
+                 checkpoint: Optional[OffsetCheckpoint] = None,
+                 catchup_max_bytes: Optional[int] = None,
+                 source: Optional[str] = None):
+        super().__init__(log_file, parser, callback, batch_callback, chunk_size,
+                         checkpoint, catchup_max_bytes, source)
+        self._waker = _Waker()
+        self.stats.update(_LATENCY_STATS)
+    
+    def get_stats(self) -> Dict:
+        return _latency_stats(super().get_stats())
+    
+    def _run(self):
+        """等待inotify事件并读取新数据"""
+        watcher = inotify.Inotify()
+        log_dir = os.path.dirname(os.path.abspath(self.log_file))
+        log_name = os.path.basename(self.log_file)
+        self._waker.clear()
+        
+        try:
+            dir_wd = watcher.add_watch(log_dir, self.DIR_MASK)
+            file_wd = self._watch_file(watcher)
             
-            print(f"开始监控日志文件: {self.log_file}")
+            # 打开文件与添加监视之间可能已经发生了轮转
+            rotated = self._is_rotated()
+            self.read_available()
             
             while self.running:
-                line = f.readline()
+                if rotated and os.path.exists(self.log_file):
+                    # 新文件已出现，读完旧文件剩余数据后切换
+                    if file_wd is not None:
+                        watcher.rm_watch(file_wd)
+                    self.check_rotation()
+                    file_wd = self._watch_file(watcher)
+                    rotated = self._is_rotated()
+                    self.read_available()
+                    continue
                 
-                if line:
-                    # 解析日志行
-                    parsed = self.parser.parse_line(line)
-                    if parsed:
-                        try:
-                            self.callback(parsed)
-                        except Exception as e:
-                            print(f"处理日志行时出错: {e}")
-                else:
-                    # 没有新数据，等待一下
-                    time.sleep(0.1)
-                    
-                    # 检查文件是否被轮转
-                    try:
-                        current_inode = os.stat(self.log_file).st_ino
-                        if hasattr(f, 'fileno'):
-                            file_inode = os.fstat(f.fileno()).st_ino
-                            if current_inode != file_inode:
-                                # 文件已轮转，重新打开
-                                print("检测到日志轮转，重新打开文件...")
-                                break
-                    except:
-                        pass
+                # 有未写盘的检查点时，最多等待一个写盘间隔
+                timeout = None
+                if self.checkpoint and self.checkpoint.dirty:
+                    timeout = self.checkpoint.interval
+                
+                events = watcher.read_events(timeout, (self._waker.fd,))
+                self.stats['wakeups'] += 1
+                if not events:
+                    self._flush_checkpoint()
+                    continue
+                
+                self.stats['events'] += len(events)
+                modified = False
+                for wd, mask, _, name in events:
+                    if mask & inotify.IN_Q_OVERFLOW:
+                        # 事件队列溢出，无法确定发生了什么，按修改+轮转检查处理
+                        modified = True
+                        rotated = rotated or self._is_rotated()
+                    elif wd == file_wd:
+                        if mask & inotify.IN_MODIFY:
+                            modified = True
+                        if mask & (inotify.IN_MOVE_SELF | inotify.IN_DELETE_SELF):
+                            rotated = True
+                    elif wd == dir_wd and name == log_name:
+                        rotated = True
+                
+                if modified and self._file:
+                    _record_latency(self.stats, self._file)
+                    self._handle_truncation()
+                    self.read_available()
+        finally:
+            watcher.close()
+    
+    def _watch_file(self, watcher: inotify.Inotify) -> Optional[int]:
+        """监视当前打开的日志文件"""
+        if not self._file:
+            return None
+        try:
+            return watcher.add_watch(self.log_file, self.FILE_MASK)
+        except OSError:
+            return None
+    
+    def stop(self):
+        """停止监控"""
+        self.running = False
+        self._waker.wake()
+
+
+class MultiLogMonitor:
+    """
+    多文件日志监控器
+    
+    按通配符匹配多个日志文件（如每个server块各自的access log），运行中自动发现新文件。
+    所有文件在同一个事件循环中复用（inotify或轮询），不为每个文件单独开线程；
+    每条日志的source字段标明其来源文件，便于按站点区分
+    """
+    
+    FILE_MASK = InotifyLogMonitor.FILE_MASK
+    DIR_MASK = InotifyLogMonitor.DIR_MASK
+    
+    # 已轮转/已压缩的文件不作为实时跟踪对象：access.log.1、access.log.2.gz、access.log.old，
+    # 以及logrotate dateext的 access.log-20261017、access.log-2026101718（可再带压缩后缀）
+    ROTATED_SUFFIX = re.compile(r'(?:\.(\d+|gz|bz2|xz|zst|old)|-\d{8}(\d{2})?)$')
+    
+    def __init__(self, patterns: List[str], parser: NginxLogParser, callback: Callable,
+                 batch_callback: Optional[Callable] = None,
+                 chunk_size: int = 1024 * 1024,
+                 checkpoint: Optional[OffsetCheckpoint] = None,
+                 catchup_max_bytes: Optional[int] = None,
+                 engine: str = 'auto',
+                 rescan_interval: float = 10.0):
+        """
+        Args:
+            patterns: 日志路径或通配符列表，如 ["/var/log/nginx/*.access.log"]
+            engine: 'auto'（Linux上使用inotify，否则轮询）、'inotify' 或 'poll'
+            rescan_interval: 重新扫描通配符以发现新文件的间隔（秒）
+            其余参数同LogMonitor
+        """
+        self.patterns = [os.path.abspath(p) for p in patterns]
+        self.parser = parser
+        self.callback = callback
+        self.batch_callback = batch_callback
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint
+        self.catchup_max_bytes = catchup_max_bytes
+        self.rescan_interval = rescan_interval
+        self.use_inotify = engine in ('auto', 'inotify') and inotify.is_available()
+        if engine == 'inotify' and not self.use_inotify:
+            print("⚠ 当前平台不支持inotify，使用轮询方式监控日志")
+        self.running = False
+        
+        # 路径 -> 单文件跟踪器（只使用其读取逻辑，不调用其start()）
+        self.tails: Dict[str, LogMonitor] = {}
+        
+        self._watcher = None
+        self._file_watches: Dict[int, LogMonitor] = {}   # wd -> 跟踪器
+        self._tail_wds: Dict[str, int] = {}               # 路径 -> wd
+        self._dir_watches: Dict[int, str] = {}            # wd -> 目录
+        self._pending_rotation = set()                    # 已被移走、等待新文件出现的路径
+        self._waker = _Waker()
+        
+        self.stats = {
+            'wakeups': 0,
+            'discovered': 0,    # 运行中新发现的文件数
+        }
+        self.stats.update(_LATENCY_STATS)
+    
+    def get_stats(self) -> Dict:
+        """获取运行统计（含各文件汇总及按来源的条数）"""
+        stats = _latency_stats(self.stats)
+        stats['files'] = len(self.tails)
+        for key in ('rotations', 'batches', 'entries', 'catchup_bytes'):
+            stats[key] = sum(tail.stats[key] for tail in self.tails.values())
+        stats['sources'] = {tail.source: tail.stats['entries'] for tail in self.tails.values()}
+        stats.update(self.parser.stats)
+        return stats
+    
+    def start(self):
+        """开始监控所有匹配的日志文件"""
+        self.running = True
+        self._waker.clear()
+        if self.use_inotify:
+            self._watcher = inotify.Inotify()
+        
+        try:
+            self._discover(resume=True)
+            if not self.tails:
+                print(f"警告: 没有匹配的日志文件: {', '.join(self.patterns)}")
+                print("等待文件创建...")
+            
+            if self._watcher:
+                self._run_inotify()
+            else:
+                self._run_poll()
+        finally:
+            for tail in self.tails.values():
+                tail.close()
+            if self._watcher:
+                self._watcher.close()
+                self._watcher = None
     
     def stop(self):
         """停止监控"""
         self.running = False
+        self._waker.wake()
+    
+    # ==================== 文件发现 ====================
+    
+    def _discover(self, resume: bool = False):
+        """
+        按通配符扫描并开始跟踪新出现的文件
+        
+        Args:
+            resume: 启动时已存在的文件从检查点恢复（没有检查点则从末尾开始），
+                    运行中新出现的文件从头读取
+        """
+        for pattern in self.patterns:
+            for path in sorted(glob.glob(pattern)):
+                self._add_file(path, resume)
+            
+            # 通配符只出现在文件名中时，直接监视所在目录以便及时发现新文件
+            directory = os.path.dirname(pattern)
+            if self._watcher and not self._has_magic(directory):
+                self._watch_dir(directory)
+    
+    def _add_file(self, path: str, resume: bool = False):
+        """开始跟踪一个日志文件"""
+        path = os.path.abspath(path)
+        if path in self.tails or self.ROTATED_SUFFIX.search(path) or not os.path.isfile(path):
+            return
+        
+        tail = LogMonitor(path, self.parser, self.callback, self.batch_callback,
+                          self.chunk_size, self.checkpoint, self.catchup_max_bytes)
+        tail.running = True
+        if not tail.open(resume=resume):
+            return
+        
+        self.tails[path] = tail
+        if not resume:
+            self.stats['discovered'] += 1
+        if self._watcher:
+            self._watch_file(tail)
+            self._watch_dir(os.path.dirname(path))
+        
+        tail.read_available()
+    
+    def _matches(self, path: str) -> bool:
+        """路径是否匹配任一通配符"""
+        return any(fnmatch.fnmatch(path, pattern) for pattern in self.patterns)
+    
+    @staticmethod
+    def _has_magic(path: str) -> bool:
+        return any(c in path for c in '*?[')
+    
+    # ==================== inotify ====================
+    
+    def _watch_dir(self, directory: str):
+        if directory in self._dir_watches.values() or not os.path.isdir(directory):
+            return
+        try:
+            self._dir_watches[self._watcher.add_watch(directory, self.DIR_MASK)] = directory
+        except OSError as e:
+            print(f"⚠ 无法监视目录 {directory}: {e}")
+    
+    def _watch_file(self, tail: LogMonitor):
+        """监视跟踪器当前打开的文件（轮转后替换旧的监视）"""
+        old_wd = self._tail_wds.pop(tail.log_file, None)
+        if old_wd is not None:
+            self._file_watches.pop(old_wd, None)
+            self._watcher.rm_watch(old_wd)
+        
+        if not tail._file:
+            return
+        try:
+            wd = self._watcher.add_watch(tail.log_file, self.FILE_MASK)
+        except OSError:
+            return
+        self._file_watches[wd] = tail
+        self._tail_wds[tail.log_file] = wd
+    
+    def _run_inotify(self):
+        """inotify事件循环"""
+        next_rescan = time.time() + self.rescan_interval
+        
+        while self.running:
+            timeout = max(0.0, next_rescan - time.time())
+            if self.checkpoint and self.checkpoint.dirty:
+                timeout = min(timeout, self.checkpoint.interval)
+            
+            events = self._watcher.read_events(timeout, (self._waker.fd,))
+            self.stats['wakeups'] += 1
+            self.stats['events'] += len(events)
+            
+            modified = {}
+            for wd, mask, _, name in events:
+                if mask & inotify.IN_Q_OVERFLOW:
+                    # 事件队列溢出，全部检查一遍
+                    modified.update((tail.log_file, tail) for tail in self.tails.values())
+                    next_rescan = 0
+                    continue
+                
+                tail = self._file_watches.get(wd)
+                if tail:
+                    if mask & inotify.IN_MODIFY:
+                        modified[tail.log_file] = tail
+                    if mask & (inotify.IN_MOVE_SELF | inotify.IN_DELETE_SELF):
+                        self._pending_rotation.add(tail.log_file)
+                    continue
+                
+                directory = self._dir_watches.get(wd)
+                if directory and name:
+                    path = os.path.join(directory, name)
+                    if path in self.tails:
+                        self._pending_rotation.add(path)
+                    elif self._matches(path):
+                        self._add_file(path)
+            
+            for tail in modified.values():
+                if tail._file:
+                    _record_latency(self.stats, tail._file)
+                    tail._handle_truncation()
+                    tail.read_available()
+            
+            # 被移走的文件在新文件出现后再切换，期间旧文件的写入仍会被读取
+            for path in list(self._pending_rotation):
+                if os.path.exists(path):
+                    self._pending_rotation.discard(path)
+                    tail = self.tails[path]
+                    if tail.check_rotation():
+                        self._watch_file(tail)
+                        tail.read_available()
+            
+            if time.time() >= next_rescan:
+                self._discover()
+                for path, tail in self.tails.items():
+                    if not tail._file and tail.check_rotation():
+                        self._watch_file(tail)
+                next_rescan = time.time() + self.rescan_interval
+            
+            if self.checkpoint:
+                self.checkpoint.flush()
+    
+    # ==================== 轮询 ====================
+    
+    def _run_poll(self):
+        """轮询事件循环：所有文件在同一个循环中依次读取"""
+        next_rescan = time.time() + self.rescan_interval
+        
+        while self.running:
+            if sum(tail.read_available() for tail in list(self.tails.values())):
+                continue
+            
+            time.sleep(0.1)
+            self.stats['wakeups'] += 1
+            if self.checkpoint:
+                self.checkpoint.flush()
+            
+            for tail in list(self.tails.values()):
+                tail.check_rotation()
+            
+            if time.time() >= next_rescan:
+                self._discover()
+                next_rescan = time.time() + self.rescan_interval
+
+
+def create_log_monitor(log_file, parser: NginxLogParser, callback: Callable,
+                       batch_callback: Optional[Callable] = None,
+                       chunk_size: int = 1024 * 1024,
+                       engine: str = 'auto',
+                       checkpoint: Optional[OffsetCheckpoint] = None,
+                       catchup_max_bytes: Optional[int] = None):
+    """
+    创建日志监控器
+    
+    Args:
+        log_file: 日志路径；传入列表或包含通配符时创建MultiLogMonitor
+        engine: 'auto'（Linux上使用inotify，否则轮询）、'inotify' 或 'poll'
+    """
+    if isinstance(log_file, (list, tuple)) or MultiLogMonitor._has_magic(log_file):
+        patterns = list(log_file) if isinstance(log_file, (list, tuple)) else [log_file]
+        return MultiLogMonitor(patterns, parser, callback, batch_callback, chunk_size,
+                               checkpoint, catchup_max_bytes, engine)
+    
+    monitor_class = LogMonitor
+    if engine in ('auto', 'inotify') and inotify.is_available():
+        monitor_class = InotifyLogMonitor
+    elif engine == 'inotify':
+        print("⚠ 当前平台不支持inotify，使用轮询方式监控日志")
+    
+    return monitor_class(log_file, parser, callback, batch_callback, chunk_size,
+                         checkpoint, catchup_max_bytes)
 
 
 class BatchLogProcessor:
@@ -183,37 +1260,53 @@ class BatchLogProcessor:
         处理日志文件
         
         Args:
-            log_file: 日志文件路径
+            log_file: 日志文件路径、目录或通配符（支持.gz/.bz2/.xz/.zst压缩日志，
+                      多个文件按其中日志的时间顺序处理）
             max_lines: 最多处理的行数（None表示全部）
         """
-        if not os.path.exists(log_file):
+        log_files = expand_log_paths(log_file, self.parser)
+        if not log_files or not os.path.exists(log_files[0]):
             print(f"错误: 日志文件不存在: {log_file}")
             return
         
-        print(f"开始处理日志文件: {log_file}")
-        
         processed = 0
         errors = 0
         
-        with open(log_file, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                if max_lines and processed >= max_lines:
-                    break
-                
-                parsed = self.parser.parse_line(line)
-                if parsed:
-                    try:
-                        self.callback(parsed)
-                        processed += 1
+        for path in log_files:
+            print(f"开始处理日志文件: {path}")
+            
+            reader = PipelinedLineReader(path)
+            try:
+                for lines in reader:
+                    for line in lines:
+                        if max_lines and processed >= max_lines:
+                            break
                         
-                        if processed % 1000 == 0:
-                            print(f"已处理 {processed} 行...")
-                    except Exception as e:
-                        errors += 1
-                        if errors <= 10:  # 只打印前10个错误
-                            print(f"处理日志行时出错: {e}")
-                else:
-                    errors += 1
+                        parsed = self.parser.parse_line(line)
+                        if parsed:
+                            parsed['source'] = path
+                            try:
+                                self.callback(parsed)
+                                processed += 1
+                                
+                                if processed % 1000 == 0:
+                                    print(f"已处理 {processed} 行...")
+                            except Exception as e:
+                                errors += 1
+                                if errors <= 10:  # 只打印前10个错误
+                                    print(f"处理日志行时出错: {e}")
+                        elif line.strip():
+                            errors += 1
+                    
+                    if max_lines and processed >= max_lines:
+                        break
+            except Exception as e:
+                print(f"读取日志文件失败 {path}: {e}")
+            finally:
+                reader.close()
+            
+            if max_lines and processed >= max_lines:
+                break
         
         print(f"处理完成: 成功 {processed} 行, 错误 {errors} 行")
 
@@ -0,0 +1,168 @@
+"""
+历史日志来源
+支持直接流式解压logrotate压缩过的日志（.gz/.bz2/.xz/.zst），
+以及按目录或通配符展开多个日志文件并按时间顺序排列
+"""
+import bz2
+import glob
+import gzip
+import lzma
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard未安装，无法读取.zst日志
+    zstandard = None
+
+
+def _open_zstd(path: str):
+    if zstandard is None:
+        raise RuntimeError(f"读取 {path} 需要安装zstandard: pip install zstandard")
+    return zstandard.open(path, 'rb')
+
+
+# 压缩后缀 -> 以二进制流方式打开的函数
+DECOMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open,
+    '.zst': _open_zstd,
+}
+
+
+def is_compressed(path: str) -> bool:
+    """是否为压缩日志"""
+    return os.path.splitext(path)[1] in DECOMPRESSORS
+
+
+def open_log(path: str):
+    """以二进制流方式打开日志（压缩文件边读边解压）"""
+    opener = DECOMPRESSORS.get(os.path.splitext(path)[1])
+    if opener:
+        return opener(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_first_line(path: str) -> Optional[str]:
+    """读取日志的第一行（压缩文件只解压开头的一小部分）"""
+    try:
+        with open_log(path) as f:
+            line = f.readline(64 * 1024)
+    except (OSError, EOFError, RuntimeError, lzma.LZMAError):
+        return None
+    return line.decode('utf-8', errors='ignore') if line else None
+
+
+def expand_log_paths(target: str, parser=None) -> List[str]:
+    """
+    将路径展开为日志文件列表
+    
+    Args:
+        target: 单个文件、目录（目录下所有文件）或通配符
+        parser: 日志解析器，用于读取每个文件第一行的时间进行排序；
+                为None或无法解析时按修改时间排序
+    
+    Returns:
+        按时间从早到晚排列的文件列表
+    """
+    if os.path.isdir(target):
+        paths = [os.path.join(target, name) for name in os.listdir(target)]
+    elif any(c in target for c in '*?['):
+        paths = glob.glob(target)
+    else:
+        return [target]
+    
+    paths = [p for p in paths if os.path.isfile(p)]
+    
+    def sort_key(path):
+        timestamp = None
+        if parser:
+            line = read_first_line(path)
+            parsed = parser.parse_line(line) if line else None
+            if parsed:
+                timestamp = parsed['timestamp']
+        if timestamp is None:
+            timestamp = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        return timestamp, path
+    
+    return sorted(paths, key=sort_key)
+
+
+class PipelinedLineReader:
+    """
+    流水线式日志读取器
+    
+    在后台线程中读取（并解压）日志，按块切分为完整的行放入有界队列，
+    解压与调用方的解析处理并行进行
+    """
+    
+    _END = object()
+    
+    def __init__(self, path: str, chunk_size: int = 1024 * 1024, queue_size: int = 8):
+        """
+        Args:
+            path: 日志路径（可以是压缩文件）
+            chunk_size: 每次读取的（解压后）字节数
+            queue_size: 队列中最多缓存的块数
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._read, daemon=True)
+    
+    def _read(self):
+        """后台线程：读取并按行切分"""
+        partial = b''
+        try:
+            with open_log(self.path) as f:
+                while not self._stopped:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    chunk = partial + chunk
+                    end = chunk.rfind(b'\n')
+                    if end < 0:
+                        partial = chunk
+                        continue
+                    partial = chunk[end + 1:]
+                    self._put(chunk[:end].decode('utf-8', errors='ignore').split('\n'))
+            if partial and not self._stopped:
+                self._put([partial.decode('utf-8', errors='ignore')])
+        except Exception as e:
+            self._error = e
+        finally:
+            self._put(self._END)
+    
+    def _put(self, item):
+        while not self._stopped:
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+    
+    def __iter__(self) -> Iterator[List[str]]:
+        """逐块返回日志行列表（不含换行符）"""
+        self._thread.start()
+        try:
+            while True:
+                lines = self._queue.get()
+                if lines is self._END:
+                    break
+                yield lines
+        finally:
+            self.close()
+        
+        if self._error:
+            raise self._error
+    
+    def close(self):
+        """停止后台读取（提前结束迭代时调用）"""
+        self._stopped = True
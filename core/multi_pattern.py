@@ -0,0 +1,359 @@
+"""
+多模式匹配
+把多个类别的特征（正则和字面量）编译为一个匹配器：
+特征较多时，每个模式必须出现的字面量（锚点）放入Aho-Corasick自动机，
+每个输入字符串只扫描一遍，再只验证锚点出现过的正则，耗时基本不随特征数量增长
+"""
+import re
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# 正则元字符（未转义时说明该模式不是字面量）
+_REGEX_META = set('.^$*+?{}[]|()')
+
+
+def literal_of(pattern: str) -> Optional[str]:
+    """
+    模式是否等价于一个字面量
+    
+    Args:
+        pattern: 正则表达式
+    
+    Returns:
+        字面量字符串（如 'document\\.cookie' -> 'document.cookie'）；含有正则语法时返回None
+    """
+    chars = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            # \d、\s、\x41等是字符类或转义序列，不是字面量
+            if ch.isalnum():
+                return None
+            chars.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch in _REGEX_META:
+            return None
+        else:
+            chars.append(ch)
+    if escaped or not chars:
+        return None
+    return ''.join(chars)
+
+
+def required_literal(pattern: str, flags: int = 0) -> Optional[Tuple[str, bool]]:
+    """
+    正则匹配时必定出现在文本中的最长字面量（锚点）
+    
+    只取顶层（及不带内联标志的分组内）连续的普通字符，遇到分支、重复、字符类等即断开，
+    例如 'union.*select' -> 'select'，'exec\\(' -> 'exec('
+    
+    Args:
+        pattern: 正则表达式
+        flags: 编译标志
+    
+    Returns:
+        (锚点, 是否忽略大小写)，忽略大小写时锚点为小写；没有可用的锚点返回None
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    ignore_case = bool(parsed.state.flags & re.IGNORECASE)
+    
+    runs = []
+    current = []
+    
+    def walk(items):
+        for op, av in items:
+            if op is sre_parse.LITERAL:
+                current.append(chr(av))
+            elif op is sre_parse.SUBPATTERN and not av[1] and not av[2]:
+                walk(av[3])
+            elif current:
+                runs.append(''.join(current))
+                current.clear()
+    
+    walk(parsed)
+    if current:
+        runs.append(''.join(current))
+    if not runs:
+        return None
+    
+    anchor = max(runs, key=len)
+    if ignore_case:
+        # 非ASCII字符忽略大小写时可能匹配ASCII字符（如开尔文符号与k），不能作为锚点
+        if not anchor.isascii():
+            return None
+        anchor = anchor.lower()
+    return anchor, ignore_case
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick自动机（纯Python实现）
+    
+    构建时把失败链接展开为完整的状态转移表，扫描时每个字符只做一次字典查找，
+    耗时与字面量数量基本无关
+    """
+    
+    def __init__(self, words: Iterable[Tuple[str, object]]):
+        """
+        Args:
+            words: (字面量, 命中时返回的值) 列表
+        """
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[list] = [[]]
+        for word, value in words:
+            state = 0
+            for ch in word:
+                next_state = goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(goto)
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][ch] = next_state
+                state = next_state
+            outputs[state].append(value)
+        
+        # 按广度优先计算失败链接，并合并后缀状态的输出
+        fail = [0] * len(goto)
+        order = []
+        queue = deque(goto[0].values())
+        while queue:
+            state = queue.popleft()
+            order.append(state)
+            for ch, next_state in goto[state].items():
+                target = fail[state]
+                while target and ch not in goto[target]:
+                    target = fail[target]
+                fallback = goto[target].get(ch, 0)
+                fail[next_state] = fallback if fallback != next_state else 0
+                outputs[next_state] = outputs[next_state] + outputs[fail[next_state]]
+                queue.append(next_state)
+        
+        # 展开为完整的转移表（缺失的转移回到根状态）
+        delta = [dict(transitions) for transitions in goto]
+        for state in order:
+            for ch, next_state in delta[fail[state]].items():
+                delta[state].setdefault(ch, next_state)
+        
+        self._delta = delta
+        self._outputs = [tuple(values) for values in outputs]
+    
+    def __len__(self) -> int:
+        """状态数"""
+        return len(self._delta)
+    
+    def find_all(self, text: str) -> List:
+        """返回文本中出现的全部字面量对应的值（按结束位置排序，可能重复）"""
+        delta = self._delta
+        outputs = self._outputs
+        found = []
+        state = 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if outputs[state]:
+                found.extend(outputs[state])
+        return found
+
+
+class _NativeAhoCorasick:
+    """pyahocorasick自动机（已安装时代替纯Python实现）"""
+    
+    def __init__(self, words: Iterable[Tuple[str, object]]):
+        self._automaton = ahocorasick.Automaton()
+        values: Dict[str, list] = {}
+        for word, value in words:
+            values.setdefault(word, []).append(value)
+        for word, items in values.items():
+            self._automaton.add_word(word, tuple(items))
+        self._automaton.make_automaton()
+        self._states = len(values)
+    
+    def __len__(self) -> int:
+        return self._states
+    
+    def find_all(self, text: str) -> List:
+        found = []
+        for _, items in self._automaton.iter(text):
+            found.extend(items)
+        return found
+
+
+def build_automaton(words: List[Tuple[str, object]]):
+    """创建Aho-Corasick自动机（优先使用pyahocorasick）"""
+    if ahocorasick is not None:
+        return _NativeAhoCorasick(words)
+    return AhoCorasick(words)
+
+
+class MultiPatternMatcher:
+    """
+    多类别特征匹配器
+    
+    用法:
+        matcher = MultiPatternMatcher()
+        matcher.add('sql_injection', ['union.*select', "' or 1=1"])
+        matcher.add('sensitive_path', ['/.env', '/.git'], regex=False, ignore_case=False)
+        matcher.compile()
+        matcher.match('/index.php?id=1 union select')   # {'sql_injection': 'union.*select'}
+    
+    模式数量少于ac_min_patterns时逐个匹配（单个带字面量前缀的正则搜索很快）；
+    达到该值时把每个模式的锚点放入Aho-Corasick自动机，扫描一遍得到候选模式，
+    字面量模式命中锚点即命中，正则模式再验证一次；没有锚点的模式每次都检查。
+    每个类别返回按添加顺序第一个命中的模式，与逐个匹配的结果相同
+    """
+    
+    def __init__(self, ac_min_patterns: int = 100):
+        """
+        Args:
+            ac_min_patterns: 模式数量达到该值时使用Aho-Corasick自动机
+        """
+        self.ac_min_patterns = ac_min_patterns
+        # (类别, 原始模式, 验证函数, 字面量或None, 忽略大小写)
+        self._patterns: List[Tuple[str, str, Callable, Optional[str], bool]] = []
+        self.categories: List[str] = []
+        self.invalid: List[Tuple[str, str, str]] = []
+        self._automata: List[Tuple[object, bool]] = []
+        # 命中锚点即可确定命中的模式序号
+        self._exact = frozenset()
+        # 没有锚点、每次都要检查的模式序号
+        self._unanchored = frozenset()
+    
+    def __len__(self) -> int:
+        """模式总数"""
+        return len(self._patterns)
+    
+    def add(self, category: str, patterns: Iterable[str], regex: bool = True,
+            ignore_case: bool = True):
+        """
+        添加一个类别的模式（调用compile()后生效）
+        
+        Args:
+            category: 类别名
+            patterns: 模式列表
+            regex: True表示正则表达式，False表示字面量（子串匹配）
+            ignore_case: 是否忽略大小写
+        """
+        if category not in self.categories:
+            self.categories.append(category)
+        flags = re.IGNORECASE if ignore_case else 0
+        for pattern in patterns:
+            if not pattern:
+                continue
+            if not regex:
+                if ignore_case:
+                    search = re.compile(re.escape(pattern), flags).search
+                else:
+                    search = (lambda text, literal=pattern: literal in text)
+                self._patterns.append((category, pattern, search, pattern, ignore_case))
+                continue
+            try:
+                compiled = re.compile(pattern, flags)
+            except re.error as e:
+                self.invalid.append((category, pattern, str(e)))
+                print(f"⚠ 无效的{category}特征 {pattern!r}: {e}")
+                continue
+            self._patterns.append((category, pattern, compiled.search, literal_of(pattern), ignore_case))
+        return self
+    
+    def compile(self) -> 'MultiPatternMatcher':
+        """编译自动机（模式数量未达到ac_min_patterns时不使用自动机）"""
+        self._automata = []
+        self._exact = frozenset()
+        self._unanchored = frozenset()
+        if len(self._patterns) < self.ac_min_patterns:
+            return self
+        
+        words = {True: [], False: []}
+        exact = set()
+        unanchored = set()
+        for index, (category, pattern, search, literal, ignore_case) in enumerate(self._patterns):
+            if pattern == literal:
+                # 字面量（或不含转义和元字符的正则）：整个模式就是锚点
+                if ignore_case and not literal.isascii():
+                    anchor = None
+                else:
+                    anchor = (literal.lower() if ignore_case else literal, ignore_case)
+            else:
+                anchor = required_literal(pattern, re.IGNORECASE if ignore_case else 0)
+            if anchor is None:
+                unanchored.add(index)
+                continue
+            word, anchor_ignore_case = anchor
+            words[anchor_ignore_case].append((word, index))
+            if literal is not None and word == (literal.lower() if anchor_ignore_case else literal):
+                exact.add(index)
+        
+        self._automata = [
+            (build_automaton(items), ignore_case)
+            for ignore_case, items in words.items() if items
+        ]
+        self._exact = frozenset(exact)
+        self._unanchored = frozenset(unanchored)
+        return self
+    
+    def match(self, text: str) -> Dict[str, str]:
+        """
+        扫描字符串
+        
+        Returns:
+            {类别: 命中的模式}，每个类别取按添加顺序第一个命中的模式；没有命中返回空字典
+        """
+        if not text:
+            return {}
+        
+        # 未使用自动机，或文本含非ASCII字符（忽略大小写的锚点不可靠）时逐个匹配
+        if not self._automata or not text.isascii():
+            found: Dict[str, str] = {}
+            for category, pattern, search, _, _ in self._patterns:
+                if category not in found and search(text):
+                    found[category] = pattern
+            return found
+        
+        candidates = set(self._unanchored)
+        lowered = None
+        for automaton, ignore_case in self._automata:
+            if ignore_case:
+                if lowered is None:
+                    lowered = text.lower()
+                candidates.update(automaton.find_all(lowered))
+            else:
+                candidates.update(automaton.find_all(text))
+        if not candidates:
+            return {}
+        
+        found = {}
+        patterns = self._patterns
+        exact = self._exact
+        for index in sorted(candidates):
+            category, pattern, search, _, _ = patterns[index]
+            if category not in found and (index in exact or search(text)):
+                found[category] = pattern
+        return found
+    
+    def get_stats(self) -> Dict:
+        """编译结果统计"""
+        return {
+            'patterns': len(self._patterns),
+            'categories': len(self.categories),
+            'automaton': bool(self._automata),
+            'automaton_states': sum(len(automaton) for automaton, _ in self._automata),
+            'anchored': len(self._patterns) - len(self._unanchored) if self._automata else 0,
+            'unanchored': len(self._unanchored),
+            'invalid': len(self.invalid),
+            'native_automaton': ahocorasick is not None,
+        }
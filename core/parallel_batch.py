@@ -0,0 +1,231 @@
+"""
+并行批量日志处理
+将历史日志按行对齐的字节区间切分，在进程池中并行解析并生成指纹，
+主进程按区间顺序合并结果，同一IP的日志按时间顺序交给处理流程
+"""
+import heapq
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from .log_monitor import NginxLogParser
+from .log_source import PipelinedLineReader, expand_log_paths, is_compressed
+
+
+# 工作进程内的解析器和指纹生成器（由_init_worker创建）
+_parser = None
+_fingerprint_gen = None
+
+
+def _init_worker(log_format: str, config: Dict):
+    """工作进程初始化"""
+    global _parser, _fingerprint_gen
+    from .fingerprint import FingerprintGenerator
+    
+    _parser = NginxLogParser(log_format, config.get('nginx', {}).get('json_fields'))
+    _fingerprint_gen = FingerprintGenerator(config)
+
+
+def _process_segment(task: Tuple[str, int, int]) -> Tuple[List[Dict], int, int]:
+    """
+    解析一个字节区间并生成指纹
+    
+    Returns:
+        (按时间排序的日志列表（同一IP内保持稳定顺序）, 解析成功行数, 解析失败行数)
+    """
+    log_file, start, end = task
+    with open(log_file, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _process_lines((log_file, data.decode('utf-8', errors='ignore').splitlines()))
+
+
+def _process_lines(task: Tuple[str, List[str]]) -> Tuple[List[Dict], int, int]:
+    """解析一批日志行并生成指纹（压缩日志无法按字节切分，由主进程解压后分批下发）"""
+    log_file, lines = task
+    by_ip: Dict[str, List[Dict]] = {}
+    errors = 0
+    for line in lines:
+        if not line:
+            continue
+        entry = _parser.parse_line(line)
+        if not entry:
+            errors += 1
+            continue
+        entry['source'] = log_file
+        entry['base_hash'] = _fingerprint_gen.generate_base_hash(entry)
+        entry['behavior_hash'] = _fingerprint_gen.generate_behavior_hash(entry)
+        by_ip.setdefault(entry['ip'], []).append(entry)
+    
+    for ip_entries in by_ip.values():
+        # 稳定排序：时间相同的日志保持原有顺序
+        ip_entries.sort(key=lambda e: e['timestamp'])
+    # 各IP的日志按时间归并回一个序列，避免排在后面的IP整体落后于水位线被当作迟到日志丢弃
+    entries = list(heapq.merge(*by_ip.values(), key=lambda e: e['timestamp']))
+    return entries, len(entries), errors
+
+
+def split_offsets(log_file: str, segment_size: int) -> List[Tuple[int, int]]:
+    """
+    将文件切分为按行对齐的字节区间
+    
+    Returns:
+        [(start, end), ...]，每个区间都从行首开始、在换行符之后结束
+    """
+    size = os.path.getsize(log_file)
+    boundaries = [0]
+    with open(log_file, 'rb') as f:
+        pos = segment_size
+        while pos < size:
+            f.seek(pos)
+            f.readline()
+            aligned = f.tell()
+            if aligned >= size:
+                break
+            if aligned > boundaries[-1]:
+                boundaries.append(aligned)
+            pos = aligned + segment_size
+    boundaries.append(size)
+    return [(boundaries[i], boundaries[i + 1]) for i in range(len(boundaries) - 1)
+            if boundaries[i + 1] > boundaries[i]]
+
+
+def _format_eta(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+class ParallelBatchLogProcessor:
+    """
+    并行批量日志处理器 - 用于回填大量历史日志
+    
+    解析和指纹计算在工作进程中完成；检测、入库等有状态的处理仍在主进程中
+    按区间顺序串行执行，保证同一IP的日志按时间顺序被检测
+    """
+    
+    def __init__(self, log_format: str, config: Dict, callback: Callable,
+                 workers: Optional[int] = None,
+                 segment_size: int = 16 * 1024 * 1024,
+                 progress_interval: float = 5.0):
+        """
+        Args:
+            log_format: 日志格式（同NginxLogParser）
+            config: 系统配置（工作进程用于创建指纹生成器）
+            callback: 处理单条日志的回调（日志已包含base_hash/behavior_hash）
+            workers: 工作进程数（默认为CPU核数）
+            segment_size: 每个任务处理的字节数
+            progress_interval: 打印进度的间隔（秒）
+        """
+        self.log_format = log_format
+        self.config = config
+        self.callback = callback
+        self.workers = workers or os.cpu_count() or 1
+        self.segment_size = segment_size
+        self.progress_interval = progress_interval
+    
+    def process_file(self, log_file: str, max_lines: Optional[int] = None):
+        """
+        处理日志文件
+        
+        Args:
+            log_file: 日志文件路径、目录或通配符（支持压缩日志，多个文件按时间顺序处理）
+            max_lines: 最多处理的行数（None表示全部）
+        """
+        log_files = expand_log_paths(
+            log_file, NginxLogParser(self.log_format, self.config.get('nginx', {}).get('json_fields')))
+        if not log_files or not os.path.exists(log_files[0]):
+            print(f"错误: 日志文件不存在: {log_file}")
+            return
+        
+        total_bytes = sum(os.path.getsize(path) for path in log_files)
+        print(f"开始并行处理日志: {log_file} "
+              f"({len(log_files)} 个文件, {total_bytes / 1024 / 1024:.1f} MiB, {self.workers} 个进程)")
+        
+        processed = 0
+        errors = 0
+        done_bytes = 0
+        started = time.time()
+        last_report = started
+        
+        with Pool(self.workers, _init_worker, (self.log_format, self.config)) as pool:
+            tasks = self._iter_tasks(log_files)
+            pending = deque()
+            
+            # 限制在途任务数，避免解析结果在内存中堆积
+            def submit():
+                while len(pending) < self.workers * 2:
+                    task = next(tasks, None)
+                    if task is None:
+                        return
+                    func, args, weight = task
+                    pending.append((weight, pool.apply_async(func, (args,))))
+            
+            submit()
+            while pending:
+                weight, result = pending.popleft()
+                entries, _, parse_errors = result.get()
+                submit()
+                
+                errors += parse_errors
+                for entry in entries:
+                    if max_lines and processed >= max_lines:
+                        break
+                    try:
+                        self.callback(entry)
+                        processed += 1
+                    except Exception as e:
+                        errors += 1
+                        if errors <= 10:  # 只打印前10个错误
+                            print(f"处理日志行时出错: {e}")
+                
+                done_bytes += weight
+                if max_lines and processed >= max_lines:
+                    tasks.close()
+                    pool.terminate()
+                    break
+                
+                now = time.time()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    self._report(processed, done_bytes, total_bytes, now - started)
+        
+        elapsed = time.time() - started
+        rate = processed / elapsed if elapsed > 0 else 0
+        print(f"处理完成: 成功 {processed} 行, 错误 {errors} 行, "
+              f"耗时 {elapsed:.1f} 秒 ({rate:.0f} 行/秒)")
+    
+    def _iter_tasks(self, log_files: List[str]) -> Iterator[Tuple[Callable, tuple, int]]:
+        """
+        按文件顺序生成任务 (函数, 参数, 计入进度的字节数)
+        普通文件按字节区间切分；压缩文件由后台线程流式解压，按解压后的大小分批
+        """
+        for path in log_files:
+            if not is_compressed(path):
+                for start, end in split_offsets(path, self.segment_size):
+                    yield _process_segment, (path, start, end), end - start
+                continue
+            
+            # 解压后的总大小未知，压缩文件在最后一批完成时整体计入进度
+            batch, batch_bytes = [], 0
+            reader = PipelinedLineReader(path)
+            try:
+                for lines in reader:
+                    batch.extend(lines)
+                    batch_bytes += sum(len(line) + 1 for line in lines)
+                    if batch_bytes >= self.segment_size:
+                        yield _process_lines, (path, batch), 0
+                        batch, batch_bytes = [], 0
+            finally:
+                reader.close()
+            yield _process_lines, (path, batch), os.path.getsize(path)
+    
+    @staticmethod
+    def _report(processed: int, done_bytes: int, total_bytes: int, elapsed: float):
+        """打印进度：速度和预计剩余时间（按已处理字节比例估算）"""
+        rate = processed / elapsed if elapsed > 0 else 0
+        progress = done_bytes / total_bytes if total_bytes else 1.0
+        eta = elapsed / progress - elapsed if progress > 0 else 0
+        print(f"进度 {progress * 100:.1f}%: 已处理 {processed} 行, "
+              f"{rate:.0f} 行/秒, 预计剩余 {_format_eta(eta)}")
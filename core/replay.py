@@ -0,0 +1,168 @@
+"""
+日志回放
+按日志自身的时间驱动虚拟时钟，以指定倍速（或不限速）回放历史日志，
+用于端到端吞吐量测试、参数调优以及确定性地复现安全事件
+"""
+import os
+import time
+from typing import Callable, Dict, Optional
+
+from .clock import VirtualClock
+from .log_monitor import NginxLogParser
+from .log_source import PipelinedLineReader, expand_log_paths
+
+
+def parse_speed(value: str) -> Optional[float]:
+    """
+    解析回放速度
+    
+    Args:
+        value: "50x"、"50" 或 "max"
+    
+    Returns:
+        倍速，"max"返回None（不等待，尽快处理）
+    
+    Raises:
+        ValueError: 无法识别的速度
+    """
+    value = value.strip().lower()
+    if value == 'max':
+        return None
+    speed = float(value[:-1] if value.endswith('x') else value)
+    if speed <= 0:
+        raise ValueError(f"回放速度必须大于0: {value}")
+    return speed
+
+
+class ReplayEngine:
+    """
+    日志回放引擎
+    
+    每条日志交给处理流程之前先将虚拟时钟推进到该日志的时间，
+    检测、评分、规则等模块看到的"当前时间"只取决于日志内容，与回放速度无关
+    """
+    
+    def __init__(self, parser: NginxLogParser, callback: Callable, clock: VirtualClock,
+                 speed: Optional[float] = None,
+                 progress_interval: float = 5.0):
+        """
+        Args:
+            parser: 日志解析器
+            callback: 处理单条日志的回调
+            clock: 注入到各模块的虚拟时钟
+            speed: 回放倍速（None表示不限速）
+            progress_interval: 打印进度的间隔（秒）
+        """
+        self.parser = parser
+        self.callback = callback
+        self.clock = clock
+        self.speed = speed
+        self.progress_interval = progress_interval
+        
+        self.stats = {
+            'processed': 0,      # 处理的日志条数
+            'errors': 0,         # 解析或处理失败的条数
+            'log_seconds': 0.0,  # 回放的日志时间跨度
+            'wall_seconds': 0.0, # 实际耗时
+            'max_lag_ms': 0.0,   # 限速回放时处理落后于计划的最大时间
+        }
+    
+    def replay(self, log_file: str, max_lines: Optional[int] = None) -> Dict:
+        """
+        回放日志
+        
+        Args:
+            log_file: 日志文件路径、目录或通配符（支持压缩日志）
+            max_lines: 最多回放的行数（None表示全部）
+        
+        Returns:
+            回放统计
+        """
+        log_files = expand_log_paths(log_file, self.parser)
+        if not log_files or not os.path.exists(log_files[0]):
+            print(f"错误: 日志文件不存在: {log_file}")
+            return self.stats
+        
+        speed_text = f"{self.speed:g}x" if self.speed else "max"
+        print(f"开始回放日志: {log_file} ({len(log_files)} 个文件, 速度 {speed_text})")
+        
+        first_epoch = None
+        last_epoch = None
+        started = time.perf_counter()
+        last_report = started
+        
+        for path in log_files:
+            reader = PipelinedLineReader(path)
+            try:
+                for lines in reader:
+                    for line in lines:
+                        if max_lines and self.stats['processed'] >= max_lines:
+                            break
+                        
+                        entry = self.parser.parse_line(line)
+                        if not entry:
+                            if line.strip():
+                                self.stats['errors'] += 1
+                            continue
+                        entry['source'] = path
+                        
+                        epoch = entry['epoch']
+                        if first_epoch is None:
+                            first_epoch = epoch
+                        if last_epoch is None or epoch > last_epoch:
+                            last_epoch = epoch
+                        if self.speed:
+                            self._pace(started, epoch - first_epoch)
+                        
+                        self.clock.advance(epoch)
+                        try:
+                            self.callback(entry)
+                            self.stats['processed'] += 1
+                        except Exception as e:
+                            self.stats['errors'] += 1
+                            if self.stats['errors'] <= 10:  # 只打印前10个错误
+                                print(f"处理日志行时出错: {e}")
+                    
+                    if max_lines and self.stats['processed'] >= max_lines:
+                        break
+                    
+                    now = time.perf_counter()
+                    if now - last_report >= self.progress_interval:
+                        last_report = now
+                        self._report(now - started, (last_epoch or 0) - (first_epoch or 0))
+            finally:
+                reader.close()
+            
+            if max_lines and self.stats['processed'] >= max_lines:
+                break
+        
+        self.stats['wall_seconds'] = time.perf_counter() - started
+        self.stats['log_seconds'] = (last_epoch - first_epoch) if first_epoch is not None else 0.0
+        self._summary()
+        return self.stats
+    
+    def _pace(self, started: float, log_offset: float):
+        """限速回放：等待到该日志按倍速换算后的计划时间"""
+        delay = started + log_offset / self.speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif -delay * 1000 > self.stats['max_lag_ms']:
+            self.stats['max_lag_ms'] = -delay * 1000
+    
+    def _report(self, elapsed: float, log_seconds: float):
+        """打印进度"""
+        rate = self.stats['processed'] / elapsed if elapsed > 0 else 0
+        speed = log_seconds / elapsed if elapsed > 0 else 0
+        print(f"回放进度: 已处理 {self.stats['processed']} 行, {rate:.0f} 行/秒, "
+              f"日志时间 {self.clock.now().strftime('%Y-%m-%d %H:%M:%S')} (实际 {speed:.1f}x)")
+    
+    def _summary(self):
+        """打印回放结果"""
+        stats = self.stats
+        elapsed = stats['wall_seconds']
+        rate = stats['processed'] / elapsed if elapsed > 0 else 0
+        speed = stats['log_seconds'] / elapsed if elapsed > 0 else 0
+        print(f"回放完成: 成功 {stats['processed']} 行, 错误 {stats['errors']} 行, "
+              f"耗时 {elapsed:.1f} 秒 ({rate:.0f} 行/秒)")
+        print(f"  日志时间跨度 {stats['log_seconds']:.0f} 秒, 实际倍速 {speed:.1f}x"
+              + (f", 最大落后 {stats['max_lag_ms']:.0f}ms" if self.speed else ''))
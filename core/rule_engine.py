@@ -3,22 +3,25 @@
 允许用户定义灵活的检测规则
 """
 import re
-from typing import Dict, List, Any
-from datetime import datetime, time
+from typing import Dict, List, Any, Optional
+from datetime import time
+
+from .clock import Clock, SYSTEM_CLOCK
 
 
 class RuleEngine:
     """自定义规则引擎"""
     
-    def __init__(self, db, config: Dict):
+    def __init__(self, db, config: Dict, clock: Optional[Clock] = None):
         self.db = db
         self.config = config
+        self.clock = clock or SYSTEM_CLOCK
         self.rules = []
         
         # 从配置加载规则
         custom_rules = config.get('custom_rules', [])
         for rule_data in custom_rules:
-            self.add_rule(CustomRule(rule_data))
+            self.add_rule(CustomRule(rule_data, self.clock))
         
         # 从数据库加载规则
         self.load_rules_from_db()
@@ -73,7 +76,7 @@ class RuleEngine:
                     'priority': db_rule.priority,
                     'enabled': db_rule.enabled
                 }
-                self.add_rule(CustomRule(rule_data))
+                self.add_rule(CustomRule(rule_data, self.clock))
         finally:
             session.close()
     
@@ -107,7 +110,7 @@ class RuleEngine:
 class CustomRule:
     """自定义规则"""
     
-    def __init__(self, rule_data: Dict):
+    def __init__(self, rule_data: Dict, clock: Optional[Clock] = None):
         self.name = rule_data['name']
         self.description = rule_data.get('description', '')
         self.conditions = rule_data.get('conditions', {})
@@ -115,6 +118,7 @@ class CustomRule:
         self.action = rule_data.get('action', 'score')
         self.priority = rule_data.get('priority', 0)
         self.enabled = rule_data.get('enabled', True)
+        self.clock = clock or SYSTEM_CLOCK
         
         # 编译正则表达式（如果有）
         self._compile_patterns()
@@ -217,7 +221,7 @@ class CustomRule:
             start_time = time.fromisoformat(start_str.strip())
             end_time = time.fromisoformat(end_str.strip())
             
-            current_time = datetime.now().time()
+            current_time = self.clock.now().time()
             
             if start_time <= end_time:
                 return start_time <= current_time <= end_time
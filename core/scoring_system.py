@@ -2,10 +2,12 @@
 用户威胁评分系统
 对每个用户的行为进行评分，累计分数达到阈值时采取行动
 """
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Dict, List, Tuple, Optional
 import json
 
+from .clock import Clock, SYSTEM_CLOCK
+
 
 class ThreatScoringSystem:
     """威胁评分系统"""
@@ -36,10 +38,11 @@ class ThreatScoringSystem:
         'rapid_behavior_change': 25,
     }
     
-    def __init__(self, db, config: Dict):
+    def __init__(self, db, config: Dict, clock: Optional[Clock] = None):
         self.db = db
         self.config = config
         self.scoring_config = config.get('scoring_system', {})
+        self.clock = clock or SYSTEM_CLOCK
         
         # 是否启用评分系统
         self.enabled = self.scoring_config.get('enabled', True)
@@ -83,8 +86,8 @@ class ThreatScoringSystem:
         threat_type = threat.get('threat_type')
         severity = threat.get('severity', 'medium')
         
-        # 基础分数（从配置读取）
-        base_score = self.threat_scores.get(threat_type, 10)
+        # 基础分数：命中的检测规则设置了分数时使用规则的分数，否则从配置读取
+        base_score = threat.get('threat_score') or self.threat_scores.get(threat_type, 10)
         
         # 严重程度乘数（从配置读取）
         multiplier = self.severity_multipliers.get(severity, 1.0)
@@ -95,7 +98,8 @@ class ThreatScoringSystem:
         return final_score
     
     def add_score_to_fingerprint(self, base_hash: str, score: float, 
-                                 reason: str, threat_id: Optional[int] = None):
+                                 reason: str, threat_id: Optional[int] = None,
+                                 uow=None):
         """
         为指纹添加分数
         
@@ -104,15 +108,19 @@ class ThreatScoringSystem:
             score: 要添加的分数
             reason: 评分原因
             threat_id: 关联的威胁事件ID
+            uow: 工作单元（传入时使用缓存的指纹状态，由工作单元统一提交）
         """
         from models.database import Fingerprint, ScoreHistory
         
-        session = self.db.get_session()
+        session = uow.session if uow else self.db.get_session()
         try:
-            # 获取或创建指纹
-            fingerprint = session.query(Fingerprint).filter(
-                Fingerprint.base_hash == base_hash
-            ).first()
+            # 获取指纹
+            if uow:
+                fingerprint = uow.get_state(base_hash)
+            else:
+                fingerprint = session.query(Fingerprint).filter(
+                    Fingerprint.base_hash == base_hash
+                ).first()
             
             if not fingerprint:
                 return
@@ -122,29 +130,40 @@ class ThreatScoringSystem:
             
             # 添加新分数
             new_score = current_score + score
-            fingerprint.threat_score = min(200, int(new_score))  # 最高200分
-            fingerprint.last_score_update = datetime.now()
+            threat_score = min(200, int(new_score))  # 最高200分
+            now = self.clock.now()
+            if uow:
+                uow.update_state(base_hash, threat_score=threat_score, last_score_update=now)
+            else:
+                fingerprint.threat_score = threat_score
+                fingerprint.last_score_update = now
             
             # 记录评分历史
             score_history = ScoreHistory(
                 fingerprint_id=fingerprint.id,
                 base_hash=base_hash,
                 score_change=score,
-                total_score=fingerprint.threat_score,
+                total_score=threat_score,
                 reason=reason,
-                threat_event_id=threat_id
+                threat_event_id=threat_id,
+                timestamp=now
             )
             session.add(score_history)
             
-            session.commit()
+            if not uow:
+                session.commit()
+                self.db.invalidate_fingerprint_cache(base_hash)
             
-            return fingerprint.threat_score
+            return threat_score
         except Exception as e:
+            if uow:
+                raise
             session.rollback()
             print(f"添加评分失败: {e}")
             return None
         finally:
-            session.close()
+            if not uow:
+                session.close()
     
     def _apply_score_decay(self, fingerprint) -> float:
         """
@@ -161,7 +180,7 @@ class ThreatScoringSystem:
             return fingerprint.threat_score
         
         # 计算时间差（小时）
-        time_diff = datetime.now() - fingerprint.last_score_update
+        time_diff = self.clock.now() - fingerprint.last_score_update
         hours_passed = time_diff.total_seconds() / 3600
         
         # 如果超过衰减周期，应用衰减
@@ -172,34 +191,44 @@ class ThreatScoringSystem:
         
         return fingerprint.threat_score
     
-    def get_fingerprint_score(self, base_hash: str) -> Tuple[float, str]:
+    def get_fingerprint_score(self, base_hash: str, uow=None) -> Tuple[float, str]:
         """
         获取指纹的当前分数和风险等级
         
+        Args:
+            base_hash: 基础指纹哈希
+            uow: 工作单元（传入时使用缓存的指纹状态）
+        
         Returns:
             (score, risk_level)
         """
         from models.database import Fingerprint
         
+        if uow:
+            return self._score_and_risk(uow.get_state(base_hash))
+        
         session = self.db.get_session()
         try:
             fingerprint = session.query(Fingerprint).filter(
                 Fingerprint.base_hash == base_hash
             ).first()
-            
-            if not fingerprint:
-                return 0.0, 'safe'
-            
-            # 应用衰减
-            current_score = self._apply_score_decay(fingerprint)
-            
-            # 确定风险等级
-            risk_level = self._determine_risk_level(current_score)
-            
-            return current_score, risk_level
+            return self._score_and_risk(fingerprint)
         finally:
             session.close()
     
+    def _score_and_risk(self, fingerprint) -> Tuple[float, str]:
+        """计算指纹衰减后的分数和风险等级"""
+        if not fingerprint:
+            return 0.0, 'safe'
+        
+        # 应用衰减
+        current_score = self._apply_score_decay(fingerprint)
+        
+        # 确定风险等级
+        risk_level = self._determine_risk_level(current_score)
+        
+        return current_score, risk_level
+    
     def _determine_risk_level(self, score: float) -> str:
         """确定风险等级"""
         if score >= self.thresholds['permanent_ban']:
@@ -213,24 +242,34 @@ class ThreatScoringSystem:
         else:
             return 'safe'      # 安全
     
-    def should_ban(self, base_hash: str) -> Tuple[bool, Optional[str], Optional[int]]:
+    def should_ban(self, base_hash: str, uow=None) -> Tuple[bool, Optional[str], Optional[int]]:
         """
         判断是否应该封禁该指纹
         
+        Args:
+            base_hash: 基础指纹哈希
+            uow: 工作单元（传入时复用已加载的指纹）
+        
         Returns:
             (should_ban, ban_type, duration_seconds)
         """
-        score, risk_level = self.get_fingerprint_score(base_hash)
+        score, risk_level = self.get_fingerprint_score(base_hash, uow)
         
-        # 判断封禁级别
+        ban_type = self.get_ban_type(score)
+        if ban_type:
+            return True, ban_type, self.ban_durations[ban_type]
+        
+        return False, None, None
+    
+    def get_ban_type(self, score: float) -> Optional[str]:
+        """分数对应的封禁级别（未达到封禁阈值返回None）"""
         if score >= self.thresholds['permanent_ban']:
-            return True, 'permanent_ban', self.ban_durations['permanent_ban']
+            return 'permanent_ban'
         elif score >= self.thresholds['extended_ban']:
-            return True, 'extended_ban', self.ban_durations['extended_ban']
+            return 'extended_ban'
         elif score >= self.thresholds['temporary_ban']:
-            return True, 'temporary_ban', self.ban_durations['temporary_ban']
-        
-        return False, None, None
+            return 'temporary_ban'
+        return None
     
     def add_behavior_pattern_score(self, base_hash: str, pattern_type: str):
         """
@@ -297,7 +336,7 @@ class ThreatScoringSystem:
             if fingerprint:
                 old_score = fingerprint.threat_score
                 fingerprint.threat_score = 0
-                fingerprint.last_score_update = datetime.now()
+                fingerprint.last_score_update = self.clock.now()
                 
                 # 记录重置
                 score_history = ScoreHistory(
@@ -305,11 +344,13 @@ class ThreatScoringSystem:
                     base_hash=base_hash,
                     score_change=-old_score,
                     total_score=0,
-                    reason=reason
+                    reason=reason,
+                    timestamp=fingerprint.last_score_update
                 )
                 session.add(score_history)
                 
                 session.commit()
+                self.db.invalidate_fingerprint_cache(base_hash)
                 return True
         except Exception as e:
             session.rollback()
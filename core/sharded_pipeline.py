@@ -0,0 +1,350 @@
+"""
+按IP分片的多进程处理流程
+日志按IP（或base_hash）的一致性哈希路由到固定的工作进程，每个进程独占这些IP的
+检测窗口和规则状态，无需加锁；每个分片在主进程中有各自的写入线程，
+这些IP的入库、指纹、评分和封禁只由该线程按顺序执行，各分片之间并行写入
+"""
+import os
+import queue
+import signal
+import threading
+import time
+import zlib
+from collections import deque
+import multiprocessing
+from multiprocessing import Queue
+from typing import Callable, Dict, List, Optional
+
+
+# 分片键
+SHARD_KEY_IP = 'ip'
+SHARD_KEY_BASE_HASH = 'base_hash'
+
+
+def jump_hash(key: int, num_buckets: int) -> int:
+    """
+    一致性哈希（Jump Consistent Hash）
+    
+    工作进程数从N变为N+1时只有约1/(N+1)的键改变归属，
+    其余IP的检测窗口仍留在原来的进程中
+    
+    Args:
+        key: 64位整数键
+        num_buckets: 分片数
+    
+    Returns:
+        分片编号 [0, num_buckets)
+    """
+    b, j = -1, 0
+    while j < num_buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return b
+
+
+def shard_for(value: str, num_shards: int) -> int:
+    """计算字符串键（IP或base_hash）所属的分片"""
+    data = (value or '').encode('utf-8')
+    # crc32在各进程间稳定（内置hash()按进程随机化，不能用于路由）
+    key = (zlib.crc32(data) << 32) | zlib.adler32(data)
+    return jump_hash(key, num_shards)
+
+
+class ShardAnalyzer:
+    """
+    分片内的无数据库分析阶段：生成指纹哈希、评估自定义规则、威胁检测
+    
+    同一IP的日志总是由同一个分析器按顺序处理，滑动窗口等内存状态只属于该分片
+    """
+    
+    def __init__(self, config: Dict, db=None):
+        """
+        Args:
+            config: 系统配置
+            db: 数据库（用于加载数据库中的自定义规则，None时在进程内新建连接）
+        """
+        from .fingerprint import FingerprintGenerator
+        from .rule_engine import RuleEngine
+        from .threat_detector import ThreatDetector
+        from models.database import Database
+        
+        if db is None:
+            db = Database(config)
+        self.fingerprint_gen = FingerprintGenerator(config)
+        self.threat_detector = ThreatDetector(db, config)
+        self.rule_engine = RuleEngine(db, config)
+    
+    def analyze(self, log_data: Dict) -> tuple:
+        """
+        分析单条日志
+        
+        Returns:
+            (base_hash, behavior_hash, 匹配的自定义规则列表, 检测到的威胁列表)
+        """
+        if not log_data.get('base_hash'):
+            log_data['base_hash'] = self.fingerprint_gen.generate_base_hash(log_data)
+        if not log_data.get('behavior_hash'):
+            log_data['behavior_hash'] = self.fingerprint_gen.generate_behavior_hash(log_data)
+        
+        rule_matches = self.rule_engine.evaluate(log_data)
+        threats = self.threat_detector.detect(log_data)
+        return log_data['base_hash'], log_data['behavior_hash'], rule_matches, threats
+
+
+def _worker_main(index: int, config: Dict, in_queue: Queue, out_queue: Queue):
+    """工作进程：逐批分析日志，将结果交给该分片的写入线程"""
+    # 停止由主进程统一协调（发送结束标记），工作进程忽略终端信号
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    
+    analyzer = ShardAnalyzer(config)
+    # 工作进程各自检查检测规则版本，规则修改后由后台线程重新编译
+    analyzer.threat_detector.start_rule_refresh(
+        config.get('threat_detection', {}).get('rules_refresh_interval', 5)
+    )
+    while True:
+        batch = in_queue.get()
+        if batch is None:
+            break
+        
+        # 只回传分析结果（与批次中的日志一一对应，失败为None），日志本身留在主进程中
+        started = time.perf_counter()
+        results = []
+        errors = 0
+        for entry in batch:
+            try:
+                results.append(analyzer.analyze(entry))
+            except Exception as e:
+                results.append(None)
+                errors += 1
+                if errors <= 10:  # 只打印前10个错误
+                    print(f"分片 {index} 分析日志时出错: {e}")
+        out_queue.put((index, results, errors, time.perf_counter() - started))
+    
+    # 结束标记：该分片的写入线程收到后退出
+    out_queue.put((index, None, 0, 0.0))
+
+
+class ShardedPipeline:
+    """
+    按IP分片的多进程处理流程
+    
+    读取线程调用put()，日志按分片键路由到各工作进程的输入队列；
+    工作进程完成分析后，该分片的写入线程按发送顺序调用result_callback执行入库、评分和封禁
+    （result_callback会被各分片的写入线程并发调用）
+    """
+    
+    def __init__(self, config: Dict, result_callback: Callable,
+                 workers: Optional[int] = None,
+                 shard_key: str = SHARD_KEY_IP,
+                 queue_batches: int = 64,
+                 fingerprint_gen=None,
+                 start_method: str = 'spawn'):
+        """
+        Args:
+            config: 系统配置（工作进程用于创建检测器和规则引擎）
+            result_callback: 写入回调，接收 [(log_data, rule_matches, threats), ...]，需线程安全
+            workers: 工作进程数（默认为CPU核数）
+            shard_key: 分片键 ip / base_hash
+            queue_batches: 每个工作进程输入队列最多积压的批次数（满时put()阻塞，形成背压）
+            fingerprint_gen: 按base_hash分片时用于在路由前生成哈希
+            start_method: 工作进程的启动方式 spawn / forkserver / fork；
+                主进程在创建流程前已启动写缓冲、聚合器等后台线程，fork可能复制其他线程持有的锁而死锁
+        
+        Raises:
+            ValueError: 未知的分片键或启动方式
+        """
+        if shard_key not in (SHARD_KEY_IP, SHARD_KEY_BASE_HASH):
+            raise ValueError(f"未知的分片键: {shard_key}（可选: ip, base_hash）")
+        
+        self._context = multiprocessing.get_context(start_method)
+        self.config = config
+        self.result_callback = result_callback
+        self.workers = workers or os.cpu_count() or 1
+        self.shard_key = shard_key
+        self.queue_batches = queue_batches
+        
+        if shard_key == SHARD_KEY_BASE_HASH and fingerprint_gen is None:
+            from .fingerprint import FingerprintGenerator
+            fingerprint_gen = FingerprintGenerator(config)
+        self.fingerprint_gen = fingerprint_gen
+        
+        self.running = False
+        self._in_queues: List[Queue] = []
+        self._out_queues: List[Queue] = []
+        self._processes: List[multiprocessing.process.BaseProcess] = []
+        # 每个分片已发送、等待分析结果的批次（输入输出队列都是先进先出，结果按发送顺序返回）
+        self._sent = [deque() for _ in range(self.workers)]
+        self._writers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        
+        # 每个分片的统计
+        self.shard_stats = [self._new_shard_stats() for _ in range(self.workers)]
+        self.stats = {
+            'written': 0,           # 各写入线程处理完成的日志条数
+            'write_batches': 0,
+            'write_errors': 0,
+            'write_seconds': 0.0,   # 写入回调累计耗时（各写入线程之和）
+        }
+    
+    @staticmethod
+    def _new_shard_stats() -> Dict:
+        return {
+            'routed': 0,            # 路由到该分片的日志条数
+            'analyzed': 0,          # 分析完成的日志条数
+            'errors': 0,
+            'batches': 0,
+            'max_pending': 0,       # 已路由但未分析完成的最大条数
+            'busy_seconds': 0.0,    # 工作进程分析耗时
+        }
+    
+    def get_stats(self) -> Dict:
+        """获取流程统计（含每个分片的积压条数和队列深度）"""
+        shards = []
+        with self._lock:
+            for index, shard in enumerate(self.shard_stats):
+                item = dict(shard)
+                item['shard'] = index
+                item['pending'] = shard['routed'] - shard['analyzed'] - shard['errors']
+                try:
+                    item['queue_batches'] = self._in_queues[index].qsize()
+                except (IndexError, NotImplementedError):
+                    # macOS不支持Queue.qsize()
+                    item['queue_batches'] = None
+                shards.append(item)
+            stats = dict(self.stats)
+        
+        stats['workers'] = self.workers
+        stats['shard_key'] = self.shard_key
+        stats['pending'] = sum(shard['pending'] for shard in shards)
+        stats['shards'] = shards
+        return stats
+    
+    def start(self):
+        """启动工作进程和各分片的写入线程"""
+        self.running = True
+        for index in range(self.workers):
+            in_queue = self._context.Queue(self.queue_batches)
+            out_queue = self._context.Queue(self.queue_batches)
+            process = self._context.Process(target=_worker_main, name=f'shard-worker-{index}',
+                                            args=(index, self.config, in_queue, out_queue), daemon=True)
+            process.start()
+            self._in_queues.append(in_queue)
+            self._out_queues.append(out_queue)
+            self._processes.append(process)
+        
+        for index in range(self.workers):
+            writer = threading.Thread(target=self._write_loop, args=(index,),
+                                      name=f'shard-writer-{index}', daemon=True)
+            writer.start()
+            self._writers.append(writer)
+        print(f"✓ 分片处理流程已启动 ({self.workers} 个工作进程, 按{self.shard_key}分片)")
+    
+    def stop(self, timeout: float = 30.0):
+        """
+        停止流程（各分片处理完已路由的日志、写入线程写完后返回）
+        
+        Args:
+            timeout: 等待剩余日志处理完成的最长时间（秒）
+        """
+        if not self.running:
+            return
+        self.running = False
+        
+        for in_queue in self._in_queues:
+            in_queue.put(None)
+        deadline = time.monotonic() + timeout
+        for writer in self._writers:
+            writer.join(max(0.0, deadline - time.monotonic()))
+        self._writers = []
+        
+        for process in self._processes:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        self._in_queues = []
+        self._out_queues = []
+    
+    # ==================== 路由（读取线程） ====================
+    
+    def put(self, entries: List[Dict]):
+        """按分片键把一批日志分发到各工作进程（输入队列满时阻塞）"""
+        batches = [[] for _ in range(self.workers)]
+        for entry in entries:
+            batches[self._route(entry)].append(entry)
+        
+        for index, batch in enumerate(batches):
+            if not batch:
+                continue
+            with self._lock:
+                shard = self.shard_stats[index]
+                shard['routed'] += len(batch)
+                pending = shard['routed'] - shard['analyzed'] - shard['errors']
+                if pending > shard['max_pending']:
+                    shard['max_pending'] = pending
+                self._sent[index].append(batch)
+            self._in_queues[index].put(batch)
+    
+    def put_one(self, entry: Dict):
+        """分发单条日志（非分块读取模式）"""
+        self.put([entry])
+    
+    def _route(self, entry: Dict) -> int:
+        """计算日志所属的分片"""
+        if self.workers == 1:
+            return 0
+        if self.shard_key == SHARD_KEY_BASE_HASH:
+            if not entry.get('base_hash'):
+                entry['base_hash'] = self.fingerprint_gen.generate_base_hash(entry)
+            return shard_for(entry['base_hash'], self.workers)
+        return shard_for(entry.get('ip'), self.workers)
+    
+    # ==================== 写入（主进程中各分片的写入线程） ====================
+    
+    def _write_loop(self, index: int):
+        """写入一个分片的分析结果（该分片的IP只由这个线程写入，同一IP的日志保持顺序）"""
+        out_queue = self._out_queues[index]
+        process = self._processes[index]
+        while True:
+            try:
+                _, analyzed, errors, busy = out_queue.get(timeout=0.5)
+            except queue.Empty:
+                if not self.running and not process.is_alive():
+                    return
+                continue
+            
+            if analyzed is None:
+                return
+            
+            with self._lock:
+                batch = self._sent[index].popleft()
+                shard = self.shard_stats[index]
+                shard['analyzed'] += len(batch) - errors
+                shard['errors'] += errors
+                shard['batches'] += 1
+                shard['busy_seconds'] += busy
+            
+            results = []
+            for entry, result in zip(batch, analyzed):
+                if result is None:
+                    continue
+                entry['base_hash'], entry['behavior_hash'], rule_matches, threats = result
+                results.append((entry, rule_matches, threats))
+            
+            started = time.perf_counter()
+            failed = False
+            try:
+                self.result_callback(results)
+            except Exception as e:
+                failed = True
+                print(f"写入分片 {index} 的处理结果时出错: {e}")
+            elapsed = time.perf_counter() - started
+            
+            with self._lock:
+                if failed:
+                    self.stats['write_errors'] += 1
+                self.stats['write_seconds'] += elapsed
+                self.stats['written'] += len(results)
+                self.stats['write_batches'] += 1
@@ -0,0 +1,299 @@
+"""
+Syslog日志接收器
+接收nginx通过 access_log syslog:server=... 推送的日志，作为文件跟踪之外的另一种日志来源
+"""
+import asyncio
+import socket
+import threading
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .log_monitor import NginxLogParser
+
+
+def parse_syslog_message(data: bytes) -> Tuple[Optional[str], str]:
+    """
+    从syslog报文中取出主机名和消息正文
+    
+    支持RFC 3164（<190>Oct 17 18:30:00 host nginx: msg）
+    和RFC 5424（<190>1 2025-10-17T18:30:00+08:00 host nginx - - - msg）
+    
+    Returns:
+        (主机名, 消息正文)，无法识别报头时整个报文作为正文
+    """
+    text = data.decode('utf-8', errors='ignore').rstrip('\r\n\0')
+    if not text.startswith('<'):
+        return None, text
+    end = text.find('>', 1, 5)
+    if end < 0:
+        return None, text
+    text = text[end + 1:]
+    
+    if text.startswith('1 '):
+        # RFC 5424: VERSION TIMESTAMP HOSTNAME APP-NAME PROCID MSGID STRUCTURED-DATA MSG
+        parts = text.split(' ', 6)
+        if len(parts) < 7:
+            return None, text
+        host = parts[2] if parts[2] != '-' else None
+        message = parts[6]
+        if message.startswith('['):
+            # 结构化数据
+            end = message.find('] ')
+            message = message[end + 2:] if end >= 0 else ''
+        elif message.startswith('- ') or message == '-':
+            message = message[2:]
+        if message.startswith('\ufeff'):
+            message = message[1:]
+        return host, message
+    
+    # RFC 3164: TIMESTAMP(15字符) HOSTNAME TAG: MSG
+    if len(text) > 16 and text[15] == ' ':
+        host, _, rest = text[16:].partition(' ')
+        tag_end = rest.find(': ')
+        if tag_end >= 0:
+            return host, rest[tag_end + 2:]
+    return None, text
+
+
+class _UdpProtocol(asyncio.DatagramProtocol):
+    def __init__(self, receiver: 'SyslogReceiver'):
+        self.receiver = receiver
+    
+    def datagram_received(self, data, addr):
+        self.receiver._receive(data)
+
+
+class SyslogReceiver:
+    """
+    Syslog日志接收器
+    
+    事件循环线程只负责收包：同一轮循环（tick）内收到的报文合并为一批放入有界缓冲区，
+    解析和处理在单独的线程中进行；缓冲区满时丢弃新数据并计数，处理变慢也不会阻塞socket
+    """
+    
+    def __init__(self, parser: NginxLogParser, callback: Callable,
+                 batch_callback: Optional[Callable] = None,
+                 host: str = '0.0.0.0',
+                 udp_port: Optional[int] = 514,
+                 tcp_port: Optional[int] = None,
+                 max_buffer_lines: int = 100000,
+                 recv_buffer_bytes: int = 4 * 1024 * 1024,
+                 max_frame_bytes: int = 64 * 1024):
+        """
+        Args:
+            parser: 日志解析器
+            callback: 回调函数，处理解析后的日志行
+            batch_callback: 批量回调函数（设置后优先于callback）
+            host: 监听地址
+            udp_port: UDP端口（None表示不监听）
+            tcp_port: TCP端口（None表示不监听），支持RFC 6587/5425的长度前缀分帧和换行分帧
+            max_buffer_lines: 等待处理的最大行数，超出时丢弃
+            recv_buffer_bytes: UDP socket接收缓冲区大小（SO_RCVBUF）
+            max_frame_bytes: TCP单个报文的最大字节数，超出时关闭该连接（长度前缀由对端声明，不能直接信任）
+        """
+        self.parser = parser
+        self.callback = callback
+        self.batch_callback = batch_callback
+        self.host = host
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.max_buffer_lines = max_buffer_lines
+        self.recv_buffer_bytes = recv_buffer_bytes
+        self.max_frame_bytes = max_frame_bytes
+        self.running = False
+        
+        self._loop = None
+        self._stop_event = None
+        self._tcp_tasks = set()
+        
+        # 当前tick收到的报文
+        self._pending: List[bytes] = []
+        self._flush_scheduled = False
+        
+        # 等待处理的批次（有界）
+        self._buffer = deque()
+        self._buffered_lines = 0
+        self._cond = threading.Condition()
+        
+        self.stats = {
+            'received': 0,       # 收到的报文数
+            'dropped': 0,        # 缓冲区满被丢弃的报文数
+            'batches': 0,        # 处理的批次数
+            'entries': 0,        # 解析成功的日志条数
+            'parse_errors': 0,   # 无法解析的日志条数
+            'connections': 0,    # 累计TCP连接数
+            'oversized_frames': 0,   # 超过max_frame_bytes或分帧无效而关闭的TCP连接数
+        }
+    
+    def get_stats(self) -> Dict:
+        """获取运行统计"""
+        stats = dict(self.stats)
+        stats['buffered'] = self._buffered_lines
+        stats.update(self.parser.stats)
+        return stats
+    
+    def start(self):
+        """启动接收器（阻塞直到stop()）"""
+        self.running = True
+        worker = threading.Thread(target=self._process_loop, name='syslog-worker', daemon=True)
+        worker.start()
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.running = False
+            with self._cond:
+                self._cond.notify_all()
+            worker.join()
+    
+    def stop(self):
+        """停止接收器"""
+        self.running = False
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+    
+    # ==================== 接收（事件循环线程） ====================
+    
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if not self.running:
+            return
+        
+        transport = None
+        server = None
+        try:
+            if self.udp_port:
+                sock = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET,
+                                     socket.SOCK_DGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.recv_buffer_bytes)
+                sock.bind((self.host, self.udp_port))
+                transport, _ = await self._loop.create_datagram_endpoint(
+                    lambda: _UdpProtocol(self), sock=sock)
+                print(f"✓ Syslog UDP监听: {self.host}:{self.udp_port}")
+            
+            if self.tcp_port:
+                # limit限制按换行分帧时单行的长度
+                server = await asyncio.start_server(self._handle_tcp, self.host, self.tcp_port,
+                                                    limit=self.max_frame_bytes)
+                print(f"✓ Syslog TCP监听: {self.host}:{self.tcp_port}")
+            
+            await self._stop_event.wait()
+        finally:
+            if transport:
+                transport.close()
+            if server:
+                server.close()
+                for task in self._tcp_tasks:
+                    task.cancel()
+                await asyncio.gather(*self._tcp_tasks, return_exceptions=True)
+                await server.wait_closed()
+            self._flush()
+    
+    async def _handle_tcp(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """处理一个TCP连接：长度前缀分帧（"长度 报文"）或按换行分帧"""
+        self.stats['connections'] += 1
+        task = asyncio.current_task()
+        self._tcp_tasks.add(task)
+        try:
+            while self.running:
+                first = await reader.read(1)
+                if not first:
+                    break
+                if first.isdigit():
+                    token = first + await reader.readuntil(b' ')
+                    if token[:-1].isdigit():
+                        length = int(token[:-1])
+                        if length > self.max_frame_bytes:
+                            # 不按对端声明的长度分配内存，直接关闭连接
+                            self.stats['oversized_frames'] += 1
+                            break
+                        frame = await reader.readexactly(length)
+                    else:
+                        # 以数字开头的换行分帧报文（没有PRI报头）
+                        frame = token + await reader.readuntil(b'\n')
+                else:
+                    frame = first + await reader.readuntil(b'\n')
+                self._receive(frame)
+        except (asyncio.LimitOverrunError, ValueError):
+            # 单行超过max_frame_bytes，或长度前缀无法转换为整数
+            self.stats['oversized_frames'] += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # 停止时取消仍在等待数据的连接
+            pass
+        finally:
+            self._tcp_tasks.discard(task)
+            writer.close()
+    
+    def _receive(self, data: bytes):
+        """收到一个报文：加入当前tick的批次，并安排在本轮循环结束时提交"""
+        self.stats['received'] += 1
+        self._pending.append(data)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+    
+    def _flush(self):
+        """将本轮循环收到的报文作为一批放入缓冲区（不等待，满时丢弃）"""
+        self._flush_scheduled = False
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        
+        with self._cond:
+            room = self.max_buffer_lines - self._buffered_lines
+            if room < len(batch):
+                self.stats['dropped'] += len(batch) - max(room, 0)
+                batch = batch[:max(room, 0)]
+            if batch:
+                self._buffer.append(batch)
+                self._buffered_lines += len(batch)
+                self._cond.notify()
+    
+    # ==================== 处理（工作线程） ====================
+    
+    def _process_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer and self.running:
+                    self._cond.wait(0.5)
+                if not self._buffer:
+                    return
+                # 处理期间积压的批次合并为一批
+                batch = [data for pending in self._buffer for data in pending]
+                self._buffer.clear()
+                self._buffered_lines = 0
+            
+            self._dispatch(batch)
+    
+    def _dispatch(self, batch: List[bytes]):
+        """解析一批报文并交给回调处理"""
+        entries = []
+        parse_line = self.parser.parse_line
+        for data in batch:
+            host, message = parse_syslog_message(data)
+            entry = parse_line(message) if message else None
+            if not entry:
+                self.stats['parse_errors'] += 1
+                continue
+            entry['source'] = f"syslog:{host}" if host else 'syslog'
+            entries.append(entry)
+        
+        if not entries:
+            return
+        self.stats['batches'] += 1
+        self.stats['entries'] += len(entries)
+        
+        if self.batch_callback:
+            try:
+                self.batch_callback(entries)
+            except Exception as e:
+                print(f"批量处理日志时出错: {e}")
+            return
+        
+        for parsed in entries:
+            try:
+                self.callback(parsed)
+            except Exception as e:
+                print(f"处理日志行时出错: {e}")
@@ -0,0 +1,234 @@
+"""
+威胁事件聚合
+同一IP、同一威胁类型在聚合窗口内的重复命中不再各自写入ThreatEvent和ScoreHistory，
+而是合并到窗口内第一条事件的occurrence_count/last_seen，定期用一条批量UPDATE写入
+"""
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Optional, Tuple
+
+from sqlalchemy import bindparam, case, func
+
+
+class ThreatEventAggregator:
+    """
+    威胁事件聚合器
+    
+    窗口内第一次命中由调用方同步写入ThreatEvent（以及评分、封禁），提交后调用open_window()；
+    之后的命中通过fold()合并：累加次数、last_seen，分数按指纹（同一IP可能有多个指纹）暂存。
+    待计入的分数由调用方在会跨过封禁阈值或等待超过score_interval时用take_score()取出并一次写入，
+    窗口结束后仍未取出的由flush()交给score_sink写入。
+    命中时间是日志时间：命中是否属于窗口按日志时间判断；回填历史日志时窗口的日志时间早已过去，
+    因此窗口最多再保持window_seconds的时钟时间，到期后由flush()结束
+    """
+    
+    def __init__(self, engine, window_seconds: float = 60, score_interval_seconds: float = 10,
+                 flush_interval: Optional[float] = 1.0, max_pending: int = 10000,
+                 score_sink: Optional[Callable] = None, clock=None):
+        """
+        Args:
+            engine: SQLAlchemy引擎
+            window_seconds: 聚合窗口（秒，从第一次命中开始计算）
+            score_interval_seconds: 合并的分数最长延迟多久计入指纹（由调用方按fold()返回的since判断）
+            flush_interval: 定期写入的间隔（秒），None表示只按数量写入
+            max_pending: 有待写次数的事件数达到该值时立即写入
+            score_sink: 写入遗留分数的函数 score_sink(base_hash, score, reason, threat_event_id)
+            clock: 时钟（窗口的最长保持时间按该时钟计算，None表示系统时钟）
+        """
+        from models.database import ThreatEvent
+        
+        self.engine = engine
+        self.window = timedelta(seconds=window_seconds)
+        self.score_interval = timedelta(seconds=score_interval_seconds)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.score_sink = score_sink
+        self.clock = clock
+        
+        table = ThreatEvent.__table__
+        self._update = table.update().where(table.c.id == bindparam('event_id')).values(
+            occurrence_count=func.coalesce(table.c.occurrence_count, 1) + bindparam('count'),
+            last_seen=case(
+                (table.c.last_seen.is_(None), bindparam('seen')),
+                (table.c.last_seen < bindparam('seen'), bindparam('seen')),
+                else_=table.c.last_seen
+            )
+        )
+        
+        # (ip, threat_type) -> 窗口状态
+        self._windows: Dict[Tuple[str, str], Dict] = {}
+        # 写入失败的行，下次刷新重试
+        self._retry = []
+        # 有待写次数的窗口数
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        
+        self.stats = {
+            'windows_opened': 0,
+            'folded': 0,            # 合并到已有事件的命中次数
+            'scores_applied': 0,    # 调用方取出合并分数的次数
+            'scores_flushed': 0,    # 窗口结束后由score_sink写入的次数
+            'flushes': 0,
+            'rows_flushed': 0,
+            'flush_errors': 0,
+        }
+    
+    def _now(self) -> datetime:
+        return self.clock.now() if self.clock else datetime.now()
+    
+    def get_stats(self) -> Dict:
+        """获取聚合统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['windows'] = len(self._windows)
+            stats['pending'] = self._dirty
+        stats['window_seconds'] = self.window.total_seconds()
+        return stats
+    
+    def start(self):
+        """启动定期写入线程"""
+        if self.flush_interval:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._flush_loop, name='threat-aggregator', daemon=True)
+            self._thread.start()
+    
+    def close(self):
+        """停止写入线程，写入剩余的次数和分数"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        self.flush(final=True)
+    
+    def open_window(self, ip: str, threat_type: str, event_id: int, timestamp: datetime):
+        """开始新的聚合窗口（窗口内第一条威胁事件提交后调用，timestamp为该事件的日志时间）"""
+        if not event_id:
+            return
+        with self._lock:
+            previous = self._windows.get((ip, threat_type))
+            self._windows[(ip, threat_type)] = {
+                'event_id': event_id,
+                'expires': timestamp + self.window,
+                'deadline': self._now() + self.window,
+                'count': 0,
+                'last_seen': timestamp,
+                # base_hash -> {'score', 'count', 'since'}：尚未计入指纹的分数
+                'scores': {},
+            }
+            if previous is not None and (previous['count'] or previous['scores']):
+                # 旧窗口尚未写入的次数和分数留给flush()
+                self._windows[(ip, threat_type, previous['event_id'])] = previous
+            self.stats['windows_opened'] += 1
+    
+    def fold(self, ip: str, threat_type: str, base_hash: str, score: float,
+             timestamp: datetime) -> Optional[Dict]:
+        """
+        把一次命中合并到当前窗口
+        
+        Args:
+            ip: IP地址
+            threat_type: 威胁类型
+            base_hash: 命中的指纹
+            score: 这次命中的威胁分数（暂不计入指纹）
+            timestamp: 命中时间（日志时间）
+        
+        Returns:
+            已合并时返回 {'event_id', 'score': 该指纹待计入的分数合计, 'count': 合并次数, 'since': 最早一次的时间}；
+            没有窗口或窗口已结束时返回None（调用方写入新事件）
+        """
+        with self._lock:
+            window = self._windows.get((ip, threat_type))
+            if window is None or timestamp >= window['expires']:
+                return None
+            
+            if not window['count']:
+                self._dirty += 1
+            window['count'] += 1
+            if timestamp > window['last_seen']:
+                window['last_seen'] = timestamp
+            pending = window['scores'].get(base_hash)
+            if pending is None:
+                pending = window['scores'][base_hash] = {'score': 0.0, 'count': 0, 'since': timestamp}
+            pending['score'] += score
+            pending['count'] += 1
+            self.stats['folded'] += 1
+            result = dict(pending, event_id=window['event_id'])
+            full = self._dirty >= self.max_pending
+        if full:
+            self.flush()
+        return result
+    
+    def take_score(self, ip: str, threat_type: str, base_hash: str) -> Tuple[float, int]:
+        """
+        取出窗口中该指纹尚未计入的分数（调用方随后一次写入）
+        
+        Returns:
+            (分数合计, 合并的命中次数)
+        """
+        with self._lock:
+            window = self._windows.get((ip, threat_type))
+            pending = window['scores'].pop(base_hash, None) if window else None
+            if pending is None:
+                return 0.0, 0
+            self.stats['scores_applied'] += 1
+            return pending['score'], pending['count']
+    
+    def forget_all(self):
+        """清空窗口（清理任务删除威胁事件后调用，之后的命中重新写入事件）"""
+        self.flush(final=True)
+    
+    def flush(self, final: bool = False):
+        """
+        把合并的次数和last_seen用一条批量UPDATE写入，结束的窗口中遗留的分数交给score_sink
+        
+        Args:
+            final: 写入全部窗口的遗留分数并清空窗口（停止时调用）
+        """
+        with self._flush_lock:
+            now = self._now()
+            with self._lock:
+                rows, scores = self._retry, []
+                self._retry = []
+                self._dirty = 0
+                for key, window in list(self._windows.items()):
+                    if window['count']:
+                        rows.append({'event_id': window['event_id'], 'count': window['count'],
+                                     'seen': window['last_seen']})
+                        window['count'] = 0
+                    ended = final or len(key) == 3 or now >= window['deadline']
+                    if not ended:
+                        continue
+                    for base_hash, pending in window['scores'].items():
+                        scores.append((base_hash, pending['score'], pending['count'],
+                                       key[1], window['event_id']))
+                    del self._windows[key]
+            
+            if rows:
+                try:
+                    with self.engine.begin() as conn:
+                        conn.execute(self._update, rows)
+                except Exception as e:
+                    with self._lock:
+                        self._retry.extend(rows)
+                        self.stats['flush_errors'] += 1
+                    print(f"✗ 批量更新威胁事件失败: {e}")
+                else:
+                    with self._lock:
+                        self.stats['flushes'] += 1
+                        self.stats['rows_flushed'] += len(rows)
+            
+            if self.score_sink:
+                for base_hash, score, count, threat_type, event_id in scores:
+                    try:
+                        self.score_sink(base_hash, score, f"威胁检测: {threat_type} (合并 {count} 次)", event_id)
+                    except Exception as e:
+                        print(f"✗ 写入合并的威胁分数失败: {e}")
+                with self._lock:
+                    self.stats['scores_flushed'] += len(scores)
+    
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
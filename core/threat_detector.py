@@ -2,40 +2,109 @@
 威胁检测引擎
 检测各种安全威胁和异常行为
 """
-import re
+import threading
+from bisect import bisect_left, bisect_right, insort
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-from collections import defaultdict, deque
-import time
+from typing import Dict, List, Optional, Any, Tuple
+from collections import defaultdict
+
+from .clock import Clock, SYSTEM_CLOCK
+from .threat_rules import THREAT_RULES_VERSION, ThreatRuleset, load_threat_rules
 
 
 class ThreatDetector:
     """威胁检测引擎"""
     
-    def __init__(self, db, config: Dict):
+    # 特征类威胁的描述（其他类别使用规则名）
+    SIGNATURE_DESCRIPTIONS = {
+        'sql_injection': 'SQL注入攻击特征',
+        'xss_attack': 'XSS攻击特征',
+    }
+    
+    def __init__(self, db, config: Dict, clock: Optional[Clock] = None):
         self.db = db
         self.config = config
         self.detection_config = config.get('threat_detection', {})
-        
-        # 内存缓存（用于实时检测）
-        self.ip_request_history = defaultdict(lambda: deque(maxlen=1000))
-        self.ip_404_history = defaultdict(lambda: deque(maxlen=100))
-        
-        # 编译正则表达式模式
-        self._compile_patterns()
+        self.clock = clock or SYSTEM_CLOCK
+        
+        # 内存缓存（用于实时检测）：按事件时间（日志自身的时间）排序的时间戳列表
+        self.ip_request_history = defaultdict(list)
+        self.ip_404_history = defaultdict(list)
+        
+        # 事件时间水位线：按日志来源分别记录已见到的最大日志时间，减去允许的乱序时间即该来源的水位线，
+        # 早于水位线的日志不再计入窗口（回填、追读和实时处理得到相同的结果）。
+        # 追读积压时各文件依次读取，一个来源的进度不会让其他来源的日志变为迟到；时间无法解析的日志不推进水位线
+        self.allowed_lateness = self.detection_config.get('allowed_lateness_seconds', 30)
+        self.max_event_time: Dict[Any, float] = {}     # 日志来源 -> 已见最大日志时间
+        self._source_active: Dict[Any, float] = {}     # 日志来源 -> 最近一条日志到达时的时钟时间
+        # 所有来源中最早的水位线：清理窗口时以它为准，不删除较慢的来源仍会用到的时间戳
+        self._low_watermark = float('-inf')
+        self._events_since_cleanup = 0
+        self.stats = {
+            'late_events': 0,   # 超出乱序容忍范围、未计入窗口的日志数
+        }
+        
+        # 编译检测规则：先使用配置文件中的特征，有数据库时加载ThreatDetectionRule表中的规则
+        self._ruleset = ThreatRuleset(self.detection_config)
+        self._reload_lock = threading.Lock()
+        self._refresh_stop = threading.Event()
+        self._refresh_thread = None
+        if self.db is not None:
+            self.refresh_rules()
     
-    def _compile_patterns(self):
-        """编译威胁检测的正则表达式"""
-        sql_patterns = self.detection_config.get('sql_injection', {}).get('patterns', [])
-        self.sql_patterns = [re.compile(p, re.IGNORECASE) for p in sql_patterns]
-        
-        xss_patterns = self.detection_config.get('xss_detection', {}).get('patterns', [])
-        self.xss_patterns = [re.compile(p, re.IGNORECASE) for p in xss_patterns]
+    def refresh_rules(self, force: bool = False) -> bool:
+        """
+        数据库中的规则版本变化时重新编译规则集并整体替换
+        在后台线程或Web请求中调用，日志处理线程不编译规则
         
-        ua_patterns = self.detection_config.get('bad_user_agents', {}).get('patterns', [])
-        self.bad_ua_patterns = [re.compile(p, re.IGNORECASE) for p in ua_patterns]
+        Args:
+            force: 版本未变化时也重新加载
         
-        self.sensitive_paths = self.detection_config.get('sensitive_paths', {}).get('paths', [])
+        Returns:
+            是否替换了规则集
+        """
+        if self.db is None:
+            return False
+        
+        # 串行执行重新加载，避免较早读取的规则覆盖较新的
+        with self._reload_lock:
+            try:
+                if not force and self.db.get_rule_version(THREAT_RULES_VERSION) == self._ruleset.version:
+                    return False
+                version, rules = load_threat_rules(self.db)
+            except Exception as e:
+                # 数据库不可用时保留当前规则集
+                print(f"⚠ 加载威胁检测规则失败: {e}")
+                return False
+            ruleset = ThreatRuleset(self.detection_config, rules, version)
+            self._ruleset = ruleset
+        
+        print(f"✓ 威胁检测规则已加载 (版本 {version}, {ruleset.rule_count} 条规则)")
+        return True
+    
+    def start_rule_refresh(self, interval: float):
+        """启动后台线程，每interval秒检查一次规则版本"""
+        if not interval or self.db is None or self._refresh_thread:
+            return
+        self._refresh_stop.clear()
+        self._refresh_thread = threading.Thread(target=self._rule_refresh_loop, args=(interval,),
+                                                name='threat-rule-refresh', daemon=True)
+        self._refresh_thread.start()
+    
+    def stop_rule_refresh(self):
+        """停止规则检查线程"""
+        self._refresh_stop.set()
+        if self._refresh_thread:
+            self._refresh_thread.join(5.0)
+            self._refresh_thread = None
+    
+    def _rule_refresh_loop(self, interval: float):
+        while not self._refresh_stop.wait(interval):
+            self.refresh_rules()
+    
+    def get_rules_stats(self) -> Dict:
+        """当前规则集的版本、加载时间、各字段特征数和无效特征"""
+        return self._ruleset.get_stats()
     
     def detect(self, log_data: Dict) -> List[Dict]:
         """
@@ -47,199 +116,291 @@ class ThreatDetector:
             - severity: 严重程度
             - description: 描述
             - details: 详细信息
+            - threat_score: 命中的规则设置的基础分数（可选）
         """
         threats = []
-        ip = log_data.get('ip')
+        # 整条日志使用同一个规则集快照，检测过程中规则被替换也不会混用新旧规则
+        ruleset = self._ruleset
         
         # 1. 频率限制检测
-        if self.detection_config.get('rate_limit', {}).get('enabled', True):
-            threat = self._check_rate_limit(log_data)
+        rate_config = ruleset.config.get('rate_limit', {})
+        if rate_config.get('enabled', True):
+            threat = self._check_rate_limit(log_data, rate_config)
             if threat:
                 threats.append(threat)
         
         # 2. 404扫描检测
-        if self.detection_config.get('scan_detection', {}).get('enabled', True):
-            threat = self._check_scan_behavior(log_data)
+        scan_config = ruleset.config.get('scan_detection', {})
+        if scan_config.get('enabled', True):
+            threat = self._check_scan_behavior(log_data, scan_config)
             if threat:
                 threats.append(threat)
         
-        # 3. SQL注入检测
-        if self.detection_config.get('sql_injection', {}).get('enabled', True):
-            threat = self._check_sql_injection(log_data)
+        # 3. 特征检测（SQL注入、XSS、敏感路径、恶意User-Agent及数据库中的其他类别）：
+        # 每个字段只扫描一遍，得到命中的全部类别
+        hits = ruleset.match(log_data)
+        for signature in ruleset.signatures:
+            threat = self._check_signature(ruleset, signature, log_data, hits)
             if threat:
                 threats.append(threat)
         
-        # 4. XSS检测
-        if self.detection_config.get('xss_detection', {}).get('enabled', True):
-            threat = self._check_xss(log_data)
-            if threat:
-                threats.append(threat)
+        return threats
+    
+    def is_suspicious(self, log_data: Dict) -> bool:
+        """
+        快速判断日志是否可疑（接入队列过载时这类日志不会被丢弃）
         
-        # 5. 敏感路径访问
-        if self.detection_config.get('sensitive_paths', {}).get('enabled', True):
-            threat = self._check_sensitive_path(log_data)
-            if threat:
-                threats.append(threat)
+        4xx/5xx响应、命中任何启用的特征（恶意UA、注入特征、敏感路径等）均视为可疑
+        """
+        if log_data.get('status_code', 0) >= 400:
+            return True
         
-        # 6. User-Agent检测
-        if self.detection_config.get('bad_user_agents', {}).get('enabled', True):
-            threat = self._check_bad_user_agent(log_data)
-            if threat:
-                threats.append(threat)
+        return any(self._ruleset.match(log_data).values())
+    
+    @property
+    def watermark(self) -> float:
+        """所有日志来源中最早的水位线（早于该时间的日志对任何来源都是迟到）"""
+        return self._low_watermark
+    
+    def _event_time(self, log_data: Dict) -> Tuple[float, float]:
+        """
+        日志的事件时间（没有日志时间时使用时钟时间），并推进该日志来源的水位线
         
-        return threats
+        Returns:
+            (事件时间, 该来源的水位线)
+        """
+        source = log_data.get('source')
+        now = self.clock.time()
+        event_time = log_data.get('epoch')
+        if event_time is None:
+            event_time = now
+        self._source_active[source] = now
+        
+        previous = self.max_event_time.get(source)
+        if not log_data.get('time_estimated') and (previous is None or event_time > previous):
+            self.max_event_time[source] = event_time
+            # 新来源或最慢的来源推进时重新计算最早的水位线
+            if previous is None or previous - self.allowed_lateness <= self._low_watermark:
+                self._low_watermark = min(self.max_event_time.values()) - self.allowed_lateness
+            previous = event_time
+        if previous is None:
+            # 该来源还没有可信的日志时间
+            return event_time, float('-inf')
+        return event_time, previous - self.allowed_lateness
     
-    def _check_rate_limit(self, log_data: Dict) -> Optional[Dict]:
-        """检测请求频率限制"""
-        config = self.detection_config.get('rate_limit', {})
-        window_seconds = config.get('window_seconds', 60)
-        max_requests = config.get('max_requests', 100)
+    def _window_count(self, history: Dict, key, event_time: float, watermark: float,
+                      window_seconds: int, max_events: int) -> Optional[int]:
+        """
+        将事件加入滑动窗口，返回以该事件时间为终点的窗口内事件数
+        
+        Args:
+            history: 时间戳列表的字典
+            key: 统计键
+            event_time: 事件时间
+            watermark: 该事件所属日志来源的水位线
+            window_seconds: 窗口长度（秒）
+            max_events: 每个键最多保留的时间戳数
+        
+        Returns:
+            窗口内的事件数；事件早于水位线（迟到）时返回None
+        """
+        if event_time < watermark:
+            self.stats['late_events'] += 1
+            return None
         
+        times = history[key]
+        if not times or event_time >= times[-1]:
+            times.append(event_time)
+        else:
+            # 容忍范围内的乱序日志按时间插入
+            insort(times, event_time)
+        
+        # 清理不会再落入任何窗口的时间戳（各来源的后续事件都不早于最早的水位线）
+        expired = bisect_left(times, self._low_watermark - window_seconds)
+        if len(times) - expired > max_events:
+            expired = len(times) - max_events
+        if expired:
+            del times[:expired]
+        
+        self._cleanup_idle_keys()
+        
+        # 窗口包含两端：[event_time - window_seconds, event_time]
+        start = bisect_left(times, event_time - window_seconds)
+        return bisect_right(times, event_time, start) - start
+    
+    def _cleanup_idle_keys(self):
+        """定期删除窗口已全部过期的键，避免长时间运行后内存增长"""
+        self._events_since_cleanup += 1
+        if self._events_since_cleanup < 10000:
+            return
+        self._events_since_cleanup = 0
+        
+        config = self._ruleset.config
+        rate_window = config.get('rate_limit', {}).get('window_seconds', 60)
+        scan_window = config.get('scan_detection', {}).get('window_seconds', 300)
+        
+        # 长时间没有新日志的来源（已读完的文件、已下线的syslog主机）不再限制最早的水位线
+        idle_cutoff = self.clock.time() - self.allowed_lateness - max(rate_window, scan_window)
+        for source in [s for s, active in self._source_active.items() if active < idle_cutoff]:
+            del self._source_active[source]
+            self.max_event_time.pop(source, None)
+        if self.max_event_time:
+            self._low_watermark = min(self.max_event_time.values()) - self.allowed_lateness
+        
+        for history, window_seconds in ((self.ip_request_history, rate_window),
+                                        (self.ip_404_history, scan_window)):
+            cutoff = self._low_watermark - window_seconds
+            for key in [k for k, times in history.items() if not times or times[-1] < cutoff]:
+                del history[key]
+    
+    @staticmethod
+    def _window_key(log_data: Dict, config: Dict):
+        """
+        滑动窗口的统计键
+        默认按IP统计；配置per_source: true时按 (日志来源, IP) 分别统计，
+        同一IP访问不同站点的请求互不累加
+        """
         ip = log_data.get('ip')
-        current_time = time.time()
+        if config.get('per_source'):
+            return (log_data.get('source'), ip)
+        return ip
+    
+    def _check_rate_limit(self, log_data: Dict, config: Dict) -> Optional[Dict]:
+        """检测请求频率限制（config为规则集中的rate_limit配置）"""
+        window_seconds = config.get('window_seconds', 60)
+        max_requests = config.get('max_requests', 100)
         
-        # 添加到历史记录
-        self.ip_request_history[ip].append(current_time)
+        key = self._window_key(log_data, config)
+        event_time, watermark = self._event_time(log_data)
         
-        # 计算时间窗口内的请求数
-        cutoff_time = current_time - window_seconds
-        recent_requests = [t for t in self.ip_request_history[ip] if t >= cutoff_time]
+        # 添加到历史记录，并计算时间窗口内的请求数
+        request_count = self._window_count(self.ip_request_history, key, event_time, watermark,
+                                           window_seconds, 1000)
         
-        if len(recent_requests) > max_requests:
-            return {
+        if request_count is not None and request_count > max_requests:
+            threat = {
                 'threat_type': 'rate_limit_exceeded',
                 'severity': 'high',
-                'description': f'请求频率过高: {len(recent_requests)}次/{window_seconds}秒',
+                'description': f'请求频率过高: {request_count}次/{window_seconds}秒',
                 'details': {
-                    'request_count': len(recent_requests),
+                    'request_count': request_count,
                     'window_seconds': window_seconds,
                     'max_allowed': max_requests
                 }
             }
+            if config.get('threat_score'):
+                threat['threat_score'] = config['threat_score']
+            return threat
         
         return None
     
-    def _check_scan_behavior(self, log_data: Dict) -> Optional[Dict]:
-        """检测路径扫描行为"""
-        config = self.detection_config.get('scan_detection', {})
+    def _check_scan_behavior(self, log_data: Dict, config: Dict) -> Optional[Dict]:
+        """检测路径扫描行为（config为规则集中的scan_detection配置）"""
         window_seconds = config.get('window_seconds', 300)
         max_404_count = config.get('max_404_count', 20)
         
-        ip = log_data.get('ip')
+        key = self._window_key(log_data, config)
         status_code = log_data.get('status_code')
         
         if status_code == 404:
-            current_time = time.time()
-            self.ip_404_history[ip].append(current_time)
+            event_time, watermark = self._event_time(log_data)
             
-            # 计算时间窗口内的404数量
-            cutoff_time = current_time - window_seconds
-            recent_404s = [t for t in self.ip_404_history[ip] if t >= cutoff_time]
+            # 添加到历史记录，并计算时间窗口内的404数量
+            count_404 = self._window_count(self.ip_404_history, key, event_time, watermark,
+                                           window_seconds, 100)
             
-            if len(recent_404s) > max_404_count:
-                return {
+            if count_404 is not None and count_404 > max_404_count:
+                threat = {
                     'threat_type': 'path_scan',
                     'severity': 'high',
-                    'description': f'疑似路径扫描: {len(recent_404s)}个404错误',
+                    'description': f'疑似路径扫描: {count_404}个404错误',
                     'details': {
-                        '404_count': len(recent_404s),
+                        '404_count': count_404,
                         'window_seconds': window_seconds,
                         'max_allowed': max_404_count
                     }
                 }
+                if config.get('threat_score'):
+                    threat['threat_score'] = config['threat_score']
+                return threat
         
         return None
     
-    def _check_sql_injection(self, log_data: Dict) -> Optional[Dict]:
-        """检测SQL注入攻击"""
-        request_path = log_data.get('request_path', '')
-        query_params = log_data.get('query_params', '')
-        
-        # 检查路径和参数
-        test_strings = [request_path, query_params]
-        
-        for test_str in test_strings:
-            for pattern in self.sql_patterns:
-                if pattern.search(test_str):
-                    return {
-                        'threat_type': 'sql_injection',
-                        'severity': 'critical',
-                        'description': 'SQL注入攻击特征',
-                        'details': {
-                            'matched_pattern': pattern.pattern,
-                            'request_path': request_path,
-                            'matched_in': test_str[:200]
-                        }
-                    }
+    def _check_signature(self, ruleset: ThreatRuleset, signature: tuple, log_data: Dict,
+                         hits: Dict) -> Optional[Dict]:
+        """
+        根据扫描结果生成特征类威胁
         
-        return None
-    
-    def _check_xss(self, log_data: Dict) -> Optional[Dict]:
-        """检测XSS攻击"""
-        request_path = log_data.get('request_path', '')
-        query_params = log_data.get('query_params', '')
-        
-        test_strings = [request_path, query_params]
-        
-        for test_str in test_strings:
-            for pattern in self.xss_patterns:
-                if pattern.search(test_str):
-                    return {
-                        'threat_type': 'xss_attack',
-                        'severity': 'high',
-                        'description': 'XSS攻击特征',
-                        'details': {
-                            'matched_pattern': pattern.pattern,
-                            'request_path': request_path,
-                            'matched_in': test_str[:200]
-                        }
-                    }
+        Args:
+            ruleset: 规则集快照
+            signature: (类别, 威胁类型, 严重程度, 匹配的字段)
+            hits: ruleset.match()的扫描结果，按字段顺序取第一个命中（路径优先于查询参数）
+        """
+        category, threat_type, severity, fields = signature
+        for field in fields:
+            pattern = hits[field].get(category)
+            if pattern:
+                break
+        else:
+            return None
         
-        return None
-    
-    def _check_sensitive_path(self, log_data: Dict) -> Optional[Dict]:
-        """检测敏感路径访问"""
         request_path = log_data.get('request_path', '')
-        
-        for sensitive_path in self.sensitive_paths:
-            if sensitive_path in request_path:
-                return {
-                    'threat_type': 'sensitive_path_access',
-                    'severity': 'medium',
-                    'description': f'访问敏感路径: {sensitive_path}',
-                    'details': {
-                        'sensitive_path': sensitive_path,
-                        'full_path': request_path
-                    }
+        rule_name = ruleset.rule_name(category, pattern)
+        if category == 'sensitive_path':
+            threat = {
+                'threat_type': threat_type,
+                'severity': severity,
+                'description': f'访问敏感路径: {pattern}',
+                'details': {
+                    'sensitive_path': pattern,
+                    'full_path': request_path
                 }
-        
-        return None
-    
-    def _check_bad_user_agent(self, log_data: Dict) -> Optional[Dict]:
-        """检测恶意User-Agent"""
-        user_agent = log_data.get('user_agent', '').lower()
-        
-        for pattern in self.bad_ua_patterns:
-            if pattern.search(user_agent):
-                return {
-                    'threat_type': 'bad_user_agent',
-                    'severity': 'medium',
-                    'description': '检测到恶意工具User-Agent',
-                    'details': {
-                        'matched_pattern': pattern.pattern,
-                        'user_agent': user_agent[:200]
-                    }
+            }
+        elif category == 'bad_user_agent':
+            threat = {
+                'threat_type': threat_type,
+                'severity': severity,
+                'description': '检测到恶意工具User-Agent',
+                'details': {
+                    'matched_pattern': pattern,
+                    'user_agent': log_data.get('user_agent', '').lower()[:200]
                 }
+            }
+        else:
+            matched_in = log_data.get('query_params', '') if field in ('query', 'upload') else request_path
+            threat = {
+                'threat_type': threat_type,
+                'severity': severity,
+                'description': self.SIGNATURE_DESCRIPTIONS.get(category) or rule_name or f'{category}特征',
+                'details': {
+                    'matched_pattern': pattern,
+                    'request_path': request_path,
+                    'matched_in': matched_in[:200]
+                }
+            }
         
-        return None
+        # 来自数据库规则时记录规则名，规则设置了分数时由评分系统直接使用
+        if rule_name:
+            threat['details']['rule'] = rule_name
+        threat_score = ruleset.threat_score(category, pattern)
+        if threat_score:
+            threat['threat_score'] = threat_score
+        return threat
     
     def save_threat_event(self, ip: str, base_hash: str, threat: Dict, 
-                         identity_chain_id: Optional[int] = None):
-        """保存威胁事件到数据库"""
-        from models.database import ThreatEvent
+                         identity_chain_id: Optional[int] = None, uow=None,
+                         timestamp: Optional[datetime] = None):
+        """
+        保存威胁事件到数据库（传入工作单元时只flush获取ID，由工作单元统一提交）
+        
+        Args:
+            timestamp: 事件时间（触发威胁的日志时间，与检测窗口一致；None表示当前时间）
+        """
+        from models.database import ThreatEvent, to_db_time
         import json
         
-        session = self.db.get_session()
+        session = uow.session if uow else self.db.get_session()
+        now = to_db_time(timestamp) if timestamp is not None else self.clock.now()
         try:
             event = ThreatEvent(
                 ip=ip,
@@ -249,17 +410,26 @@ class ThreatDetector:
                 severity=threat['severity'],
                 description=threat['description'],
                 details=json.dumps(threat.get('details', {})),
-                handled=False
+                handled=False,
+                timestamp=now,
+                occurrence_count=1,
+                last_seen=now
             )
             session.add(event)
-            session.commit()
+            if uow:
+                session.flush()
+            else:
+                session.commit()
             return event.id
         except Exception as e:
+            if uow:
+                raise
             session.rollback()
             print(f"保存威胁事件失败: {e}")
             return None
         finally:
-            session.close()
+            if not uow:
+                session.close()
     
     def get_ip_threat_history(self, ip: str, hours: int = 24) -> List[Dict]:
         """获取IP的威胁历史"""
@@ -279,7 +449,9 @@ class ThreatDetector:
                 'timestamp': event.timestamp.isoformat(),
                 'threat_type': event.threat_type,
                 'severity': event.severity,
-                'description': event.description
+                'description': event.description,
+                'occurrence_count': event.occurrence_count or 1,
+                'last_seen': (event.last_seen or event.timestamp).isoformat()
             } for event in events]
         finally:
             session.close()
@@ -292,11 +464,13 @@ class ThreatDetector:
         session = self.db.get_session()
         try:
             cutoff_time = datetime.now() - timedelta(hours=hours)
+            # 聚合的威胁事件按命中次数统计
+            occurrences = func.sum(func.coalesce(ThreatEvent.occurrence_count, 1))
             
             # 按类型统计
             type_stats = session.query(
                 ThreatEvent.threat_type,
-                func.count(ThreatEvent.id).label('count')
+                occurrences.label('count')
             ).filter(
                 ThreatEvent.timestamp >= cutoff_time
             ).group_by(ThreatEvent.threat_type).all()
@@ -304,18 +478,18 @@ class ThreatDetector:
             # 按严重程度统计
             severity_stats = session.query(
                 ThreatEvent.severity,
-                func.count(ThreatEvent.id).label('count')
+                occurrences.label('count')
             ).filter(
                 ThreatEvent.timestamp >= cutoff_time
             ).group_by(ThreatEvent.severity).all()
             
             # 总数
-            total = session.query(func.count(ThreatEvent.id)).filter(
+            total = session.query(occurrences).filter(
                 ThreatEvent.timestamp >= cutoff_time
             ).scalar()
             
             return {
-                'total': total,
+                'total': total or 0,
                 'by_type': {t: c for t, c in type_stats},
                 'by_severity': {s: c for s, c in severity_stats},
                 'time_range_hours': hours
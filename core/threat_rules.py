@@ -0,0 +1,266 @@
+"""
+威胁检测规则集
+把配置文件和ThreatDetectionRule表中的检测规则编译为不可变的规则集快照：
+各字段（路径、查询参数、User-Agent、上传文件名）的多模式匹配器，以及合并后的窗口类规则参数。
+规则版本变化时由后台线程重新编译并整体替换，日志处理线程每条日志只读取一次当前快照
+"""
+import json
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .multi_pattern import MultiPatternMatcher
+
+
+# 规则版本名（RuleVersion表）
+THREAT_RULES_VERSION = 'threat_detection'
+
+# 特征类规则：类别 -> (威胁类型, 严重程度, 匹配的字段)
+# 字段：path（请求路径）、query（查询参数）、user_agent、
+# upload（POST/PUT请求的查询参数，特征按上传文件名参数编写，不匹配接收上传的路径本身）
+SIGNATURE_CATEGORIES = {
+    'sql_injection': ('sql_injection', 'critical', ('path', 'query')),
+    'xss_attack': ('xss_attack', 'high', ('path', 'query')),
+    'sensitive_path': ('sensitive_path_access', 'medium', ('path',)),
+    'bad_user_agent': ('bad_user_agent', 'medium', ('user_agent',)),
+    'command_injection': ('command_injection', 'critical', ('path', 'query')),
+    'path_traversal': ('path_traversal', 'high', ('path', 'query')),
+    'webshell': ('webshell', 'critical', ('path', 'query')),
+    'ssrf': ('ssrf', 'high', ('query',)),
+    'xxe': ('xxe', 'high', ('query',)),
+    'file_upload': ('file_upload', 'high', ('upload',)),
+}
+
+# Web界面新增的其他类别：威胁类型即类别名，检查路径和查询参数
+DEFAULT_SIGNATURE = ('medium', ('path', 'query'))
+
+# 窗口类规则：参数覆盖配置文件threat_detection下的同名配置段
+WINDOW_CATEGORIES = ('rate_limit', 'scan_detection')
+
+# 配置文件中的特征配置段 -> (类别, 特征列表的键)
+CONFIG_SECTIONS = {
+    'sql_injection': ('sql_injection', 'patterns'),
+    'xss_detection': ('xss_attack', 'patterns'),
+    'sensitive_paths': ('sensitive_path', 'paths'),
+    'bad_user_agents': ('bad_user_agent', 'patterns'),
+}
+
+# 按字面量子串（区分大小写）匹配的类别
+LITERAL_CATEGORIES = ('sensitive_path',)
+
+# 上传请求的方法
+UPLOAD_METHODS = ('POST', 'PUT')
+
+
+def parse_patterns(value) -> List[str]:
+    """
+    解析规则的特征列表
+    
+    Args:
+        value: JSON数组字符串，或每行一个特征的文本
+    
+    Returns:
+        特征列表
+    """
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value if item]
+    try:
+        data = json.loads(value)
+    except ValueError:
+        data = None
+    if isinstance(data, list):
+        return [str(item) for item in data if item]
+    return [line.strip() for line in str(value).splitlines() if line.strip()]
+
+
+def parse_parameters(value) -> Dict:
+    """解析规则参数（JSON对象，无效时返回空字典）"""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return dict(value)
+    try:
+        data = json.loads(value)
+    except ValueError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def load_threat_rules(db) -> Tuple[int, List[Dict]]:
+    """
+    从数据库读取规则版本和全部威胁检测规则
+    
+    先读版本再读规则：读取期间有新的修改时，规则不旧于版本，下次检查会再次加载
+    
+    Returns:
+        (规则版本, [{'id', 'category', 'name', 'enabled', 'patterns', 'parameters', 'threat_score'}, ...])
+    """
+    from models.database import ThreatDetectionRule
+    
+    version = db.get_rule_version(THREAT_RULES_VERSION)
+    session = db.get_session()
+    try:
+        rules = session.query(ThreatDetectionRule).order_by(ThreatDetectionRule.id).all()
+        return version, [{
+            'id': rule.id,
+            'category': rule.category,
+            'name': rule.name,
+            'enabled': bool(rule.enabled),
+            'patterns': parse_patterns(rule.patterns),
+            'parameters': parse_parameters(rule.parameters),
+            'threat_score': rule.threat_score or 0,
+        } for rule in rules if rule.category]
+    finally:
+        session.close()
+
+
+class ThreatRuleset:
+    """
+    编译后的威胁检测规则集（创建后不再修改，替换时整体替换）
+    
+    数据库中某个特征类别有启用的规则时，该类别以数据库为准，否则使用配置文件threat_detection下的对应配置段
+    （默认规则按禁用写入，管理员启用后才覆盖配置）；窗口类规则只覆盖其设置了的参数，
+    参数为空时沿用配置文件的窗口参数
+    """
+    
+    def __init__(self, detection_config: Dict, rules: Optional[List[Dict]] = None,
+                 version: Optional[int] = None):
+        """
+        Args:
+            detection_config: 配置文件中的threat_detection配置
+            rules: load_threat_rules()返回的规则列表（None表示只使用配置文件）
+            version: 规则版本（None表示未从数据库加载）
+        """
+        self.version = version
+        self.loaded_at = datetime.now()
+        self.rule_count = len(rules or [])
+        # 合并数据库参数后的配置（窗口类规则从这里读取）
+        self.config = dict(detection_config)
+        
+        # 类别 -> {'enabled', 'patterns', 'names': {特征: 规则名}, 'scores': {特征: 分数}}
+        signatures: Dict[str, Dict] = {}
+        for section, (category, key) in CONFIG_SECTIONS.items():
+            section_config = detection_config.get(section, {})
+            signatures[category] = {
+                'enabled': section_config.get('enabled', True),
+                'patterns': list(section_config.get(key, [])),
+                'names': {},
+                'scores': {},
+            }
+        
+        database_signatures: Dict[str, Dict] = {}
+        windows: Dict[str, Dict] = {}
+        for rule in rules or []:
+            category = rule['category']
+            if category in WINDOW_CATEGORIES:
+                window = windows.setdefault(category, {'enabled': False})
+                if rule['enabled']:
+                    window.update(rule['parameters'])
+                    window['enabled'] = True
+                    if rule['threat_score']:
+                        window['threat_score'] = rule['threat_score']
+                continue
+            
+            if not rule['enabled']:
+                continue
+            entry = database_signatures.setdefault(
+                category, {'enabled': True, 'patterns': [], 'names': {}, 'scores': {}}
+            )
+            for pattern in rule['patterns']:
+                if pattern in entry['names']:
+                    continue
+                entry['patterns'].append(pattern)
+                entry['names'][pattern] = rule['name']
+                if rule['threat_score']:
+                    entry['scores'][pattern] = rule['threat_score']
+        signatures.update(database_signatures)
+        
+        for category, window in windows.items():
+            section = dict(detection_config.get(category, {}))
+            section.update(window)
+            self.config[category] = section
+        
+        # 已知类别按固定顺序检测（威胁列表的顺序与之前一致），其他类别按规则顺序
+        order = [category for category in SIGNATURE_CATEGORIES if category in signatures]
+        order += [category for category in signatures if category not in SIGNATURE_CATEGORIES]
+        
+        ac_min_patterns = detection_config.get('ac_min_patterns', 100)
+        self.matchers = {
+            field: MultiPatternMatcher(ac_min_patterns)
+            for field in ('path', 'query', 'user_agent', 'upload')
+        }
+        # [(类别, 威胁类型, 严重程度, 匹配的字段)]，按检测顺序
+        self.signatures: List[Tuple[str, str, str, Tuple[str, ...]]] = []
+        self._names: Dict[str, Dict[str, str]] = {}
+        self._scores: Dict[str, Dict[str, int]] = {}
+        for category in order:
+            entry = signatures[category]
+            if not entry['enabled'] or not entry['patterns']:
+                continue
+            if category in SIGNATURE_CATEGORIES:
+                threat_type, severity, fields = SIGNATURE_CATEGORIES[category]
+            else:
+                threat_type = category
+                severity, fields = DEFAULT_SIGNATURE
+            literal = category in LITERAL_CATEGORIES
+            patterns = entry['patterns']
+            for field in fields:
+                matcher = self.matchers[field]
+                matcher.add(category, patterns, regex=not literal, ignore_case=not literal)
+                # 无效的正则只在第一个字段报告一次
+                invalid = {pattern for item, pattern, _ in matcher.invalid if item == category}
+                patterns = [pattern for pattern in patterns if pattern not in invalid]
+            self.signatures.append((category, threat_type, severity, fields))
+            self._names[category] = entry['names']
+            self._scores[category] = entry['scores']
+        
+        for matcher in self.matchers.values():
+            matcher.compile()
+    
+    def match(self, log_data: Dict) -> Dict[str, Dict[str, str]]:
+        """
+        扫描一条日志的各个字段
+        
+        Returns:
+            {字段: {类别: 命中的特征}}，User-Agent按小写匹配
+        """
+        hits = {
+            'path': self.matchers['path'].match(log_data.get('request_path', '')),
+            'query': self.matchers['query'].match(log_data.get('query_params', '')),
+            'user_agent': self.matchers['user_agent'].match(log_data.get('user_agent', '').lower()),
+            'upload': {},
+        }
+        if len(self.matchers['upload']) and log_data.get('request_method') in UPLOAD_METHODS:
+            hits['upload'] = self.matchers['upload'].match(log_data.get('query_params', ''))
+        return hits
+    
+    def rule_name(self, category: str, pattern: str) -> Optional[str]:
+        """命中特征所属的数据库规则名（来自配置文件时为None）"""
+        return self._names.get(category, {}).get(pattern)
+    
+    def threat_score(self, category: str, pattern: str) -> Optional[int]:
+        """命中特征所属规则的威胁分数（未设置时为None，由评分系统按威胁类型计算）"""
+        return self._scores.get(category, {}).get(pattern)
+    
+    def get_stats(self) -> Dict:
+        """规则集统计"""
+        invalid = []
+        seen = set()
+        for matcher in self.matchers.values():
+            for item in matcher.invalid:
+                if item not in seen:
+                    seen.add(item)
+                    invalid.append({'category': item[0], 'pattern': item[1], 'error': item[2]})
+        return {
+            'version': self.version,
+            'loaded_at': self.loaded_at.isoformat(),
+            'rules': self.rule_count,
+            'categories': [category for category, _, _, _ in self.signatures],
+            'patterns': {field: len(matcher) for field, matcher in self.matchers.items()},
+            'windows': {
+                category: {key: value for key, value in self.config.get(category, {}).items()}
+                for category in WINDOW_CATEGORIES
+            },
+            'invalid': invalid,
+        }
@@ -0,0 +1,207 @@
+"""
+工作单元
+一条日志的各个处理阶段（入库、指纹、地理位置、身份链、评分、封禁）共用一个数据库会话，
+指纹记录只加载一次，全部阶段完成后统一提交一次
+"""
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import event
+
+from .fingerprint_cache import FingerprintState
+
+
+class UnitOfWork:
+    """
+    单条日志的工作单元
+    
+    各阶段通过uow参数取得共享会话，只调用flush()（需要ID时），不提交也不关闭；
+    with块正常结束时提交（没有任何写入时只结束只读事务，不产生提交），出现异常时整体回滚
+    
+    封禁、告警等外部动作通过after_commit()登记，提交成功并关闭会话后才执行，回滚时丢弃
+    
+    只需要评分、身份链、extra_data等字段的阶段使用get_state()/update_state()：
+    数据库配置了指纹状态缓存（db.fingerprint_cache）时优先从缓存读取，
+    修改直接以UPDATE语句写入；提交成功后把本工作单元读取或修改过的状态写回缓存
+    
+    用法:
+        with UnitOfWork(db) as uow:
+            save_access_log(log_data, uow=uow)
+            update_fingerprint(log_data, uow=uow)
+    """
+    
+    def __init__(self, db):
+        self.session = db.get_session()
+        self.cache = getattr(db, 'fingerprint_cache', None)
+        # 读取任何状态之前记录缓存代数，期间缓存被invalidate()时不写回
+        self._cache_generation = self.cache.generation if self.cache is not None else None
+        # base_hash -> Fingerprint（None表示已查询过但不存在）
+        self._fingerprints: Dict[str, Optional[object]] = {}
+        # base_hash -> FingerprintState（从缓存取得、尚未加载Fingerprint记录的指纹）
+        self._states: Dict[str, FingerprintState] = {}
+        self._states_changed = set()
+        self._written = False
+        self._after_commit = []
+        event.listen(self.session, 'after_flush', self._on_flush)
+    
+    def _on_flush(self, session, flush_context):
+        self._written = True
+    
+    def has_writes(self) -> bool:
+        """工作单元内是否有已flush或待flush的修改"""
+        session = self.session
+        return self._written or bool(session.new or session.dirty or session.deleted)
+    
+    def __enter__(self) -> 'UnitOfWork':
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                if self.has_writes():
+                    self.session.commit()
+                    self._write_through()
+                else:
+                    # 回滚会使已加载的记录过期，先写入缓存
+                    self._write_through()
+                    self.session.rollback()
+            else:
+                self.session.rollback()
+                self._after_commit = []
+        finally:
+            self.session.close()
+        
+        for func, args, kwargs in self._after_commit:
+            func(*args, **kwargs)
+        return False
+    
+    def after_commit(self, func, *args, **kwargs):
+        """登记提交成功后执行的函数（引用本工作单元写入的记录时，保证其他会话能读到）"""
+        self._after_commit.append((func, args, kwargs))
+    
+    def _write_through(self):
+        """把已提交的指纹状态写入缓存（从缓存读取且未修改的不必重写）"""
+        if self.cache is None:
+            return
+        generation = self._cache_generation
+        for fingerprint in self._fingerprints.values():
+            if fingerprint is not None and fingerprint.id is not None:
+                self.cache.put(FingerprintState.from_model(fingerprint), generation)
+        for base_hash in self._states_changed:
+            if base_hash not in self._fingerprints:
+                self.cache.put(self._states[base_hash], generation)
+    
+    def get_fingerprint(self, base_hash: str):
+        """获取完整的指纹记录（同一工作单元内只查询一次）"""
+        if base_hash not in self._fingerprints:
+            # 之后该指纹的状态以记录为准
+            self._states.pop(base_hash, None)
+            from models.database import Fingerprint
+            self._fingerprints[base_hash] = self.session.query(Fingerprint).filter(
+                Fingerprint.base_hash == base_hash
+            ).first()
+        return self._fingerprints[base_hash]
+    
+    def add_fingerprint(self, fingerprint):
+        """加入新建的指纹记录（立即flush以便后续阶段使用其ID）"""
+        self.session.add(fingerprint)
+        self.session.flush()
+        self._fingerprints[fingerprint.base_hash] = fingerprint
+    
+    def get_state(self, base_hash: str) -> Optional[FingerprintState]:
+        """
+        获取指纹的精简状态（缓存命中时不查询数据库）
+        
+        Returns:
+            FingerprintState，指纹不存在时返回None
+        """
+        if base_hash in self._states:
+            return self._states[base_hash]
+        if base_hash not in self._fingerprints and self.cache is not None:
+            state = self.cache.get(base_hash)
+            if state is not None:
+                self._states[base_hash] = state
+                return state
+        
+        fingerprint = self.get_fingerprint(base_hash)
+        return FingerprintState.from_model(fingerprint) if fingerprint else None
+    
+    def update_state(self, base_hash: str, **values):
+        """
+        修改指纹字段（列名同Fingerprint，extra_data为JSON字符串）
+        
+        已加载Fingerprint记录时直接修改记录，否则按ID执行UPDATE，不再查询整条记录
+        """
+        state = self._states.get(base_hash)
+        if state is None:
+            fingerprint = self._fingerprints.get(base_hash)
+            if fingerprint is None:
+                fingerprint = self.get_fingerprint(base_hash)
+            if fingerprint is not None:
+                for column, value in values.items():
+                    setattr(fingerprint, column, value)
+            return
+        
+        from models.database import Fingerprint
+        self.session.query(Fingerprint).filter(
+            Fingerprint.id == state.id
+        ).update(values, synchronize_session=False)
+        state.apply(values)
+        self._states_changed.add(base_hash)
+        self._written = True
+
+
+class CommitCounter:
+    """
+    数据库提交计数
+    
+    监听引擎的commit事件统计实际提交次数（包括未经过工作单元的提交），
+    与处理的日志行数一起换算为每1000行的提交次数
+    """
+    
+    def __init__(self, engine=None):
+        """
+        Args:
+            engine: SQLAlchemy引擎（None时只能通过record_commit()手动计数）
+        """
+        self.commits = 0
+        self.lines = 0
+        self._lock = threading.Lock()
+        self._last = (0, 0)
+        if engine is not None:
+            event.listen(engine, 'commit', self._on_commit)
+    
+    def _on_commit(self, conn):
+        self.record_commit()
+    
+    def record_commit(self):
+        with self._lock:
+            self.commits += 1
+    
+    def add_lines(self, count: int = 1):
+        with self._lock:
+            self.lines += count
+    
+    def get_stats(self) -> Dict:
+        """累计的提交次数、日志行数和每1000行的提交次数"""
+        with self._lock:
+            commits, lines = self.commits, self.lines
+        return {
+            'commits': commits,
+            'lines': lines,
+            'commits_per_1000_lines': commits * 1000 / lines if lines else 0.0,
+        }
+    
+    def get_interval_stats(self) -> Dict:
+        """自上次调用以来的提交次数、日志行数和每1000行的提交次数"""
+        with self._lock:
+            commits, lines = self.commits, self.lines
+            last_commits, last_lines = self._last
+            self._last = (commits, lines)
+        commits -= last_commits
+        lines -= last_lines
+        return {
+            'commits': commits,
+            'lines': lines,
+            'commits_per_1000_lines': commits * 1000 / lines if lines else 0.0,
+        }
@@ -0,0 +1,270 @@
+"""
+访问日志写缓冲
+访问日志先进入内存缓冲，攒够N条或等待T毫秒后用一次executemany批量插入，
+SQLite上由每条日志一次提交（一次fsync）变为每批一次
+"""
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import insert
+
+
+# SQLite PRAGMA synchronous 可选值（持久性由高到低：EXTRA > FULL > NORMAL > OFF）
+SYNCHRONOUS_MODES = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+class LatencyHistogram:
+    """延迟直方图（毫秒，按固定桶计数）"""
+    
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+    
+    def record(self, ms: float):
+        index = 0
+        while index < len(self.BUCKETS_MS) and ms > self.BUCKETS_MS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+    
+    def percentile(self, p: float) -> float:
+        """近似百分位（返回所在桶的上界，不超过最大值）"""
+        if not self.count:
+            return 0.0
+        target = self.count * p / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(float(self.BUCKETS_MS[index]), self.max_ms) if index < len(self.BUCKETS_MS) else self.max_ms
+        return self.max_ms
+    
+    def get_stats(self) -> Dict:
+        labels = [f'<={ms}ms' for ms in self.BUCKETS_MS] + [f'>{self.BUCKETS_MS[-1]}ms']
+        return {
+            'count': self.count,
+            'avg_ms': self.total_ms / self.count if self.count else 0.0,
+            'max_ms': self.max_ms,
+            'p50_ms': self.percentile(50),
+            'p99_ms': self.percentile(99),
+            'buckets': {label: count for label, count in zip(labels, self.counts) if count},
+        }
+
+
+class AccessLogWriter:
+    """
+    访问日志批量写入器
+    
+    add()只把行放入缓冲；缓冲达到max_rows条时由调用线程立即刷新，
+    否则由后台线程在最早一行等待max_delay_ms后刷新。close()时写入剩余的行
+    
+    写入使用独立的连接，不属于任何工作单元：调用方在工作单元提交后再add()，
+    需要批量修改访问日志时调用update_rows()，同时修改缓冲中和已写入的行
+    """
+    
+    def __init__(self, engine, max_rows: int = 500,
+                 max_delay_ms: Optional[float] = 200,
+                 synchronous: Optional[str] = None):
+        """
+        Args:
+            engine: SQLAlchemy引擎
+            max_rows: 缓冲达到该条数时立即刷新
+            max_delay_ms: 行在缓冲中等待的最长时间（毫秒），None表示只按条数刷新
+            synchronous: SQLite写入连接的PRAGMA synchronous（OFF/NORMAL/FULL/EXTRA，
+                None表示保持数据库默认值），其他数据库忽略
+        
+        Raises:
+            ValueError: 无效的synchronous取值
+        """
+        from models.database import AccessLog
+        
+        if synchronous is not None:
+            synchronous = str(synchronous).upper()
+            if synchronous not in SYNCHRONOUS_MODES:
+                raise ValueError(f"无效的synchronous取值: {synchronous}（可选: {', '.join(SYNCHRONOUS_MODES)}）")
+        
+        self.engine = engine
+        self.max_rows = max_rows
+        self.max_delay_ms = max_delay_ms
+        self.synchronous = synchronous
+        self._insert = insert(AccessLog.__table__)
+        
+        self._rows: List[Dict] = []
+        self._first_added = 0.0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = None
+        self._thread = None
+        self.running = False
+        
+        self.flush_histogram = LatencyHistogram()   # 每次批量插入（含提交）的耗时
+        self.wait_histogram = LatencyHistogram()    # 每批中最早一行在缓冲中的等待时间
+        self.stats = {
+            'rows_added': 0,
+            'rows_written': 0,
+            'rows_failed': 0,       # 批量和逐行插入都失败、被丢弃的行数
+            'flushes': 0,
+            'flushes_by_size': 0,
+            'flushes_by_time': 0,
+            'bulk_failures': 0,     # 批量插入失败后改为逐行插入的次数
+        }
+    
+    def get_stats(self) -> Dict:
+        """获取写入统计和刷新延迟直方图"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['buffered'] = len(self._rows)
+        stats['max_rows'] = self.max_rows
+        stats['max_delay_ms'] = self.max_delay_ms
+        stats['synchronous'] = self.synchronous
+        stats['rows_per_flush'] = stats['rows_written'] / stats['flushes'] if stats['flushes'] else 0.0
+        stats['flush_latency'] = self.flush_histogram.get_stats()
+        stats['buffer_wait'] = self.wait_histogram.get_stats()
+        return stats
+    
+    def start(self):
+        """启动按时间刷新的后台线程"""
+        self.running = True
+        if self.max_delay_ms:
+            self._thread = threading.Thread(target=self._flush_loop, name='access-log-writer', daemon=True)
+            self._thread.start()
+    
+    def close(self):
+        """停止后台线程并写入缓冲中剩余的行"""
+        self.running = False
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(5.0)
+            self._thread = None
+        self.flush()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+    
+    def add(self, row: Dict):
+        """加入一行访问日志（列名同AccessLog）"""
+        with self._lock:
+            if not self._rows:
+                self._first_added = time.time()
+                self._wakeup.set()
+            self._rows.append(row)
+            self.stats['rows_added'] += 1
+            full = len(self._rows) >= self.max_rows
+        if full:
+            self.flush(reason='size')
+    
+    def update_rows(self, column: str, value, values: Dict):
+        """
+        修改访问日志：缓冲中尚未写入的行直接修改，已写入的行执行UPDATE
+        
+        持有刷新锁执行，正在写入的批次写完后才执行UPDATE，不会遗漏；
+        应在修改相关记录的事务提交之后调用（SQLite上写入连接要等待其他连接的写事务结束）
+        
+        Args:
+            column: 条件列名（如base_hash）
+            value: 条件值
+            values: 要修改的列和值（如{'identity_chain_id': 1}）
+        """
+        with self._flush_lock:
+            with self._lock:
+                for row in self._rows:
+                    if row.get(column) == value:
+                        row.update(values)
+            table = self._insert.table
+            conn = self._connection()
+            try:
+                conn.execute(table.update().where(table.c[column] == value).values(**values))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+    
+    def flush(self, reason: str = None):
+        """立即写入缓冲中的所有行"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                first_added = self._first_added
+            if not rows:
+                return
+            
+            started = time.time()
+            self.wait_histogram.record((started - first_added) * 1000)
+            written = self._write(rows)
+            self.flush_histogram.record((time.time() - started) * 1000)
+            
+            with self._lock:
+                self.stats['rows_written'] += written
+                self.stats['rows_failed'] += len(rows) - written
+                self.stats['flushes'] += 1
+                if reason == 'size':
+                    self.stats['flushes_by_size'] += 1
+                elif reason == 'time':
+                    self.stats['flushes_by_time'] += 1
+    
+    def _connection(self):
+        """写入专用连接（设置PRAGMA synchronous只影响这个连接）"""
+        if self._conn is None:
+            self._conn = self.engine.connect()
+            if self.synchronous and self.engine.dialect.name == 'sqlite':
+                self._conn.exec_driver_sql(f'PRAGMA synchronous={self.synchronous}')
+                self._conn.commit()
+        return self._conn
+    
+    def _write(self, rows: List[Dict]) -> int:
+        """批量插入，失败时逐行插入以免整批丢失；返回写入成功的行数"""
+        conn = self._connection()
+        # executemany要求各行的列相同（update_rows()可能给部分行加上了列），按列分组插入、一次提交
+        groups: Dict[frozenset, List[Dict]] = {}
+        for row in rows:
+            groups.setdefault(frozenset(row), []).append(row)
+        try:
+            for group in groups.values():
+                conn.execute(self._insert, group)
+            conn.commit()
+            return len(rows)
+        except Exception as e:
+            conn.rollback()
+            with self._lock:
+                self.stats['bulk_failures'] += 1
+            print(f"⚠ 批量写入访问日志失败，改为逐行写入: {e}")
+        
+        written = 0
+        for row in rows:
+            try:
+                conn.execute(self._insert, row)
+                conn.commit()
+                written += 1
+            except Exception as e:
+                conn.rollback()
+                print(f"✗ 写入访问日志失败: {e}")
+        return written
+    
+    def _flush_loop(self):
+        delay = self.max_delay_ms / 1000
+        while self.running:
+            with self._lock:
+                pending = bool(self._rows)
+                due = self._first_added + delay
+            if not pending:
+                self._wakeup.wait(1.0)
+                self._wakeup.clear()
+                continue
+            
+            remaining = due - time.time()
+            if remaining > 0:
+                time.sleep(remaining)
+                continue
+            try:
+                self.flush(reason='time')
+            except Exception as e:
+                print(f"✗ 刷新访问日志缓冲失败: {e}")
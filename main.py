@@ -1,6 +1,7 @@
 """
 Nginx日志防火墙系统 - 主程序
 """
+import os
 import sys
 import signal
 import threading
@@ -10,11 +11,26 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 from utils.helpers import load_config
 from utils.logger import setup_logger, log_threat, log_ban
-from models.database import Database, AccessLog, Fingerprint
-from core.log_monitor import NginxLogParser, LogMonitor, BatchLogProcessor
+from models.database import Database, AccessLog, Fingerprint, to_db_time
+from core.log_monitor import NginxLogParser, BatchLogProcessor, create_log_monitor
+from core.checkpoint import OffsetCheckpoint
+from core.parallel_batch import ParallelBatchLogProcessor
+from core.syslog_receiver import SyslogReceiver
+from core.ingest_queue import IngestQueue
+from core.sharded_pipeline import ShardedPipeline
+from core.unit_of_work import UnitOfWork, CommitCounter
+from core.write_buffer import AccessLogWriter
+from core.fingerprint_aggregator import FingerprintAggregator
+from core.fingerprint_cache import FingerprintCache
+from core.behavior_sketch import BehaviorSketchStore
+from core.action_executor import ActionExecutor
+from core.threat_aggregator import ThreatEventAggregator
+from core.clock import VirtualClock
+from core.replay import ReplayEngine, parse_speed
 from core.fingerprint import FingerprintGenerator, BehaviorAnalyzer
 from core.identity_chain import IdentityChainManager
 from core.threat_detector import ThreatDetector
+from core.threat_rules import THREAT_RULES_VERSION
 from core.firewall import FirewallExecutor
 from core.cache_manager import CacheManager
 from core.geo_analyzer import GeoAnalyzer
@@ -29,7 +45,15 @@ from core.auth_manager import AuthManager
 class FirewallSystem:
     """防火墙系统主类"""
     
-    def __init__(self, config_file: str = 'config.yaml'):
+    def __init__(self, config_file: str = 'config.yaml', clock=None, dry_run: bool = False,
+                 db_path: str = None):
+        """
+        Args:
+            config_file: 配置文件路径
+            clock: 注入到各模块的时钟（None表示系统时钟，回放时为虚拟时钟）
+            dry_run: 不执行实际封禁和告警（只记录到数据库），也不写入共享的Redis缓存，用于回放
+            db_path: 使用该SQLite数据库代替配置文件中的数据库（回放时写入单独的数据库）
+        """
         print("=" * 60)
         print("🛡️  Nginx日志智能防火墙系统")
         print("=" * 60)
@@ -37,6 +61,13 @@ class FirewallSystem:
         # 加载配置
         print("正在加载配置...")
         self.config = load_config(config_file)
+        self.clock = clock
+        if dry_run:
+            self.config.setdefault('firewall', {})['enabled'] = False
+            self.config.setdefault('alerts', {})['enabled'] = False
+            self.config.setdefault('redis', {})['enabled'] = False
+        if db_path:
+            self.config['database'] = dict(self.config.get('database', {}), type='sqlite', path=db_path)
         
         # 设置日志
         self.logger = setup_logger(self.config)
@@ -45,6 +76,42 @@ class FirewallSystem:
         # 初始化数据库
         print("正在初始化数据库...")
         self.db = Database(self.config)
+        # 统计数据库提交次数（每1000行日志的提交次数）
+        self.commit_counter = CommitCounter(self.db.engine)
+        
+        # 访问日志写缓冲：攒批后批量插入，代替每条日志一次提交
+        self.access_log_writer = None
+        buffer_config = self.config.get('database', {}).get('write_buffer', {})
+        if buffer_config.get('enabled', True):
+            self.access_log_writer = AccessLogWriter(
+                self.db.engine,
+                max_rows=buffer_config.get('max_rows', 500),
+                # 回放时只按条数刷新，写入时机与回放速度无关
+                max_delay_ms=None if clock else buffer_config.get('max_delay_ms', 200),
+                synchronous=buffer_config.get('synchronous')
+            )
+            self.access_log_writer.start()
+            self.db.access_log_writer = self.access_log_writer
+        
+        # 指纹访问统计聚合：已存在指纹的visit_count/last_seen增量合并后定期批量UPSERT
+        self.fingerprint_aggregator = None
+        aggregator_config = self.config.get('database', {}).get('fingerprint_aggregator', {})
+        if aggregator_config.get('enabled', True):
+            flush_interval_ms = aggregator_config.get('flush_interval_ms', 1000)
+            self.fingerprint_aggregator = FingerprintAggregator(
+                self.db.engine,
+                # 回放时只按数量刷新
+                flush_interval=None if clock or not flush_interval_ms else flush_interval_ms / 1000,
+                max_pending=aggregator_config.get('max_pending', 10000)
+            )
+            self.fingerprint_aggregator.start()
+        
+        # 指纹状态缓存：评分、身份链、地理位置等阶段读取的指纹字段缓存在进程内
+        self.fingerprint_cache = None
+        cache_config = self.config.get('database', {}).get('fingerprint_cache', {})
+        if cache_config.get('enabled', True):
+            self.fingerprint_cache = FingerprintCache(max_size=cache_config.get('max_size', 10000))
+            self.db.fingerprint_cache = self.fingerprint_cache
         
         # 初始化默认规则（如果数据库是空的）
         try:
@@ -62,31 +129,143 @@ class FirewallSystem:
         # 初始化核心模块
         print("正在初始化核心模块...")
         self.fingerprint_gen = FingerprintGenerator(self.config)
-        self.behavior_analyzer = BehaviorAnalyzer(self.config)
-        self.identity_chain_mgr = IdentityChainManager(self.db, self.config, self.fingerprint_gen)
-        self.threat_detector = ThreatDetector(self.db, self.config)
-        self.firewall = FirewallExecutor(self.db, self.config)
+        # 行为草图：每个指纹的行为多样性增量统计，代替每条日志查询最近1000条访问日志
+        self.behavior_sketch_store = None
+        sketch_config = self.config.get('fingerprint', {}).get('behavior_sketch', {})
+        if sketch_config.get('enabled', True):
+            flush_interval_ms = sketch_config.get('flush_interval_ms', 1000)
+            self.behavior_sketch_store = BehaviorSketchStore(
+                self.db.engine,
+                exact_limit=sketch_config.get('exact_limit', 256),
+                max_size=sketch_config.get('max_size', 10000),
+                # 回放时只按数量写回
+                flush_interval=None if clock or not flush_interval_ms else flush_interval_ms / 1000
+            )
+            self.behavior_sketch_store.start()
+        self.behavior_analyzer = BehaviorAnalyzer(self.config, clock, self.behavior_sketch_store)
+        self.identity_chain_mgr = IdentityChainManager(self.db, self.config, self.fingerprint_gen, clock)
+        self.threat_detector = ThreatDetector(self.db, self.config, clock)
+        # 后台检查检测规则版本，Web界面修改规则后几秒内生效（回放时只使用启动时加载的规则）
+        if not clock:
+            self.threat_detector.start_rule_refresh(
+                self.config.get('threat_detection', {}).get('rules_refresh_interval', 5)
+            )
+        self.firewall = FirewallExecutor(self.db, self.config, clock)
         
         # 初始化高级功能
         print("正在初始化高级功能...")
         self.geo_analyzer = GeoAnalyzer(self.db, self.cache_manager, self.config)
-        self.alert_manager = AlertManager(self.config)
+        self.alert_manager = AlertManager(self.config, clock)
         self.audit_logger = AuditLogger(self.config)
-        self.scoring_system = ThreatScoringSystem(self.db, self.config)
-        self.rule_engine = RuleEngine(self.db, self.config)
+        self.scoring_system = ThreatScoringSystem(self.db, self.config, clock)
+        self.rule_engine = RuleEngine(self.db, self.config, clock)
+        
+        # 威胁事件聚合：窗口内同一IP、同一威胁类型的重复命中只累加次数，不再逐条写入事件和评分历史
+        self.threat_aggregator = None
+        aggregation_config = self.config.get('threat_detection', {}).get('aggregation', {})
+        if aggregation_config.get('enabled', True):
+            flush_interval_ms = aggregation_config.get('flush_interval_ms', 1000)
+            self.threat_aggregator = ThreatEventAggregator(
+                self.db.engine,
+                window_seconds=aggregation_config.get('window_seconds', 60),
+                score_interval_seconds=aggregation_config.get('score_interval_seconds', 10),
+                # 回放时只按数量写入
+                flush_interval=None if clock or not flush_interval_ms else flush_interval_ms / 1000,
+                max_pending=aggregation_config.get('max_pending', 10000),
+                score_sink=self.scoring_system.add_score_to_fingerprint,
+                clock=clock
+            )
+            self.threat_aggregator.start()
         self.port_manager = PortManager(self.db, self.config, self.audit_logger)
+        
+        # 处置动作执行器：封禁、告警、审计在独立工作线程中执行，不阻塞日志处理
+        executor_config = self.config.get('firewall', {}).get('action_executor', {})
+        self.action_executor = ActionExecutor(
+            # 回放时同步执行，封禁记录的时间与回放进度一致
+            workers=0 if clock else executor_config.get('workers', 2),
+            max_queue=executor_config.get('max_queue', 10000),
+            ban_dedupe_seconds=executor_config.get('ban_dedupe_seconds', 60),
+            clock=clock
+        )
+        self.action_executor.start()
         self.auth_manager = AuthManager(self.db, self.config)
         
         # 日志监控器
         nginx_config = self.config.get('nginx', {})
         log_format = nginx_config.get('log_format', 'combined')
-        self.log_parser = NginxLogParser(log_format)
+        self.log_parser = NginxLogParser(log_format, nginx_config.get('json_fields'))
+        
+        # access_logs（路径或通配符列表）优先于单个access_log
+        access_log = nginx_config.get('access_logs') or nginx_config.get('access_log')
+        process_entry = self.process_log_entry
+        process_batch = self.process_log_batch
         
-        access_log = nginx_config.get('access_log')
-        self.log_monitor = LogMonitor(access_log, self.log_parser, self.process_log_entry)
+        # 分片处理流程：分析阶段按IP分布到多个工作进程，数据库写入由各分片的写入线程并行执行
+        self.pipeline = None
+        pipeline_config = nginx_config.get('pipeline', {})
+        if pipeline_config.get('workers', 1) > 1:
+            self.pipeline = ShardedPipeline(
+                self.config, self.apply_analyzed_batch,
+                workers=pipeline_config['workers'],
+                shard_key=pipeline_config.get('shard_key', 'ip'),
+                queue_batches=pipeline_config.get('queue_batches', 64),
+                fingerprint_gen=self.fingerprint_gen,
+                start_method=pipeline_config.get('start_method', 'spawn')
+            )
+            process_entry = self.pipeline.put_one
+            process_batch = self.pipeline.put
+        
+        callback = process_entry
+        batch_callback = process_batch if nginx_config.get('batch_mode', True) else None
+        
+        # 接入队列：读取与处理分离，处理变慢时读取不被阻塞
+        self.ingest_queue = None
+        queue_config = nginx_config.get('ingest_queue', {})
+        if queue_config.get('enabled', False):
+            self.ingest_queue = IngestQueue(
+                process_batch,
+                max_size=queue_config.get('max_size', 50000),
+                policy=queue_config.get('policy', 'block'),
+                sample_rate=queue_config.get('sample_rate', 0.1),
+                high_watermark=queue_config.get('high_watermark', 0.8),
+                max_batch=queue_config.get('max_batch', 5000),
+                is_protected=self.threat_detector.is_suspicious
+            )
+            callback = self.ingest_queue.put_one
+            batch_callback = self.ingest_queue.put
+        
+        checkpoint = None
+        if nginx_config.get('checkpoint_file'):
+            checkpoint = OffsetCheckpoint(
+                nginx_config['checkpoint_file'],
+                nginx_config.get('checkpoint_interval', 5)
+            )
+        syslog_config = nginx_config.get('syslog', {})
+        if syslog_config.get('enabled', False):
+            # 由nginx通过syslog推送日志，不再跟踪日志文件
+            self.log_monitor = SyslogReceiver(
+                self.log_parser, callback,
+                batch_callback=batch_callback,
+                host=syslog_config.get('host', '0.0.0.0'),
+                udp_port=syslog_config.get('udp_port', 514),
+                tcp_port=syslog_config.get('tcp_port'),
+                max_buffer_lines=syslog_config.get('max_buffer_lines', 100000),
+                recv_buffer_bytes=syslog_config.get('recv_buffer_bytes', 4 * 1024 * 1024),
+                max_frame_bytes=syslog_config.get('max_frame_bytes', 64 * 1024)
+            )
+        else:
+            self.log_monitor = create_log_monitor(
+                access_log, self.log_parser, callback,
+                batch_callback=batch_callback,
+                chunk_size=nginx_config.get('read_chunk_size', 1024 * 1024),
+                engine=nginx_config.get('tail_engine', 'auto'),
+                checkpoint=checkpoint,
+                catchup_max_bytes=nginx_config.get('catchup_max_bytes')
+            )
         
         # 定时任务调度器
         self.scheduler = BackgroundScheduler()
+        self._last_ingest_shed = 0
         self.running = False
         
         print("✓ 初始化完成")
@@ -104,19 +283,22 @@ class FirewallSystem:
             custom_count = session.query(ScoringRule).count()
             
             if threat_count == 0:
-                # 初始化默认威胁检测规则（增强版）
+                # 初始化默认威胁检测规则（增强版）：特征类规则全部按禁用写入，
+                # 由管理员在Web界面按站点情况启用后才覆盖配置文件（未启用前与配置文件的检测一致）；
+                # 窗口类规则不带参数，沿用配置文件的窗口参数，管理员设置参数后才覆盖配置
+                detection_config = self.config.get('threat_detection', {})
                 default_threats = [
                     # SQL注入检测
-                    {'category': 'sql_injection', 'name': 'SQL注入攻击', 'enabled': True,
+                    {'category': 'sql_injection', 'name': 'SQL注入攻击', 'enabled': False,
                      'patterns': json.dumps([
                          "union.*select", "select.*from", "insert.*into", "delete.*from",
                          "'; --", "' or '1'='1", "' or 1=1", "\\\"; DROP TABLE",
-                         "exec\\(", "script>", "\\\\x", "waitfor delay"
+                         "exec\\(", "\\\\x", "waitfor delay"
                      ]),
                      'threat_score': 60, 'description': '检测SQL注入攻击模式'},
                     
                     # XSS攻击
-                    {'category': 'xss_attack', 'name': 'XSS跨站脚本', 'enabled': True,
+                    {'category': 'xss_attack', 'name': 'XSS跨站脚本', 'enabled': False,
                      'patterns': json.dumps([
                          "<script", "</script>", "javascript:", "onerror=", "onload=",
                          "eval\\(", "alert\\(", "document\\.cookie", "innerHTML"
@@ -124,30 +306,31 @@ class FirewallSystem:
                      'threat_score': 50, 'description': '检测XSS跨站脚本攻击'},
                     
                     # 命令注入
-                    {'category': 'command_injection', 'name': '命令注入攻击', 'enabled': True,
+                    {'category': 'command_injection', 'name': '命令注入攻击', 'enabled': False,
                      'patterns': json.dumps([
-                         ";\\s*ls", ";\\s*cat", ";\\s*wget", ";\\s*curl", "&&", "\\|\\|",
+                         ";\\s*ls", ";\\s*cat", ";\\s*wget", ";\\s*curl",
+                         "(?:&&|\\|\\|)\\s*(?:ls|cat|id|wget|curl|sh|bash)\\b",
                          "\\$\\(", "`", "/etc/passwd", "/etc/shadow"
                      ]),
                      'threat_score': 70, 'description': '检测命令注入攻击'},
                     
                     # 路径遍历
-                    {'category': 'path_traversal', 'name': '路径遍历攻击', 'enabled': True,
+                    {'category': 'path_traversal', 'name': '路径遍历攻击', 'enabled': False,
                      'patterns': json.dumps([
                          "\\.\\./", "\\.\\.\\\\", "%2e%2e/", "%2e%2e%5c", "..%2f", "..%5c"
                      ]),
                      'threat_score': 45, 'description': '检测目录遍历攻击'},
                     
                     # 敏感文件访问
-                    {'category': 'sensitive_path', 'name': '敏感文件访问', 'enabled': True,
+                    {'category': 'sensitive_path', 'name': '敏感文件访问', 'enabled': False,
                      'patterns': json.dumps([
                          "/.env", "/.git", "/.svn", "/config.php", "/wp-config.php",
-                         "/admin", "/phpmyadmin", "/adminer", "/.ssh", "/backup"
+                         "/phpmyadmin", "/adminer", "/.ssh", "/.aws"
                      ]),
                      'threat_score': 35, 'description': '访问敏感文件或目录'},
                     
                     # 扫描工具检测
-                    {'category': 'bad_user_agent', 'name': '扫描工具UA', 'enabled': True,
+                    {'category': 'bad_user_agent', 'name': '扫描工具UA', 'enabled': False,
                      'patterns': json.dumps([
                          "masscan", "nmap", "nikto", "sqlmap", "burp", "acunetix",
                          "w3af", "metasploit", "dirbuster", "gobuster", "wpscan",
@@ -156,42 +339,49 @@ class FirewallSystem:
                      'threat_score': 40, 'description': '检测自动化扫描工具'},
                     
                     # 频率限制
-                    {'category': 'rate_limit', 'name': '高频访问限制', 'enabled': True,
-                     'parameters': json.dumps({'window_seconds': 60, 'max_requests': 120}),
-                     'threat_score': 30, 'description': '60秒内超过120次请求'},
+                    {'category': 'rate_limit', 'name': '高频访问限制',
+                     'enabled': detection_config.get('rate_limit', {}).get('enabled', True),
+                     'description': '窗口参数为空时使用配置文件threat_detection.rate_limit'},
                     
                     # 路径扫描
-                    {'category': 'scan_detection', 'name': '路径扫描检测', 'enabled': True,
-                     'parameters': json.dumps({'window_seconds': 300, 'max_404_count': 25}),
-                     'threat_score': 35, 'description': '5分钟内超过25次404'},
+                    {'category': 'scan_detection', 'name': '路径扫描检测',
+                     'enabled': detection_config.get('scan_detection', {}).get('enabled', True),
+                     'description': '窗口参数为空时使用配置文件threat_detection.scan_detection'},
                     
                     # SSRF攻击
-                    {'category': 'ssrf', 'name': 'SSRF服务端请求伪造', 'enabled': True,
+                    # 只匹配URL中的主机部分（//或@之后、端口/路径/参数结束之前），避免匹配版本号、价格等数字
+                    {'category': 'ssrf', 'name': 'SSRF服务端请求伪造', 'enabled': False,
                      'patterns': json.dumps([
-                         "localhost", "127\\.0\\.0\\.1", "0\\.0\\.0\\.0", "\\[::\\]",
-                         "169\\.254\\.", "192\\.168\\.", "10\\.", "172\\.16\\."
+                         f"(?://|@){host}(?:[:/?#\"]|$)" for host in (
+                             "localhost", "127\\.\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}", "0\\.0\\.0\\.0", "\\[::1?\\]",
+                             "169\\.254\\.\\d{1,3}\\.\\d{1,3}", "192\\.168\\.\\d{1,3}\\.\\d{1,3}",
+                             "10\\.\\d{1,3}\\.\\d{1,3}\\.\\d{1,3}", "172\\.(?:1[6-9]|2\\d|3[01])\\.\\d{1,3}\\.\\d{1,3}"
+                         )
                      ]),
                      'threat_score': 55, 'description': '检测SSRF攻击'},
                     
                     # XXE攻击
-                    {'category': 'xxe', 'name': 'XXE外部实体注入', 'enabled': True,
+                    # 实体声明区分大小写（规则默认忽略大小写）
+                    {'category': 'xxe', 'name': 'XXE外部实体注入', 'enabled': False,
                      'patterns': json.dumps([
-                         "<!DOCTYPE", "<!ENTITY", "SYSTEM", "file://", "expect://"
+                         "(?-i:<!DOCTYPE[^>]*SYSTEM)", "(?-i:<!ENTITY)", "file://", "expect://"
                      ]),
                      'threat_score': 50, 'description': '检测XXE攻击'},
                     
                     # 文件上传攻击
-                    {'category': 'file_upload', 'name': '恶意文件上传', 'enabled': True,
+                    # 检查POST/PUT请求中文件名参数（如filename=shell.php）的扩展名，而不是接收上传的路径
+                    {'category': 'file_upload', 'name': '恶意文件上传', 'enabled': False,
                      'patterns': json.dumps([
-                         "\\.php", "\\.jsp", "\\.asp", "\\.aspx", "\\.exe", "\\.sh",
-                         "\\.py", "\\.pl", "\\.rb", "\\.war", "\\.phtml"
+                         f'"[^"]*(?:file|name)[^"]*": \\["[^"]*\\.{ext}"' for ext in (
+                             "php\\d?", "phtml", "jsp", "aspx?", "exe", "sh", "py", "pl", "rb", "war"
+                         )
                      ]),
                      'threat_score': 45, 'description': '检测可疑文件上传'},
                     
                     # Web Shell特征
-                    {'category': 'webshell', 'name': 'WebShell特征', 'enabled': True,
+                    {'category': 'webshell', 'name': 'WebShell特征', 'enabled': False,
                      'patterns': json.dumps([
-                         "c99", "r57", "b374k", "wso", "webshell", "phpspy",
+                         "c99(?:shell)?\\.php", "r57(?:shell)?\\.php", "b374k", "wso\\d*\\.php", "webshell", "phpspy",
                          "eval\\(base64_decode", "assert\\("
                      ]),
                      'threat_score': 80, 'description': '检测WebShell特征'}
@@ -199,6 +389,7 @@ class FirewallSystem:
                 
                 for rule_data in default_threats:
                     session.add(ThreatDetectionRule(**rule_data))
+                self.db.bump_rule_version(session, THREAT_RULES_VERSION)
                 
                 session.commit()
                 print(f"✓ 已初始化 {len(default_threats)} 条默认威胁检测规则（增强版）")
@@ -234,120 +425,190 @@ class FirewallSystem:
         finally:
             session.close()
     
+    def process_log_batch(self, entries: list):
+        """
+        批量处理日志记录
+        由分块读取模式调用，一次处理一批已解析的日志
+        """
+        for log_data in entries:
+            self.process_log_entry(log_data)
+    
     def process_log_entry(self, log_data: dict):
         """
         处理单条日志记录
-        这是核心处理流程
+        这是核心处理流程，各阶段共用一个工作单元，处理完成后只提交一次
         """
         try:
-            ip = log_data.get('ip')
-            
-            # 检查白名单
-            if self.firewall.is_whitelisted(ip):
+            # 检查白名单（名单已编译在内存中，白名单IP不开启数据库会话）
+            if self.firewall.is_whitelisted(log_data.get('ip')):
                 return
             
-            # 1. 生成指纹
-            base_hash = self.fingerprint_gen.generate_base_hash(log_data)
-            behavior_hash = self.fingerprint_gen.generate_behavior_hash(log_data)
-            
-            log_data['base_hash'] = base_hash
-            log_data['behavior_hash'] = behavior_hash
-            
-            # 2. 保存到数据库
-            self.save_access_log(log_data)
-            
-            # 3. 更新或创建指纹记录
-            self.update_fingerprint(log_data)
-            
-            # 4. 地理位置分析
-            if self.geo_analyzer.enabled:
-                location = self.geo_analyzer.get_location(ip)
-                if location:
-                    self.geo_analyzer.update_location_metadata(base_hash, location)
-                    
-                    # 检测地理位置异常
-                    is_anomaly, reason, geo_score = self.geo_analyzer.check_geo_anomaly(ip, base_hash)
-                    if is_anomaly and self.scoring_system.enabled:
-                        self.scoring_system.add_score_to_fingerprint(base_hash, geo_score, reason)
-                        if self.alert_manager.enabled:
-                            self.alert_manager.send_threat_alert(
-                                ip, 'geo_anomaly', 'medium', reason, 
-                                {'location': location, 'score': geo_score}
-                            )
-            
-            # 5. 行为分析 - 检查是否需要创建身份链
-            behavior_analysis = self.behavior_analyzer.analyze_behavior_change(base_hash, self.db.get_session())
-            if behavior_analysis.get('should_create_chain'):
-                chain_id = self.identity_chain_mgr.check_and_create_chain(base_hash, behavior_analysis)
-                if chain_id:
-                    self.logger.info(f"创建身份链 #{chain_id} for {ip} (hash: {base_hash[:8]}...)")
-                    if self.audit_logger:
-                        self.audit_logger.log_system_event('identity_chain_created', {
-                            'chain_id': chain_id,
-                            'ip': ip,
-                            'base_hash': base_hash[:16]
-                        })
-            
-            # 6. 自定义规则检测
-            if self.rule_engine:
-                rule_matches = self.rule_engine.evaluate(log_data)
-                for match in rule_matches:
-                    if match['action'] == 'score' and self.scoring_system.enabled:
-                        self.scoring_system.add_score_to_fingerprint(
-                            base_hash, 
-                            match['score'], 
-                            f"自定义规则: {match['rule_name']}"
-                        )
-            
-            # 7. 威胁检测
-            threats = self.threat_detector.detect(log_data)
-            
-            if threats:
-                self.handle_threats(ip, base_hash, threats, log_data)
+            with UnitOfWork(self.db) as uow:
+                # 1. 生成指纹（并行回填时已在工作进程中生成）
+                base_hash = log_data.get('base_hash') or self.fingerprint_gen.generate_base_hash(log_data)
+                behavior_hash = log_data.get('behavior_hash') or self.fingerprint_gen.generate_behavior_hash(log_data)
+                
+                log_data['base_hash'] = base_hash
+                log_data['behavior_hash'] = behavior_hash
+                
+                # 2. 自定义规则和威胁检测（只使用内存状态，分片模式下在工作进程中执行）
+                rule_matches = self.rule_engine.evaluate(log_data) if self.rule_engine else []
+                threats = self.threat_detector.detect(log_data)
+                
+                self.apply_log_entry(log_data, rule_matches, threats, uow)
             
         except Exception as e:
             self.logger.error(f"处理日志条目时出错: {e}", exc_info=True)
+        finally:
+            self.commit_counter.add_lines()
     
-    def save_access_log(self, log_data: dict):
-        """保存访问日志到数据库"""
-        session = self.db.get_session()
+    def apply_analyzed_batch(self, results: list):
+        """
+        写入分片工作进程的分析结果
+        由分片处理流程各分片的写入线程并发调用（同一IP只出现在一个分片中），
+        results为 [(log_data, rule_matches, threats), ...]
+        """
+        for log_data, rule_matches, threats in results:
+            if self.firewall.is_whitelisted(log_data.get('ip')):
+                continue
+            try:
+                with UnitOfWork(self.db) as uow:
+                    self.apply_log_entry(log_data, rule_matches, threats, uow)
+            except Exception as e:
+                self.logger.error(f"处理日志条目时出错: {e}", exc_info=True)
+        self.commit_counter.add_lines(len(results))
+    
+    def apply_log_entry(self, log_data: dict, rule_matches: list, threats: list, uow: UnitOfWork):
+        """
+        执行单条日志需要访问数据库的处理：入库、指纹、地理位置、身份链、评分和封禁
+        
+        出错时抛出异常，由调用方回滚整个工作单元
+        
+        Args:
+            log_data: 已生成base_hash/behavior_hash的日志
+            rule_matches: 匹配的自定义规则
+            threats: 检测到的威胁
+            uow: 工作单元
+        """
+        ip = log_data.get('ip')
+        base_hash = log_data['base_hash']
+        
+        # 3. 保存到数据库
+        self.save_access_log(log_data, uow)
+        
+        # 4. 更新或创建指纹记录（工作单元内只加载一次，后续阶段直接使用）
+        self.update_fingerprint(log_data, uow)
+        
+        # 5. 地理位置分析
+        if self.geo_analyzer.enabled:
+            location = self.geo_analyzer.get_location(ip)
+            if location:
+                self.geo_analyzer.update_location_metadata(base_hash, location, uow)
+                
+                # 检测地理位置异常
+                is_anomaly, reason, geo_score = self.geo_analyzer.check_geo_anomaly(ip, base_hash, uow)
+                if is_anomaly and self.scoring_system.enabled:
+                    self.scoring_system.add_score_to_fingerprint(base_hash, geo_score, reason, uow=uow)
+                    if self.alert_manager.enabled:
+                        uow.after_commit(
+                            self.action_executor.submit, 'alert', self.alert_manager.send_threat_alert,
+                            ip, 'geo_anomaly', 'medium', reason,
+                            {'location': location, 'score': geo_score}
+                        )
+        
+        # 6. 行为分析 - 检查是否需要创建身份链
+        behavior_analysis = self.behavior_analyzer.analyze_behavior_change(base_hash, uow.session, log_data)
+        if behavior_analysis.get('should_create_chain'):
+            chain_id = self.identity_chain_mgr.check_and_create_chain(base_hash, behavior_analysis, uow)
+            if chain_id:
+                self.logger.info(f"创建身份链 #{chain_id} for {ip} (hash: {base_hash[:8]}...)")
+                if self.audit_logger:
+                    self.audit_logger.log_system_event('identity_chain_created', {
+                        'chain_id': chain_id,
+                        'ip': ip,
+                        'base_hash': base_hash[:16]
+                    })
+        
+        # 7. 自定义规则评分
+        for match in rule_matches:
+            if match['action'] == 'score' and self.scoring_system.enabled:
+                self.scoring_system.add_score_to_fingerprint(
+                    base_hash, 
+                    match['score'], 
+                    f"自定义规则: {match['rule_name']}",
+                    uow=uow
+                )
+        
+        # 8. 威胁处理
+        if threats:
+            self.handle_threats(ip, base_hash, threats, log_data, uow)
+    
+    def save_access_log(self, log_data: dict, uow: UnitOfWork = None):
+        """
+        保存访问日志到数据库
+        启用写缓冲时放入缓冲批量插入（传入工作单元时在其提交成功后才放入，回滚时丢弃）；
+        否则传入工作单元时由工作单元统一提交
+        """
+        row = dict(
+            timestamp=to_db_time(log_data['timestamp']),
+            ip=log_data['ip'],
+            user_agent=log_data['user_agent'],
+            request_method=log_data['request_method'],
+            request_path=log_data['request_path'],
+            query_params=log_data['query_params'],
+            status_code=log_data['status_code'],
+            referer=log_data['referer'],
+            response_size=log_data['response_size'],
+            request_time=log_data.get('request_time', 0),
+            base_hash=log_data['base_hash'],
+            behavior_hash=log_data['behavior_hash'],
+            raw_log=log_data['raw_log'],
+            source=log_data.get('source')
+        )
+        if self.access_log_writer:
+            if uow:
+                uow.after_commit(self.access_log_writer.add, row)
+            else:
+                self.access_log_writer.add(row)
+            return
+        
+        session = uow.session if uow else self.db.get_session()
         try:
-            log_entry = AccessLog(
-                timestamp=log_data['timestamp'],
-                ip=log_data['ip'],
-                user_agent=log_data['user_agent'],
-                request_method=log_data['request_method'],
-                request_path=log_data['request_path'],
-                query_params=log_data['query_params'],
-                status_code=log_data['status_code'],
-                referer=log_data['referer'],
-                response_size=log_data['response_size'],
-                request_time=log_data.get('request_time', 0),
-                base_hash=log_data['base_hash'],
-                behavior_hash=log_data['behavior_hash'],
-                raw_log=log_data['raw_log']
-            )
-            session.add(log_entry)
-            session.commit()
+            session.add(AccessLog(**row))
+            if not uow:
+                session.commit()
         except Exception as e:
+            if uow:
+                raise
             session.rollback()
             self.logger.error(f"保存访问日志失败: {e}")
         finally:
-            session.close()
+            if not uow:
+                session.close()
     
-    def update_fingerprint(self, log_data: dict):
-        """更新或创建指纹记录"""
-        session = self.db.get_session()
+    def update_fingerprint(self, log_data: dict, uow: UnitOfWork = None):
+        """
+        更新或创建指纹记录（传入工作单元时由工作单元统一提交）
+        启用聚合时，已存在指纹的访问只累加到聚合器，由聚合器批量写入
+        """
+        base_hash = log_data['base_hash']
+        timestamp = to_db_time(log_data['timestamp'])
+        aggregator = self.fingerprint_aggregator
+        if aggregator and aggregator.record(base_hash, log_data['ip'], log_data['user_agent'], timestamp):
+            return
+        
+        session = uow.session if uow else self.db.get_session()
         try:
-            base_hash = log_data['base_hash']
-            
-            fingerprint = session.query(Fingerprint).filter(
-                Fingerprint.base_hash == base_hash
-            ).first()
+            if uow:
+                fingerprint = uow.get_fingerprint(base_hash)
+            else:
+                fingerprint = session.query(Fingerprint).filter(
+                    Fingerprint.base_hash == base_hash
+                ).first()
             
             if fingerprint:
                 # 更新现有指纹
-                fingerprint.last_seen = log_data['timestamp']
+                fingerprint.last_seen = timestamp
                 fingerprint.visit_count += 1
             else:
                 # 创建新指纹
@@ -355,75 +616,186 @@ class FirewallSystem:
                     base_hash=base_hash,
                     ip=log_data['ip'],
                     user_agent=log_data['user_agent'],
-                    first_seen=log_data['timestamp'],
-                    last_seen=log_data['timestamp'],
+                    first_seen=timestamp,
+                    last_seen=timestamp,
                     visit_count=1
                 )
-                session.add(fingerprint)
+                if uow:
+                    uow.add_fingerprint(fingerprint)
+                else:
+                    session.add(fingerprint)
             
-            session.commit()
+            if not uow:
+                session.commit()
+            if aggregator:
+                # 工作单元提交成功后才记为已知：回滚时记录未写入，下次访问仍同步插入
+                if uow:
+                    uow.after_commit(aggregator.mark_known, base_hash)
+                else:
+                    aggregator.mark_known(base_hash)
         except Exception as e:
+            if uow:
+                raise
             session.rollback()
             self.logger.error(f"更新指纹失败: {e}")
         finally:
-            session.close()
+            if not uow:
+                session.close()
     
-    def handle_threats(self, ip: str, base_hash: str, threats: list, log_data: dict):
-        """处理检测到的威胁"""
+    def handle_threats(self, ip: str, base_hash: str, threats: list, log_data: dict,
+                       uow: UnitOfWork = None):
+        """
+        处理检测到的威胁
+        
+        威胁事件和评分在工作单元内写入；封禁和告警在工作单元提交后交给处置动作执行器，
+        封禁记录引用的威胁事件此时已提交。威胁事件和聚合窗口使用日志时间（与检测窗口一致），
+        延迟到达或回填的日志按其发生时间记录，回放结果与处理时间无关
+        """
+        event_time = to_db_time(log_data['timestamp'])
         for threat in threats:
             threat_type = threat['threat_type']
             severity = threat['severity']
             description = threat['description']
             
+            # 聚合窗口内的重复命中只累加到窗口的第一条威胁事件
+            if self.threat_aggregator and self._fold_threat(ip, base_hash, threat, event_time, uow):
+                continue
+            
             # 记录威胁日志
             log_threat(self.logger, ip, threat_type, description)
             
-            # 保存威胁事件
-            event_id = self.threat_detector.save_threat_event(ip, base_hash, threat)
+            # 保存威胁事件，提交后开始新的聚合窗口
+            event_id = self.threat_detector.save_threat_event(ip, base_hash, threat, uow=uow,
+                                                              timestamp=event_time)
+            if self.threat_aggregator:
+                self._after_commit(uow, self.threat_aggregator.open_window,
+                                   ip, threat_type, event_id, event_time)
             
             # 使用评分系统（如果启用）
             if self.scoring_system and self.scoring_system.enabled:
-                # 计算威胁分数
+                # 计算威胁分数（上一个聚合窗口尚未计入的分数一并计入）
                 threat_score = self.scoring_system.calculate_threat_score(threat)
+                if self.threat_aggregator:
+                    threat_score += self.threat_aggregator.take_score(ip, threat_type, base_hash)[0]
                 self.scoring_system.add_score_to_fingerprint(
                     base_hash, 
                     threat_score, 
                     f"威胁检测: {threat_type}",
-                    event_id
+                    event_id,
+                    uow=uow
                 )
                 
                 # 检查是否应该封禁
-                should_ban, ban_type, ban_duration = self.scoring_system.should_ban(base_hash)
+                should_ban, ban_type, ban_duration = self.scoring_system.should_ban(base_hash, uow)
                 
                 if should_ban:
-                    success = self.firewall.ban_ip(ip, f"评分超限: {description}", ban_duration, event_id)
-                    if success:
-                        log_ban(self.logger, ip, description)
-                        if self.audit_logger:
-                            self.audit_logger.log_ban(ip, description, ban_duration)
-                        if self.alert_manager:
-                            self.alert_manager.send_ban_alert(ip, description, ban_duration)
+                    self._after_commit(
+                        uow, self.submit_ban, ip, f"评分超限: {description}", ban_duration,
+                        event_id, description, send_alert=True
+                    )
             else:
                 # 使用传统封禁逻辑
                 should_ban = self.should_ban_for_threat(threat)
                 
                 if should_ban:
                     ban_duration = self.get_ban_duration(threat)
-                    success = self.firewall.ban_ip(ip, description, ban_duration, event_id)
-                    
-                    if success:
-                        log_ban(self.logger, ip, description)
-                        if self.audit_logger:
-                            self.audit_logger.log_ban(ip, description, ban_duration)
+                    self._after_commit(uow, self.submit_ban, ip, description, ban_duration, event_id, description)
             
             # 发送告警
             if self.alert_manager and self.alert_manager.enabled:
                 if severity in ['critical', 'high']:
-                    self.alert_manager.send_threat_alert(
+                    self._after_commit(
+                        uow, self.action_executor.submit, 'alert', self.alert_manager.send_threat_alert,
                         ip, threat_type, severity, description,
                         threat.get('details')
                     )
     
+    def _fold_threat(self, ip: str, base_hash: str, threat: dict, now,
+                     uow: UnitOfWork = None) -> bool:
+        """
+        把聚合窗口内的重复命中合并到窗口的第一条威胁事件
+        
+        合并的分数会提升封禁级别或已等待超过score_interval时一次计入指纹并判断封禁，否则暂不写入
+        
+        Args:
+            now: 命中时间（日志时间，本地naive时间）
+        
+        Returns:
+            是否已合并（False表示需要写入新的威胁事件）
+        """
+        threat_type = threat['threat_type']
+        scoring = self.scoring_system if self.scoring_system and self.scoring_system.enabled else None
+        threat_score = scoring.calculate_threat_score(threat) if scoring else 0
+        
+        folded = self.threat_aggregator.fold(ip, threat_type, base_hash, threat_score, now)
+        if folded is None:
+            return False
+        if not scoring:
+            return True
+        
+        current_score, _ = scoring.get_fingerprint_score(base_hash, uow)
+        level_up = (scoring.get_ban_type(min(200, current_score + folded['score']))
+                    != scoring.get_ban_type(current_score))
+        if not level_up and now - folded['since'] < self.threat_aggregator.score_interval:
+            return True
+        
+        score, count = self.threat_aggregator.take_score(ip, threat_type, base_hash)
+        if not count:
+            return True
+        scoring.add_score_to_fingerprint(
+            base_hash, score, f"威胁检测: {threat_type} (合并 {count} 次)", folded['event_id'], uow=uow
+        )
+        should_ban, ban_type, ban_duration = scoring.should_ban(base_hash, uow)
+        if should_ban and level_up:
+            self._after_commit(
+                uow, self.submit_ban, ip, f"评分超限: {threat['description']}", ban_duration,
+                folded['event_id'], threat['description'], send_alert=True
+            )
+        return True
+    
+    @staticmethod
+    def _after_commit(uow, func, *args, **kwargs):
+        """工作单元提交后执行（没有工作单元时立即执行）"""
+        if uow:
+            uow.after_commit(func, *args, **kwargs)
+        else:
+            func(*args, **kwargs)
+    
+    def submit_ban(self, ip: str, reason: str, duration, threat_event_id=None,
+                   description: str = None, send_alert: bool = False) -> bool:
+        """
+        提交封禁到处置动作执行器（同一IP等待中的封禁会被合并）
+        
+        Args:
+            ip: IP地址
+            reason: 封禁原因（写入封禁记录和iptables注释）
+            duration: 封禁时长（秒），None表示永久
+            threat_event_id: 威胁事件ID
+            description: 威胁描述（用于日志、审计和告警）
+            send_alert: 封禁成功后是否发送封禁告警
+        
+        Returns:
+            是否已接受
+        """
+        return self.action_executor.submit_ban(
+            ip, self._execute_ban, duration, on_success=self._on_banned,
+            reason=reason, threat_event_id=threat_event_id,
+            description=description or reason, send_alert=send_alert
+        )
+    
+    def _execute_ban(self, ip: str, duration, reason: str, threat_event_id=None, **params) -> bool:
+        """在执行器工作线程中执行封禁（封禁记录使用独立会话提交）"""
+        return self.firewall.ban_ip(ip, reason, duration, threat_event_id)
+    
+    def _on_banned(self, ip: str, duration, description: str, send_alert: bool = False, **params):
+        """封禁成功后记录日志，审计和告警按各自的优先级排队"""
+        log_ban(self.logger, ip, description)
+        if self.audit_logger:
+            self.action_executor.submit('audit', self.audit_logger.log_ban, ip, description, duration,
+                                        priority=ActionExecutor.PRIORITY_AUDIT)
+        if send_alert and self.alert_manager:
+            self.action_executor.submit('alert', self.alert_manager.send_ban_alert, ip, description, duration)
+    
     def should_ban_for_threat(self, threat: dict) -> bool:
         """判断是否应该为该威胁封禁IP"""
         severity = threat['severity']
@@ -470,10 +842,21 @@ class FirewallSystem:
             )
             self.logger.info(f"定时任务: 每{interval}秒检查过期封禁")
         
+        # 定期重新编译白名单/黑名单（通过Web接口修改时立即生效，这里用于同步其他进程直接写入数据库的条目）
+        refresh_interval = self.config.get('firewall', {}).get('list_refresh_interval', 300)
+        if refresh_interval:
+            self.scheduler.add_job(
+                self.firewall.reload_lists,
+                'interval',
+                seconds=refresh_interval,
+                id='reload_ip_lists'
+            )
+            self.logger.info(f"定时任务: 每{refresh_interval}秒刷新白名单/黑名单")
+        
         # 每天清理过期数据
         retention_days = self.config.get('fingerprint', {}).get('retention_days', 3)
         self.scheduler.add_job(
-            lambda: self.db.cleanup_old_data(retention_days),
+            lambda: self.cleanup_old_data(retention_days),
             'cron',
             hour=3,
             minute=0,
@@ -489,6 +872,121 @@ class FirewallSystem:
             id='generate_statistics'
         )
         self.logger.info("定时任务: 每小时生成统计数据")
+        
+        # 每分钟记录接入队列状态（有积压或丢弃时）
+        if self.ingest_queue:
+            self.scheduler.add_job(
+                self.log_ingest_stats,
+                'interval',
+                seconds=60,
+                id='log_ingest_stats'
+            )
+        
+        # 每分钟记录数据库提交频率
+        self.scheduler.add_job(
+            self.log_write_stats,
+            'interval',
+            seconds=60,
+            id='log_write_stats'
+        )
+        
+        # 每分钟记录分片处理流程各分片的积压情况
+        if self.pipeline:
+            self.scheduler.add_job(
+                self.log_pipeline_stats,
+                'interval',
+                seconds=60,
+                id='log_pipeline_stats'
+            )
+    
+    def log_ingest_stats(self):
+        """记录接入队列的深度、等待时间和丢弃数"""
+        stats = self.ingest_queue.get_stats()
+        shed = stats['dropped'] + stats['sampled_out']
+        if stats['depth'] == 0 and shed == self._last_ingest_shed:
+            return
+        self._last_ingest_shed = shed
+        
+        message = (f"接入队列: 深度 {stats['depth']}/{stats['capacity']}, "
+                   f"平均等待 {stats['wait_ms_avg']:.0f}ms (最大 {stats['wait_ms_max']:.0f}ms), "
+                   f"丢弃 {stats['dropped']}, 采样丢弃 {stats['sampled_out']}, "
+                   f"保留可疑 {stats['protected']}")
+        if shed:
+            self.logger.warning(message)
+        else:
+            self.logger.info(message)
+    
+    def cleanup_old_data(self, retention_days: int):
+        """清理过期数据（先写入聚合器中的指纹增量、行为草图和威胁事件次数，清理后清空内存中的指纹状态）"""
+        if self.fingerprint_aggregator:
+            self.fingerprint_aggregator.flush()
+        if self.behavior_sketch_store:
+            self.behavior_sketch_store.flush()
+        if self.threat_aggregator:
+            self.threat_aggregator.forget_all()
+        self.db.cleanup_old_data(retention_days)
+        if self.fingerprint_aggregator:
+            self.fingerprint_aggregator.forget_all()
+        if self.behavior_sketch_store:
+            self.behavior_sketch_store.forget_all()
+    
+    def log_write_stats(self):
+        """记录最近一分钟的日志行数、数据库提交次数、每1000行的提交次数和写缓冲延迟"""
+        stats = self.commit_counter.get_interval_stats()
+        if stats['lines'] == 0:
+            return
+        message = (f"数据库写入: {stats['lines']} 行日志, {stats['commits']} 次提交 "
+                   f"({stats['commits_per_1000_lines']:.0f} 次/1000行)")
+        if self.access_log_writer:
+            buffer_stats = self.access_log_writer.get_stats()
+            flush = buffer_stats['flush_latency']
+            message += (f"; 访问日志缓冲: 平均每批 {buffer_stats['rows_per_flush']:.0f} 行, "
+                        f"刷新耗时 p50 {flush['p50_ms']:.0f}ms / p99 {flush['p99_ms']:.0f}ms, "
+                        f"写入失败 {buffer_stats['rows_failed']} 行")
+        if self.fingerprint_aggregator:
+            aggregator_stats = self.fingerprint_aggregator.get_stats()
+            message += (f"; 指纹聚合: 合并 {aggregator_stats['recorded']} 次访问, "
+                        f"{aggregator_stats['flushes']} 次UPSERT (平均每次 {aggregator_stats['rows_per_flush']:.0f} 行, "
+                        f"{aggregator_stats['flush_ms_avg']:.0f}ms)")
+        if self.threat_aggregator:
+            threat_stats = self.threat_aggregator.get_stats()
+            message += (f"; 威胁事件聚合: 合并 {threat_stats['folded']} 次命中, "
+                        f"{threat_stats['windows']} 个窗口, 批量更新 {threat_stats['rows_flushed']} 行")
+        if self.behavior_sketch_store:
+            sketch_stats = self.behavior_sketch_store.get_stats()
+            message += (f"; 行为草图: {sketch_stats['size']} 个, 写回 {sketch_stats['rows_flushed']} 次, "
+                        f"从访问日志初始化 {sketch_stats['bootstrapped']} 个")
+        if self.fingerprint_cache:
+            cache_stats = self.fingerprint_cache.get_stats()
+            message += (f"; 指纹状态缓存: 命中率 {cache_stats['hit_ratio'] * 100:.1f}%, "
+                        f"{cache_stats['size']}/{cache_stats['max_size']} 条")
+        self.logger.info(message)
+        self.log_action_stats()
+    
+    def log_action_stats(self):
+        """记录处置动作执行器的队列深度和各类动作的排队/执行延迟"""
+        stats = self.action_executor.get_stats()
+        if not stats['submitted']:
+            return
+        kinds = ', '.join(
+            f"{kind} 执行 {item['executed']} 失败 {item['failed']} 丢弃 {item['dropped']} "
+            f"(排队 p99 {item['wait_latency']['p99_ms']:.0f}ms, 执行 p99 {item['run_latency']['p99_ms']:.0f}ms)"
+            for kind, item in stats['kinds'].items()
+        )
+        self.logger.info(f"处置动作: 队列 {stats['queue_depth']}/{stats['max_queue']} "
+                         f"(最大 {stats['max_queue_depth']}), 合并封禁 {stats['coalesced']}, "
+                         f"去重封禁 {stats['deduplicated']}; {kinds}")
+    
+    def log_pipeline_stats(self):
+        """记录分片处理流程每个分片的积压条数和分析耗时"""
+        stats = self.pipeline.get_stats()
+        shards = ', '.join(
+            f"#{shard['shard']} 积压 {shard['pending']} (最大 {shard['max_pending']}), "
+            f"分析 {shard['analyzed']} 条 {shard['busy_seconds']:.1f}s"
+            for shard in stats['shards']
+        )
+        self.logger.info(f"分片处理流程: 已写入 {stats['written']} 条, "
+                         f"写入耗时 {stats['write_seconds']:.1f}s; {shards}")
     
     def generate_statistics(self):
         """生成统计数据"""
@@ -552,6 +1050,10 @@ class FirewallSystem:
         signal.signal(signal.SIGINT, self._signal_handler)
         signal.signal(signal.SIGTERM, self._signal_handler)
         
+        # 启动分片工作进程（以spawn方式启动，不复制初始化时已启动的写缓冲、聚合器等后台线程的状态）
+        if self.pipeline:
+            self.pipeline.start()
+        
         # 启动定时任务
         self.setup_scheduled_tasks()
         self.scheduler.start()
@@ -565,7 +1067,13 @@ class FirewallSystem:
         print("=" * 60)
         print("🚀 系统已启动")
         print("=" * 60)
-        print(f"📝 日志文件: {self.config['nginx']['access_log']}")
+        syslog_config = self.config['nginx'].get('syslog', {})
+        if syslog_config.get('enabled', False):
+            print(f"📝 日志来源: syslog (UDP {syslog_config.get('udp_port', 514)}"
+                  f"{', TCP ' + str(syslog_config['tcp_port']) if syslog_config.get('tcp_port') else ''})")
+        else:
+            access_logs = self.config['nginx'].get('access_logs') or [self.config['nginx']['access_log']]
+            print(f"📝 日志文件: {', '.join(access_logs)}")
         print(f"💾 数据库: {self.config['database']['path']}")
         print(f"🔥 防火墙: {'启用' if self.firewall.enabled else '禁用'}")
         print(f"⚡ Redis缓存: {'启用' if self.cache_manager.is_enabled() else '禁用'}")
@@ -574,6 +1082,8 @@ class FirewallSystem:
         print(f"🔔 实时告警: {'启用' if self.alert_manager.enabled else '禁用'}")
         print(f"📊 评分系统: {'启用' if self.scoring_system.enabled else '禁用'}")
         print(f"⚙️  自定义规则: {len(self.rule_engine.rules)} 条")
+        if self.pipeline:
+            print(f"🧩 分片处理: {self.pipeline.workers} 个工作进程 (按{self.pipeline.shard_key}分片)")
         
         if web_config.get('enabled'):
             print(f"🌐 管理后台: http://{web_config['host']}:{web_config['port']}")
@@ -592,6 +1102,8 @@ class FirewallSystem:
             })
         
         # 启动日志监控
+        if self.ingest_queue:
+            self.ingest_queue.start()
         try:
             self.log_monitor.start()
         except KeyboardInterrupt:
@@ -608,7 +1120,11 @@ class FirewallSystem:
                 self.threat_detector, self.identity_chain_mgr,
                 self.cache_manager, self.geo_analyzer, 
                 self.audit_logger, self.scoring_system,
-                self.port_manager, self.auth_manager
+                self.port_manager, self.auth_manager,
+                self.ingest_queue, self.pipeline,
+                self.commit_counter, self.access_log_writer,
+                self.fingerprint_aggregator, self.fingerprint_cache,
+                self.action_executor, self.threat_aggregator
             )
             
             def run_flask():
@@ -638,8 +1154,14 @@ class FirewallSystem:
         if self.audit_logger:
             self.audit_logger.log_system_event('system_stop')
         
-        # 停止日志监控
+        # 停止日志监控，并处理完接入队列和分片处理流程中剩余的日志
         self.log_monitor.stop()
+        if self.ingest_queue:
+            self.ingest_queue.stop()
+        if self.pipeline:
+            self.pipeline.stop()
+        self.threat_detector.stop_rule_refresh()
+        self.flush_pending_writes()
         
         # 停止定时任务
         self.scheduler.shutdown()
@@ -652,6 +1174,31 @@ class FirewallSystem:
         print("✓ 系统已关闭")
         sys.exit(0)
     
+    def flush_pending_writes(self):
+        """写入缓冲中尚未落盘的访问日志、指纹增量、行为草图和威胁事件次数，执行完排队的处置动作（停止系统、批量处理和回放结束时调用）"""
+        if self.fingerprint_aggregator:
+            self.fingerprint_aggregator.close()
+            stats = self.fingerprint_aggregator.get_stats()
+            self.logger.info(f"指纹聚合已刷新: 合并 {stats['recorded']} 次访问, "
+                             f"{stats['flushes']} 次UPSERT 共 {stats['rows_flushed']} 行")
+        if self.behavior_sketch_store:
+            self.behavior_sketch_store.close()
+        if self.threat_aggregator:
+            self.threat_aggregator.close()
+            stats = self.threat_aggregator.get_stats()
+            self.logger.info(f"威胁事件聚合已刷新: 合并 {stats['folded']} 次命中, "
+                             f"批量更新 {stats['rows_flushed']} 行")
+        if self.access_log_writer:
+            self.access_log_writer.close()
+            stats = self.access_log_writer.get_stats()
+            self.logger.info(f"访问日志缓冲已刷新: 共写入 {stats['rows_written']} 行, "
+                             f"{stats['flushes']} 批, 失败 {stats['rows_failed']} 行")
+        # 执行完排队中的封禁、审计和告警
+        self.action_executor.close()
+        stats = self.action_executor.get_stats()
+        self.logger.info(f"处置动作已执行: {stats['executed']} 个, 失败 {stats['failed']}, "
+                         f"丢弃 {stats['dropped']}, 合并封禁 {stats['coalesced']}, 去重封禁 {stats['deduplicated']}")
+    
     def _signal_handler(self, signum, frame):
         """信号处理器"""
         self.stop()
@@ -660,18 +1207,49 @@ class FirewallSystem:
 def main():
     """主函数"""
     import argparse
+    import tempfile
     
     parser = argparse.ArgumentParser(description='Nginx日志智能防火墙系统')
     parser.add_argument('-c', '--config', default='config.yaml', help='配置文件路径')
-    parser.add_argument('--batch', help='批量处理历史日志文件')
+    parser.add_argument('--batch', help='批量处理历史日志（文件、目录或通配符，支持.gz/.bz2/.xz/.zst）')
     parser.add_argument('--max-lines', type=int, help='批量处理最大行数')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='批量处理的并行进程数（大于1时使用多进程解析和生成指纹）')
+    parser.add_argument('--replay', help='按日志时间回放历史日志（虚拟时钟，不执行实际封禁和告警）')
+    parser.add_argument('--speed', default='max', help='回放速度，如 50x，max 表示不限速（默认）')
+    parser.add_argument('--db', help='回放结果写入的SQLite数据库（不能是配置文件中的数据库，默认写入新建的临时文件）')
     
     args = parser.parse_args()
     
     # 加载配置
     config = load_config(args.config)
     
-    if args.batch:
+    if args.replay:
+        # 回放模式：各模块使用由日志时间驱动的虚拟时钟
+        try:
+            speed = parse_speed(args.speed)
+        except ValueError:
+            parser.error(f"无效的回放速度: {args.speed}")
+        
+        # 回放写入单独的数据库，不影响生产数据和实时评分
+        db_config = config.get('database', {})
+        if args.db:
+            db_path = args.db
+            if (db_config.get('type') == 'sqlite' and os.path.realpath(db_path) ==
+                    os.path.realpath(db_config.get('path', 'firewall.db'))):
+                parser.error(f"回放不能写入配置文件中的数据库: {db_path}，请用 --db 指定其他SQLite文件")
+        else:
+            fd, db_path = tempfile.mkstemp(prefix='firewall-replay-', suffix='.db')
+            os.close(fd)
+        
+        clock = VirtualClock()
+        system = FirewallSystem(args.config, clock=clock, dry_run=True, db_path=db_path)
+        print(f"ℹ 回放结果将写入数据库: {db_path}")
+        
+        engine = ReplayEngine(system.log_parser, system.process_log_entry, clock, speed)
+        engine.replay(args.replay, args.max_lines)
+        system.flush_pending_writes()
+    elif args.batch:
         # 批量处理模式
         print(f"批量处理日志文件: {args.batch}")
         
@@ -684,10 +1262,15 @@ def main():
         system = FirewallSystem(args.config)
         
         log_format = config.get('nginx', {}).get('log_format', 'combined')
-        parser = NginxLogParser(log_format)
-        processor = BatchLogProcessor(parser, system.process_log_entry)
+        if args.workers > 1:
+            processor = ParallelBatchLogProcessor(log_format, config, system.process_log_entry,
+                                                  workers=args.workers)
+        else:
+            parser = NginxLogParser(log_format, config.get('nginx', {}).get('json_fields'))
+            processor = BatchLogProcessor(parser, system.process_log_entry)
         
         processor.process_file(args.batch, args.max_lines)
+        system.flush_pending_writes()
         print("处理完成")
     else:
         # 实时监控模式
@@ -1,7 +1,7 @@
 """
 数据库模型定义
 """
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey, Index, func
+from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey, Index, func, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, timedelta
@@ -10,6 +10,16 @@ import json
 Base = declarative_base()
 
 
+def to_db_time(timestamp: datetime) -> datetime:
+    """
+    将带时区的时间转换为数据库使用的本地时间（不带时区）
+    数据库中的时间列与datetime.now()比较，统一存储为本地时间
+    """
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
 class AccessLog(Base):
     """访问日志记录"""
     __tablename__ = 'access_logs'
@@ -38,6 +48,9 @@ class AccessLog(Base):
     # 原始日志行
     raw_log = Column(Text)
     
+    # 日志来源（日志文件路径，多站点时用于区分server块）
+    source = Column(String(255), index=True)
+    
     __table_args__ = (
         Index('idx_base_behavior', 'base_hash', 'behavior_hash'),
         Index('idx_ip_timestamp', 'ip', 'timestamp'),
@@ -60,6 +73,8 @@ class Fingerprint(Base):
     # 统计信息
     visit_count = Column(Integer, default=1)
     unique_behaviors = Column(Integer, default=1)  # 不同行为指纹数量
+    # 行为统计草图（JSON，见core/behavior_sketch.py）：访问次数、不同行为/路径模式数、状态码计数
+    behavior_sketch = Column(Text)
     
     # 所属身份链ID（如果已归档到父指纹）
     identity_chain_id = Column(Integer, ForeignKey('identity_chains.id'), nullable=True, index=True)
@@ -129,6 +144,11 @@ class ThreatEvent(Base):
     # 是否已处理
     handled = Column(Boolean, default=False)
     action_taken = Column(String(50))  # banned, alerted, ignored
+    
+    # 聚合窗口内同一IP、同一威胁类型的命中次数和最后一次命中时间（见core/threat_aggregator.py）
+    # 旧版本数据库迁移后为NULL，统计时按1次计算
+    occurrence_count = Column(Integer, default=1)
+    last_seen = Column(DateTime, index=True)
 
 
 class BanRecord(Base):
@@ -249,6 +269,9 @@ class ScoringRule(Base):
     # 分数
     score = Column(Integer)
     
+    # 匹配后的动作
+    action = Column(String(20), default='score')  # score
+    
     # 是否启用
     enabled = Column(Boolean, default=True)
     
@@ -260,6 +283,45 @@ class ScoringRule(Base):
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
 
 
+class ThreatDetectionRule(Base):
+    """威胁检测规则（Web界面管理，检测引擎按规则版本热加载）"""
+    __tablename__ = 'threat_detection_rules'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    
+    # 规则类别：sql_injection, xss_attack, sensitive_path, bad_user_agent, command_injection,
+    # path_traversal, ssrf, xxe, file_upload, webshell 等特征类规则，以及 rate_limit, scan_detection
+    category = Column(String(50), index=True)
+    name = Column(String(100))
+    description = Column(Text)
+    
+    # 是否启用
+    enabled = Column(Boolean, default=True)
+    
+    # 特征列表（JSON数组，也可以每行一个）
+    patterns = Column(Text)  # ["union.*select", "select.*from"]
+    
+    # 参数（JSON，rate_limit/scan_detection使用）
+    parameters = Column(Text)  # {"window_seconds": 60, "max_requests": 120}
+    
+    # 命中时的基础威胁分数（0表示使用评分配置中按威胁类型的分数）
+    threat_score = Column(Integer, default=0)
+    
+    # 创建和更新时间
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+class RuleVersion(Base):
+    """规则版本（修改规则时递增，各进程的检测引擎据此重新加载规则）"""
+    __tablename__ = 'rule_versions'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(50), unique=True, index=True)  # threat_detection
+    version = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.now)
+
+
 class PortRule(Base):
     """端口规则"""
     __tablename__ = 'port_rules'
@@ -394,6 +456,7 @@ class Database:
         
         # 创建所有表
         Base.metadata.create_all(self.engine)
+        self._migrate_columns()
         
         # 创建会话工厂（配置自动提交和过期）
         self.Session = sessionmaker(
@@ -402,11 +465,67 @@ class Database:
             autocommit=False,
             expire_on_commit=False  # 提交后对象不过期，减少查询
         )
+        
+        # 指纹状态缓存（core.fingerprint_cache.FingerprintCache，由FirewallSystem按配置设置）
+        self.fingerprint_cache = None
+        # 访问日志写缓冲（core.write_buffer.AccessLogWriter，由FirewallSystem按配置设置）
+        self.access_log_writer = None
     
     def get_session(self):
         """获取数据库会话"""
         return self.Session()
     
+    def invalidate_fingerprint_cache(self, base_hash=None):
+        """不经过工作单元修改指纹后使指纹状态缓存失效（base_hash为None时清空）"""
+        if self.fingerprint_cache is not None:
+            self.fingerprint_cache.invalidate(base_hash)
+    
+    def get_rule_version(self, name: str) -> int:
+        """获取规则版本（没有记录时为0）"""
+        session = self.get_session()
+        try:
+            version = session.query(RuleVersion.version).filter(RuleVersion.name == name).scalar()
+            return version or 0
+        finally:
+            session.close()
+    
+    def bump_rule_version(self, session, name: str):
+        """在修改规则的会话中递增规则版本（随该会话一起提交）"""
+        updated = session.query(RuleVersion).filter(RuleVersion.name == name).update(
+            {RuleVersion.version: RuleVersion.version + 1, RuleVersion.updated_at: datetime.now()},
+            synchronize_session=False
+        )
+        if not updated:
+            session.add(RuleVersion(name=name, version=1, updated_at=datetime.now()))
+    
+    def _migrate_columns(self):
+        """
+        为已存在的表补充新增的列及其索引
+        create_all()只创建缺失的表，旧版本数据库中的表需要手动ALTER TABLE
+        """
+        inspector = inspect(self.engine)
+        existing_tables = set(inspector.get_table_names())
+        
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            
+            existing_columns = {col['name'] for col in inspector.get_columns(table.name)}
+            missing = [col for col in table.columns if col.name not in existing_columns]
+            if not missing:
+                continue
+            
+            with self.engine.begin() as conn:
+                for column in missing:
+                    col_type = column.type.compile(dialect=self.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+                    print(f"✓ 数据库迁移: {table.name}.{column.name}")
+                
+                missing_names = {col.name for col in missing}
+                for index in table.indexes:
+                    if missing_names.intersection(col.name for col in index.columns):
+                        index.create(conn, checkfirst=True)
+    
     def cleanup_old_data(self, retention_days=3):
         """
         清理过期数据（智能清理策略）
@@ -474,6 +593,8 @@ class Database:
                         deleted_chains += 1
             
             session.commit()
+            if deleted_fps > 0:
+                self.invalidate_fingerprint_cache()
             
             if deleted_logs > 0 or deleted_fps > 0:
                 print(f"数据清理完成: 删除 {deleted_logs} 条日志, {deleted_fps} 个指纹, {deleted_chains} 个身份链")
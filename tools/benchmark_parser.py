@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+日志解析器基准测试
+校验快速解析与原正则解析的结果一致，并比较每秒解析行数
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import random
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+
+from core.log_monitor import NginxLogParser
+from tools.test_log_generator import (generate_normal_request, generate_scan_attack,
+                                      generate_sql_injection, generate_xss_attack,
+                                      generate_rate_limit_attack)
+
+
+# 快速切分需要回退到正则或urlparse的特殊行
+EDGE_CASES = [
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET /a?x=1&x=2&y= HTTP/1.1" 200 - "-" "UA"',
+    '10.0.0.1 - bob [17/Oct/2025:18:30:00 +0800] "GET /q?s=\\"x\\" HTTP/1.1" 200 12 "-" "UA"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET /a" b" HTTP/1.1" 200 1 "-" "UA"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET http://example.com/p?x=1 HTTP/1.1" 200 1 "-" "UA"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET //evil/p HTTP/1.1" 400 1 "-" "UA"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET /a;jsessionid=1?x=1 HTTP/1.1" 200 1 "-" "UA"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET /a#frag?x=1 HTTP/1.1" 200 1 "-" "UA"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "-" 400 0 "-" "-"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "\\x16\\x03\\x01" 400 157 "-" "-"',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET / HTTP/1.1" 200 1 "" ""',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET / HTTP/1.1" 200 1 "http://ref/\\" x" "UA "quoted""',
+    '10.0.0.1 - - [17/Oct/2025:18:30:00 +0800] "GET / HTTP/1.1" 200 1 "-" "UA" "extra"',
+    '::1 - - [17/Oct/2025:18:30:00 +0800] "GET / HTTP/1.1" 200 1 "-" "UA"',
+    'garbage line',
+    '',
+]
+
+
+def legacy_parse_line(pattern, line):
+    """正则 + urlparse + strptime的参考实现（作为正确性和性能的基准）"""
+    match = pattern.match(line.strip())
+    if not match:
+        return None
+    
+    data = match.groupdict()
+    request = data.get('request', '')
+    request_parts = request.split(' ', 2)
+    
+    if len(request_parts) >= 2:
+        method = request_parts[0]
+        full_path = request_parts[1]
+    else:
+        method = 'UNKNOWN'
+        full_path = request
+    
+    parsed_url = urlparse(full_path)
+    path = parsed_url.path
+    query_params = dict(parse_qs(parsed_url.query))
+    
+    time_str = data.get('time', '')
+    timestamp = datetime.strptime(time_str, '%d/%b/%Y:%H:%M:%S %z').astimezone(timezone.utc)
+    
+    size = data.get('size', '0')
+    if size == '-':
+        size = 0
+    else:
+        size = int(size)
+    
+    return {
+        'ip': data.get('ip'),
+        'user_agent': data.get('user_agent', ''),
+        'request_method': method,
+        'request_path': path,
+        'query_params': json.dumps(query_params) if query_params else '',
+        'status_code': int(data.get('status', 0)),
+        'referer': data.get('referer', ''),
+        'response_size': size,
+        'request_time': float(data.get('request_time', 0)) if 'request_time' in data else 0,
+        'timestamp': timestamp,
+        'epoch': timestamp.timestamp(),
+        'time_estimated': False,
+        'raw_log': line.strip()
+    }
+
+
+def generate_lines(count, log_format):
+    """生成测试日志行（时间按顺序递增）"""
+    generators = [generate_normal_request] * 14 + [generate_scan_attack] * 2 + [
+        generate_sql_injection, generate_xss_attack, generate_rate_limit_attack, generate_rate_limit_attack
+    ]
+    base = int(time.time()) - count // 20
+    lines = []
+    for i in range(count):
+        line = random.choice(generators)().rstrip('\n')
+        stamp = datetime.fromtimestamp(base + i // 20).strftime('%d/%b/%Y:%H:%M:%S +0800')
+        line = line.replace(line[line.index('[') + 1:line.index(']')], stamp, 1)
+        if log_format == 'custom':
+            line += f' {random.random():.3f}'
+        lines.append(line)
+    return lines
+
+
+def check(parser, lines, log_format):
+    """逐行比较快速解析与原正则解析的结果"""
+    pattern = parser.pattern
+    mismatches = 0
+    for line in lines:
+        expected = legacy_parse_line(pattern, line)
+        actual = parser.parse_line(line)
+        if expected != actual:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"✗ 结果不一致 ({log_format}): {line!r}")
+                print(f"    正则: {expected}")
+                print(f"    快速: {actual}")
+    return mismatches
+
+
+def bench(func, lines, rounds):
+    """返回每秒解析行数（取多轮中最快的一次）"""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for line in lines:
+            func(line)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(lines) / best
+
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='日志解析器基准测试')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='测试日志行数')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='测试轮数')
+    args = parser.parse_args()
+    
+    random.seed(0)
+    failed = False
+    
+    for log_format in ('combined', 'custom'):
+        log_parser = NginxLogParser(log_format)
+        lines = generate_lines(args.count, log_format)
+        edge_cases = EDGE_CASES if log_format == 'combined' else [
+            line + ' 0.005' for line in EDGE_CASES if line] + [
+            EDGE_CASES[0] + ' 1.2.3', EDGE_CASES[0] + ' 0.1abc', EDGE_CASES[0] + ' -']
+        
+        mismatches = 0
+        for line in edge_cases:
+            try:
+                mismatches += check(log_parser, [line], log_format)
+            except ValueError:
+                # 原实现同样会抛出异常的行（如 1.2.3 这样的响应时间）
+                try:
+                    log_parser.parse_line(line)
+                    mismatches += 1
+                    print(f"✗ 原实现抛出异常而快速解析没有 ({log_format}): {line!r}")
+                except ValueError:
+                    pass
+        mismatches += check(log_parser, lines, log_format)
+        
+        # 时间字段：时区换算以及无法解析时的处理
+        for time_str, expected in [('17/Oct/2025:18:30:00 +0800', '2025-10-17 10:30:00+00:00'),
+                                   ('01/Jan/2026:00:15:00 -0530', '2026-01-01 05:45:00+00:00'),
+                                   ('31/Dec/2025:23:59:59 +0000', '2025-12-31 23:59:59+00:00')]:
+            if str(log_parser._parse_time(time_str)[0]) != expected:
+                mismatches += 1
+                print(f"✗ 时间解析错误: {time_str}")
+        fallbacks = log_parser.stats['timestamp_fallbacks']
+        last = log_parser._parse_time('31/Dec/2025:23:59:59 +0000')
+        if log_parser._parse_time('99/Foo/2025:xx') != last[:2] + (True,) or \
+                log_parser.stats['timestamp_fallbacks'] != fallbacks + 1:
+            mismatches += 1
+            print("✗ 无法解析的时间未沿用上一条日志的时间或未计数")
+        
+        legacy_rate = bench(lambda line: legacy_parse_line(log_parser.pattern, line), lines, args.rounds)
+        fast_rate = bench(log_parser.parse_line, lines, args.rounds)
+        speedup = fast_rate / legacy_rate
+        
+        status = '✓' if mismatches == 0 else '✗'
+        print(f"{status} {log_format}: {len(lines) + len(edge_cases)} 行, {mismatches} 行不一致")
+        print(f"  正则解析: {legacy_rate:>10,.0f} 行/秒")
+        print(f"  快速解析: {fast_rate:>10,.0f} 行/秒  ({speedup:.1f}x)")
+        failed = failed or mismatches > 0
+    
+    # 编译后的log_format：与内置combined解析结果一致
+    combined_format = ('$remote_addr - $remote_user [$time_local] "$request" '
+                       '$status $body_bytes_sent "$http_referer" "$http_user_agent"')
+    compiled_parser = NginxLogParser(combined_format)
+    builtin_parser = NginxLogParser('combined')
+    lines = generate_lines(args.count, 'combined')
+    mismatches = 0
+    for line in lines:
+        expected = builtin_parser.parse_line(line)
+        actual = compiled_parser.parse_line(line)
+        if actual is None or any(actual[key] != value for key, value in expected.items()):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"✗ 结果不一致 (log_format): {line!r}")
+    
+    compiled_rate = bench(compiled_parser.parse_line, lines, args.rounds)
+    status = '✓' if mismatches == 0 else '✗'
+    print(f"{status} log_format: {len(lines)} 行, {mismatches} 行不一致")
+    print(f"  编译解析: {compiled_rate:>10,.0f} 行/秒")
+    failed = failed or mismatches > 0
+    
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
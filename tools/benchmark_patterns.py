@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+威胁特征匹配基准测试
+校验多模式匹配器（Aho-Corasick锚点预筛选）与逐个正则/子串匹配的检测结果一致，
+并比较特征数量增加时每秒检测的日志行数
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import re
+import string
+import time
+
+from core.log_monitor import NginxLogParser
+from core.multi_pattern import ahocorasick
+from core.threat_detector import ThreatDetector
+from tools.test_log_generator import (generate_normal_request, generate_scan_attack,
+                                      generate_sql_injection, generate_xss_attack,
+                                      generate_rate_limit_attack)
+
+
+# 与默认威胁检测规则相同的基础特征
+BASE_SIGNATURES = {
+    'sql_injection': ["union.*select", "select.*from", "insert.*into", "delete.*from",
+                      "'; --", "' or '1'='1", "' or 1=1", "\\\"; DROP TABLE",
+                      "exec\\(", "waitfor delay"],
+    'xss_detection': ["<script", "</script>", "javascript:", "onerror=", "onload=",
+                      "eval\\(", "alert\\(", "document\\.cookie", "innerHTML"],
+    'bad_user_agents': ["masscan", "nmap", "nikto", "sqlmap", "burp", "acunetix",
+                        "w3af", "metasploit", "dirbuster", "gobuster", "wpscan",
+                        "zgrab", "python-requests/", "go-http-client"],
+    'sensitive_paths': ["/.env", "/.git", "/.svn", "/config.php", "/wp-config.php",
+                        "/phpmyadmin", "/adminer", "/.ssh", "/backup"],
+}
+
+
+def random_word(rng, low=5, high=12):
+    return ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(low, high)))
+
+
+def build_config(total, seed=0):
+    """
+    基础特征加上随机生成的特征，共约total个
+    随机特征一半为字面量、一半为正则，按比例分配到四个类别
+    """
+    rng = random.Random(seed)
+    signatures = {key: list(values) for key, values in BASE_SIGNATURES.items()}
+    extra = max(0, total - sum(len(values) for values in signatures.values()))
+    for i in range(extra):
+        key = ('sql_injection', 'xss_detection', 'bad_user_agents', 'sensitive_paths')[i % 4]
+        if key == 'sensitive_paths':
+            signatures[key].append('/' + random_word(rng))
+        elif i % 8 < 4:
+            signatures[key].append(random_word(rng))
+        else:
+            signatures[key].append(f'{random_word(rng, 3, 6)}\\d+{random_word(rng, 3, 6)}')
+    
+    return {'threat_detection': {
+        'rate_limit': {'enabled': False},
+        'scan_detection': {'enabled': False},
+        'sql_injection': {'patterns': signatures['sql_injection']},
+        'xss_detection': {'patterns': signatures['xss_detection']},
+        'bad_user_agents': {'patterns': signatures['bad_user_agents']},
+        'sensitive_paths': {'paths': signatures['sensitive_paths']},
+    }}
+
+
+class LegacySignatures:
+    """逐个正则/子串匹配的参考实现（多模式匹配器之前的检测方式）"""
+    
+    def __init__(self, config):
+        detection = config['threat_detection']
+        self.sql_patterns = [re.compile(p, re.IGNORECASE) for p in detection['sql_injection']['patterns']]
+        self.xss_patterns = [re.compile(p, re.IGNORECASE) for p in detection['xss_detection']['patterns']]
+        self.bad_ua_patterns = [re.compile(p, re.IGNORECASE) for p in detection['bad_user_agents']['patterns']]
+        self.sensitive_paths = detection['sensitive_paths']['paths']
+    
+    def detect(self, log_data):
+        request_path = log_data.get('request_path', '')
+        query_params = log_data.get('query_params', '')
+        threats = []
+        for threat_type, patterns in (('sql_injection', self.sql_patterns), ('xss_attack', self.xss_patterns)):
+            if any(p.search(s) for s in (request_path, query_params) for p in patterns):
+                threats.append(threat_type)
+        if any(path in request_path for path in self.sensitive_paths):
+            threats.append('sensitive_path_access')
+        user_agent = log_data.get('user_agent', '').lower()
+        if any(p.search(user_agent) for p in self.bad_ua_patterns):
+            threats.append('bad_user_agent')
+        return threats
+
+
+def generate_entries(count, seed=0):
+    """用测试日志生成器生成日志并解析（约30%为攻击流量）"""
+    random.seed(seed)
+    generators = [generate_normal_request] * 14 + [generate_scan_attack] * 2 + [
+        generate_sql_injection, generate_xss_attack, generate_rate_limit_attack, generate_rate_limit_attack
+    ]
+    parser = NginxLogParser('combined')
+    entries = []
+    while len(entries) < count:
+        log_data = parser.parse_line(random.choice(generators)())
+        if log_data:
+            entries.append(log_data)
+    return entries
+
+
+def bench(func, entries, rounds):
+    """返回每秒检测行数（取多轮中最快的一次）"""
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for log_data in entries:
+            func(log_data)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(entries) / best
+
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='威胁特征匹配基准测试')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='测试日志行数')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='测试轮数')
+    parser.add_argument('-p', '--patterns', default='42,200,1000,5000',
+                        help='特征总数（逗号分隔，逐个测试）')
+    args = parser.parse_args()
+    
+    entries = generate_entries(args.count)
+    print(f"测试日志: {len(entries)} 行, Aho-Corasick: {'pyahocorasick' if ahocorasick else '纯Python实现'}")
+    failed = False
+    
+    for total in (int(value) for value in args.patterns.split(',')):
+        config = build_config(total)
+        legacy = LegacySignatures(config)
+        detector = ThreatDetector(None, config)
+        
+        mismatches = 0
+        for log_data in entries:
+            expected = legacy.detect(log_data)
+            actual = [threat['threat_type'] for threat in detector.detect(log_data)]
+            if expected != actual:
+                mismatches += 1
+                if mismatches <= 5:
+                    print(f"✗ 结果不一致: {log_data['request_path']!r} {log_data['user_agent']!r}")
+                    print(f"    逐个匹配:   {expected}")
+                    print(f"    多模式匹配: {actual}")
+        
+        legacy_rate = bench(legacy.detect, entries, args.rounds)
+        combined_rate = bench(detector.detect, entries, args.rounds)
+        stats = detector._ruleset.matchers['path'].get_stats()
+        
+        status = '✓' if mismatches == 0 else '✗'
+        print(f"{status} {total} 个特征: {mismatches} 行不一致 "
+              f"(路径匹配器: {stats['patterns']} 个模式, 自动机 {stats['automaton_states']} 个状态, "
+              f"无锚点 {stats['unanchored']} 个)")
+        print(f"  逐个匹配:   {legacy_rate:>10,.0f} 行/秒")
+        print(f"  多模式匹配: {combined_rate:>10,.0f} 行/秒  ({combined_rate / legacy_rate:.1f}x)")
+        failed = failed or mismatches > 0
+    
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
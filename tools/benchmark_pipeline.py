@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+分片处理流程基准测试
+比较1~8个工作进程时分析阶段（指纹、自定义规则、威胁检测）的吞吐量，
+并校验分片处理检测到的威胁与单进程顺序处理完全一致
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from core.log_monitor import NginxLogParser
+from core.sharded_pipeline import ShardAnalyzer, ShardedPipeline, shard_for
+from tools.benchmark_parser import generate_lines
+from tools.test_log_generator import TEST_IPS
+
+
+def make_config(db_path, shard_key):
+    return {
+        'database': {'type': 'sqlite', 'path': db_path},
+        'nginx': {'pipeline': {'shard_key': shard_key}},
+    }
+
+
+def threat_summary(results):
+    """按 (IP, 威胁类型) 统计检测结果"""
+    counter = Counter()
+    for log_data, _, threats in results:
+        for threat in threats:
+            counter[(log_data['ip'], threat['threat_type'])] += 1
+    return counter
+
+
+def run_sequential(config, entries):
+    """单进程顺序处理（作为正确性基准）"""
+    analyzer = ShardAnalyzer(config)
+    started = time.perf_counter()
+    results = []
+    for entry in entries:
+        _, _, rule_matches, threats = analyzer.analyze(dict(entry))
+        results.append((entry, rule_matches, threats))
+    return results, time.perf_counter() - started
+
+
+def run_sharded(config, entries, workers, shard_key, batch_size):
+    """分片处理，返回 (结果, 耗时, 统计)"""
+    results = []
+    done = threading.Event()
+    
+    def collect(batch):
+        results.extend(batch)
+        if len(results) >= len(entries):
+            done.set()
+    
+    pipeline = ShardedPipeline(config, lambda batch: None, workers=workers, shard_key=shard_key)
+    pipeline.start()
+    
+    # 等待工作进程完成初始化，不计入吞吐量：向每个分片发送一条预热日志（使用单独的IP，不影响检测窗口）
+    warmup = {}
+    for k in range(1, 255):
+        ip = f'192.0.2.{k}'
+        warmup.setdefault(shard_for(ip, workers), dict(entries[0], ip=ip))
+    pipeline.put(list(warmup.values()))
+    while pipeline.get_stats()['written'] < len(warmup):
+        time.sleep(0.01)
+    pipeline.result_callback = collect
+    
+    started = time.perf_counter()
+    for i in range(0, len(entries), batch_size):
+        pipeline.put([dict(entry) for entry in entries[i:i + batch_size]])
+    done.wait()
+    elapsed = time.perf_counter() - started
+    
+    stats = pipeline.get_stats()
+    pipeline.stop()
+    return results, elapsed, stats
+
+
+def main():
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='分片处理流程基准测试')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='测试日志行数')
+    parser.add_argument('-w', '--workers', default='1,2,4,8', help='工作进程数列表')
+    parser.add_argument('-b', '--batch-size', type=int, default=1000, help='每次put()的条数')
+    parser.add_argument('--ips', type=int, default=5000, help='正常请求的来源IP数')
+    parser.add_argument('--shard-key', default='ip', choices=['ip', 'base_hash'], help='分片键')
+    args = parser.parse_args()
+    
+    random.seed(0)
+    log_parser = NginxLogParser('combined')
+    entries = [entry for entry in map(log_parser.parse_line, generate_lines(args.count, 'combined'))
+               if entry]
+    # 测试日志中的正常请求只来自少数几个IP，分散到更多IP上以接近实际的分片负载（攻击IP保持不变）
+    for entry in entries:
+        if entry['ip'] in TEST_IPS[:4]:
+            k = random.randrange(args.ips)
+            entry['ip'] = f'10.{k >> 16 & 255}.{k >> 8 & 255}.{k & 255}'
+    
+    # 一致性哈希：工作进程数从N增加到N+1时只有约1/(N+1)的IP改变归属
+    ips = sorted({entry['ip'] for entry in entries})
+    moved = sum(1 for ip in ips if shard_for(ip, 4) != shard_for(ip, 5))
+    print(f"ℹ {len(entries)} 条日志, {len(ips)} 个IP, CPU核数 {os.cpu_count()}")
+    print(f"  4→5 个分片时改变归属的IP: {moved / len(ips) * 100:.1f}% (理想值 20.0%)")
+    
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        config = make_config(os.path.join(tmp, 'bench.db'), args.shard_key)
+        expected, elapsed = run_sequential(config, entries)
+        expected_threats = threat_summary(expected)
+        baseline = len(entries) / elapsed
+        print(f"  单进程顺序处理: {baseline:>10,.0f} 行/秒, {sum(expected_threats.values())} 个威胁")
+        
+        for workers in [int(w) for w in args.workers.split(',')]:
+            results, elapsed, stats = run_sharded(config, entries, workers, args.shard_key, args.batch_size)
+            mismatch = threat_summary(results) != expected_threats
+            failed = failed or mismatch
+            
+            rate = len(entries) / elapsed
+            busy = [shard['busy_seconds'] for shard in stats['shards']]
+            balance = max(busy) / (sum(busy) / len(busy)) if sum(busy) else 1.0
+            status = '✗' if mismatch else '✓'
+            print(f"{status} {workers} 个工作进程: {rate:>10,.0f} 行/秒 ({rate / baseline:.2f}x), "
+                  f"最大积压 {max(s['max_pending'] for s in stats['shards'])} 条, "
+                  f"负载不均衡度 {balance:.2f}"
+                  + (", 威胁检测结果与顺序处理不一致" if mismatch else ''))
+    
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
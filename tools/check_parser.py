@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+日志解析器正确性检查
+逐行比较快速解析（NginxLogParser.parse_line）与正则解析（parse_line_regex）的结果，
+原实现（正则 + urlparse + strptime）能解析的行还与原实现的结果比较，任何一行不一致时以非零状态退出。
+检查的行包括：生成的日志、特殊格式的行、对这些行随机插入分隔符得到的变形行，以及命令行指定的真实日志文件
+"""
+import sys
+import os
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import random
+
+from core.log_monitor import NginxLogParser
+from core.log_source import PipelinedLineReader
+from tools.benchmark_parser import EDGE_CASES, generate_lines, legacy_parse_line
+
+
+# 变形时插入的字符（快速切分依赖的分隔符）
+MUTATION_CHARS = ['"', ' ', '[', ']', '-', '?', '#', ';', '\\', ' - ', '" "', '] "']
+
+
+def mutate(line: str, rng: random.Random) -> str:
+    """在随机位置插入分隔符或删除一个字符"""
+    if not line:
+        return line
+    pos = rng.randrange(len(line))
+    if rng.random() < 0.2:
+        return line[:pos] + line[pos + 1:]
+    return line[:pos] + rng.choice(MUTATION_CHARS) + line[pos:]
+
+
+def _call(func, line):
+    """解析一行，抛出ValueError时返回异常描述"""
+    try:
+        return func(line)
+    except ValueError as e:
+        return f'ValueError: {e}'
+
+
+def _comparable(entry):
+    """两边都是估计时间时（时间无法解析），首行的估计值取自当前时间，不参与比较"""
+    if isinstance(entry, dict) and entry.get('time_estimated'):
+        return {key: value for key, value in entry.items() if key not in ('timestamp', 'epoch')}
+    return entry
+
+
+def compare(fast_parser: NginxLogParser, regex_parser: NginxLogParser, line: str):
+    """
+    比较一行的解析结果（两个解析器依次解析相同的行，时间缓存和沿用的时间保持一致）
+
+    Returns:
+        None表示一致，否则为 (参照实现名, 参照结果, 快速解析结果)
+    """
+    actual = _call(fast_parser.parse_line, line)
+    expected = _call(regex_parser.parse_line_regex, line)
+    # 两种实现都抛出异常即视为一致（如响应时间为 1.2.3 的行）
+    if not (isinstance(expected, str) and isinstance(actual, str)) and \
+            _comparable(expected) != _comparable(actual):
+        return '正则解析', expected, actual
+
+    legacy = _call(lambda text: legacy_parse_line(fast_parser.pattern, text), line)
+    if not isinstance(legacy, str) and legacy != actual:
+        return '原实现', legacy, actual
+    return None
+
+
+def check_lines(log_format: str, lines, label: str, max_report: int = 5) -> int:
+    """检查一组日志行，返回不一致的行数"""
+    fast_parser = NginxLogParser(log_format)
+    regex_parser = NginxLogParser(log_format)
+    checked = 0
+    mismatches = 0
+    for line in lines:
+        checked += 1
+        diff = compare(fast_parser, regex_parser, line)
+        if diff is None:
+            continue
+        mismatches += 1
+        if mismatches <= max_report:
+            name, expected, actual = diff
+            print(f"✗ 结果不一致 ({label}): {line!r}")
+            if isinstance(expected, dict) and isinstance(actual, dict):
+                for key in sorted(set(expected) | set(actual)):
+                    if expected.get(key) != actual.get(key):
+                        print(f"    {key}: {name} {expected.get(key)!r}, 快速解析 {actual.get(key)!r}")
+            else:
+                print(f"    {name}: {expected}")
+                print(f"    快速解析: {actual}")
+    status = '✓' if mismatches == 0 else '✗'
+    print(f"{status} {label}: {checked} 行, {mismatches} 行不一致")
+    return mismatches
+
+
+def read_log_lines(path: str, limit: int):
+    """读取日志文件（支持压缩日志），最多limit行"""
+    count = 0
+    for lines in PipelinedLineReader(path):
+        for line in lines:
+            if count >= limit:
+                return
+            count += 1
+            yield line
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='日志解析器正确性检查（快速解析 vs 原正则解析）')
+    parser.add_argument('files', nargs='*', help='要检查的真实日志文件')
+    parser.add_argument('-f', '--format', choices=['combined', 'custom'], default='combined',
+                        help='日志文件的格式（默认combined）')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='生成的测试日志行数')
+    parser.add_argument('-m', '--mutations', type=int, default=20000, help='随机变形的行数')
+    parser.add_argument('--limit', type=int, default=1000000, help='每个日志文件最多检查的行数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    rng = random.Random(args.seed)
+    mismatches = 0
+
+    for log_format in ('combined', 'custom'):
+        lines = generate_lines(args.count, log_format)
+        suffix = '' if log_format == 'combined' else ' 0.005'
+        edge_cases = [line + suffix if line else line for line in EDGE_CASES]
+
+        mismatches += check_lines(log_format, edge_cases, f'{log_format} 特殊行')
+        mismatches += check_lines(log_format, lines, f'{log_format} 生成日志')
+
+        seeds = edge_cases + lines[:1000]
+        mutated = []
+        for _ in range(args.mutations):
+            line = rng.choice(seeds)
+            for _ in range(rng.randint(1, 3)):
+                line = mutate(line, rng)
+            mutated.append(line)
+        mismatches += check_lines(log_format, mutated, f'{log_format} 变形行')
+
+    for path in args.files:
+        mismatches += check_lines(args.format, read_log_lines(path, args.limit), path)
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -10,17 +10,26 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import json
 from utils.helpers import load_config
 from models.database import Database, ThreatDetectionRule, ScoringRule
+from core.threat_rules import THREAT_RULES_VERSION
 
 
-def init_default_threat_rules(db):
-    """初始化默认威胁检测规则"""
+def init_default_threat_rules(db, detection_config=None):
+    """
+    初始化默认威胁检测规则
     
+    特征类规则按禁用写入，在Web界面启用后才覆盖配置文件中的同类特征
+    
+    Args:
+        db: 数据库
+        detection_config: 配置文件中的threat_detection配置（窗口类规则的启用状态与之一致）
+    """
+    detection_config = detection_config or {}
     default_rules = [
         {
             'category': 'sql_injection',
             'name': 'SQL注入检测',
             'description': '检测常见的SQL注入攻击模式',
-            'enabled': True,
+            'enabled': False,
             'patterns': json.dumps([
                 "union.*select",
                 "select.*from",
@@ -39,7 +48,7 @@ def init_default_threat_rules(db):
             'category': 'xss_attack',
             'name': 'XSS攻击检测',
             'description': '检测跨站脚本攻击',
-            'enabled': True,
+            'enabled': False,
             'patterns': json.dumps([
                 "<script",
                 "javascript:",
@@ -52,43 +61,31 @@ def init_default_threat_rules(db):
             ]),
             'threat_score': 40
         },
+        # 窗口类规则不带参数：沿用配置文件threat_detection下的窗口参数，在Web界面设置参数后才覆盖配置
         {
             'category': 'rate_limit',
             'name': '频率限制',
             'description': '检测异常高频访问',
-            'enabled': True,
-            'parameters': json.dumps({
-                'window_seconds': 60,
-                'max_requests': 100
-            }),
-            'threat_score': 25
+            'enabled': detection_config.get('rate_limit', {}).get('enabled', True)
         },
         {
             'category': 'scan_detection',
             'name': '路径扫描检测',
             'description': '检测404路径扫描行为',
-            'enabled': True,
-            'parameters': json.dumps({
-                'window_seconds': 300,
-                'max_404_count': 20
-            }),
-            'threat_score': 30
+            'enabled': detection_config.get('scan_detection', {}).get('enabled', True)
         },
         {
             'category': 'sensitive_path',
             'name': '敏感路径访问',
             'description': '检测敏感文件和目录访问',
-            'enabled': True,
+            'enabled': False,
             'patterns': json.dumps([
                 "/.env",
                 "/.git",
-                "/admin",
                 "/phpmyadmin",
-                "/wp-admin",
                 "/.aws",
                 "/.ssh",
-                "/config",
-                "/backup"
+                "/wp-config.php"
             ]),
             'threat_score': 15
         },
@@ -96,7 +93,7 @@ def init_default_threat_rules(db):
             'category': 'bad_user_agent',
             'name': '恶意User-Agent检测',
             'description': '检测扫描工具和恶意爬虫',
-            'enabled': True,
+            'enabled': False,
             'patterns': json.dumps([
                 "masscan",
                 "nmap",
@@ -123,6 +120,8 @@ def init_default_threat_rules(db):
         for rule_data in default_rules:
             rule = ThreatDetectionRule(**rule_data)
             session.add(rule)
+        # 递增规则版本，运行中的防火墙在下次检查版本时加载这些规则
+        db.bump_rule_version(session, THREAT_RULES_VERSION)
         
         session.commit()
         print(f"✓ 已初始化 {len(default_rules)} 条默认威胁检测规则")
@@ -215,7 +214,7 @@ def main():
     db = Database(config)
     
     # 初始化规则
-    init_default_threat_rules(db)
+    init_default_threat_rules(db, config.get('threat_detection', {}))
     init_default_custom_rules(db)
     
     print("\n" + "="*60)
@@ -101,6 +101,50 @@ def test_database():
         return False
 
 
+def test_log_rotation():
+    """测试多文件监控不把已轮转的日志当作新文件跟踪"""
+    print("\n正在验证日志轮转文件识别...")
+    print("=" * 60)
+    
+    import tempfile
+    
+    try:
+        from core.log_monitor import MultiLogMonitor, NginxLogParser
+        
+        rotated = [
+            'access.log.1', 'access.log.2.gz', 'access.log.old', 'access.log-20261017',
+            'access.log-2026101718', 'access.log-20261017.gz', 'access.log-20261017.bz2',
+        ]
+        live = ['access.log', 'site.access.log', 'api-access.log']
+        
+        with tempfile.TemporaryDirectory() as log_dir:
+            for name in rotated + live:
+                with open(os.path.join(log_dir, name), 'w') as f:
+                    f.write('')
+            
+            monitor = MultiLogMonitor([os.path.join(log_dir, '*access.log*')], NginxLogParser('combined'),
+                                      lambda entry: None, engine='poll')
+            monitor._discover(resume=False)
+            tracked = sorted(os.path.basename(path) for path in monitor.tails)
+            for tail in monitor.tails.values():
+                tail.close()
+        
+        passed = tracked == sorted(live)
+        for name in rotated + live:
+            expected = 'tracked' if name in live else 'skipped'
+            actual = 'tracked' if name in tracked else 'skipped'
+            status = '[OK]' if expected == actual else '[FAIL]'
+            print(f"{status} {name:28} {actual}")
+        
+        print("=" * 60)
+        return passed
+        
+    except Exception as e:
+        print(f"✗ 日志轮转识别错误: {e}")
+        print("=" * 60)
+        return False
+
+
 def check_required_files():
     """检查必需文件"""
     print("\n正在检查必需文件...")
@@ -154,6 +198,9 @@ def main():
     # 4. 测试数据库
     results.append(("数据库测试", test_database()))
     
+    # 5. 测试日志轮转文件识别
+    results.append(("日志轮转识别测试", test_log_rotation()))
+    
     # 总结
     print("\n" + "=" * 60)
     print("验证结果汇总")
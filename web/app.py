@@ -11,7 +11,10 @@ import os
 
 def create_app(config, db, firewall, threat_detector, identity_chain_mgr, 
                cache_manager=None, geo_analyzer=None, audit_logger=None,
-               scoring_system=None, port_manager=None, auth_manager=None):
+               scoring_system=None, port_manager=None, auth_manager=None,
+               ingest_queue=None, pipeline=None, commit_counter=None,
+               access_log_writer=None, fingerprint_aggregator=None,
+               fingerprint_cache=None, action_executor=None, threat_aggregator=None):
     """创建Flask应用"""
     
     app = Flask(__name__)
@@ -27,6 +30,14 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
     app.scoring_system = scoring_system
     app.port_manager = port_manager
     app.auth_manager = auth_manager
+    app.ingest_queue = ingest_queue
+    app.pipeline = pipeline
+    app.commit_counter = commit_counter
+    app.access_log_writer = access_log_writer
+    app.fingerprint_aggregator = fingerprint_aggregator
+    app.fingerprint_cache = fingerprint_cache
+    app.action_executor = action_executor
+    app.threat_aggregator = threat_aggregator
     
     # 会话管理
     from flask import session as flask_session
@@ -281,7 +292,10 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
                 BanRecord.is_active == True
             ).scalar()
             
-            threats_detected = session.query(func.count(ThreatEvent.id)).filter(
+            # 聚合的威胁事件按命中次数统计
+            threats_detected = session.query(
+                func.coalesce(func.sum(func.coalesce(ThreatEvent.occurrence_count, 1)), 0)
+            ).filter(
                 ThreatEvent.timestamp >= cutoff
             ).scalar()
             
@@ -299,6 +313,36 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
         finally:
             session.close()
     
+    @app.route('/api/stats/sources')
+    def stats_sources():
+        """按日志来源统计（多站点）"""
+        from models.database import AccessLog
+        from sqlalchemy import func
+        
+        hours = request.args.get('hours', 24, type=int)
+        session = db.get_session()
+        try:
+            cutoff = datetime.now() - timedelta(hours=hours)
+            
+            rows = session.query(
+                AccessLog.source,
+                func.count(AccessLog.id),
+                func.count(func.distinct(AccessLog.ip))
+            ).filter(
+                AccessLog.timestamp >= cutoff
+            ).group_by(AccessLog.source).all()
+            
+            return jsonify([
+                {
+                    'source': source,
+                    'requests': requests or 0,
+                    'unique_ips': unique_ips or 0
+                }
+                for source, requests, unique_ips in rows
+            ])
+        finally:
+            session.close()
+
     @app.route('/api/stats/threats')
     def stats_threats():
         """威胁统计"""
@@ -355,7 +399,9 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
                 'threat_type': t.threat_type,
                 'severity': t.severity,
                 'description': t.description,
-                'handled': t.handled
+                'handled': t.handled,
+                'occurrence_count': t.occurrence_count or 1,
+                'last_seen': (t.last_seen or t.timestamp).isoformat()
             } for t in threats])
         finally:
             session.close()
@@ -526,6 +572,71 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
         finally:
             session.close()
     
+    @app.route('/api/stats/ingest')
+    def ingest_stats():
+        """日志接入队列状态（深度、等待时间、丢弃数）"""
+        if not ingest_queue:
+            return jsonify({'enabled': False})
+        
+        stats = ingest_queue.get_stats()
+        stats['enabled'] = True
+        return jsonify(stats)
+    
+    @app.route('/api/stats/writes')
+    def write_stats():
+        """数据库写入统计（每1000行日志的提交次数、访问日志缓冲的刷新延迟直方图、指纹聚合、威胁事件聚合）"""
+        stats = {}
+        if commit_counter:
+            stats['commits'] = commit_counter.get_stats()
+        if access_log_writer:
+            stats['access_log_buffer'] = access_log_writer.get_stats()
+        if fingerprint_aggregator:
+            stats['fingerprint_aggregator'] = fingerprint_aggregator.get_stats()
+        if threat_aggregator:
+            stats['threat_aggregator'] = threat_aggregator.get_stats()
+        return jsonify(stats)
+    
+    @app.route('/api/stats/actions')
+    def action_stats():
+        """处置动作统计（队列深度、合并/去重的封禁、每类动作的排队和执行延迟直方图）"""
+        if not action_executor:
+            return jsonify({'enabled': False})
+        
+        stats = action_executor.get_stats()
+        stats['enabled'] = True
+        return jsonify(stats)
+    
+    @app.route('/api/cache/fingerprints')
+    def fingerprint_cache_stats():
+        """指纹状态缓存统计（命中率、条数、淘汰和失效次数）"""
+        if not fingerprint_cache:
+            return jsonify({'enabled': False})
+        
+        stats = fingerprint_cache.get_stats()
+        stats['enabled'] = True
+        return jsonify(stats)
+    
+    @app.route('/api/cache/fingerprints/invalidate', methods=['POST'])
+    @require_auth
+    def invalidate_fingerprint_cache():
+        """使指纹状态缓存失效（直接修改数据库中的指纹后调用，不指定base_hash时清空）"""
+        if not fingerprint_cache:
+            return jsonify({'success': False, 'message': '指纹状态缓存未启用'}), 400
+        
+        data = request.get_json(silent=True) or {}
+        removed = fingerprint_cache.invalidate(data.get('base_hash'))
+        return jsonify({'success': True, 'removed': removed})
+    
+    @app.route('/api/stats/pipeline')
+    def pipeline_stats():
+        """分片处理流程状态（每个分片的积压条数、队列深度和分析耗时）"""
+        if not pipeline:
+            return jsonify({'enabled': False})
+        
+        stats = pipeline.get_stats()
+        stats['enabled'] = True
+        return jsonify(stats)
+    
     @app.route('/api/geo/countries')
     def geo_countries():
         """国家统计"""
@@ -689,6 +800,18 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
         """规则管理页面"""
         return render_template('rules.html', username=flask_session.get('username'))
     
+    def _bump_threat_rules_version(session):
+        """修改威胁检测规则的会话提交前调用：递增规则版本，各进程的检测引擎据此重新加载"""
+        from core.threat_rules import THREAT_RULES_VERSION
+        db.bump_rule_version(session, THREAT_RULES_VERSION)
+    
+    def _reload_threat_rules():
+        """规则修改提交后立即重新编译本进程的规则集（其他进程在下次检查版本时生效）"""
+        try:
+            threat_detector.refresh_rules()
+        except Exception as e:
+            print(f"⚠ 重新加载威胁检测规则失败: {e}")
+    
     @app.route('/api/rules/threat')
     @require_auth
     def get_threat_rules():
@@ -760,7 +883,9 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
                 threat_score=data.get('threat_score', 0)
             )
             session.add(rule)
+            _bump_threat_rules_version(session)
             session.commit()
+            _reload_threat_rules()
             
             return jsonify({'success': True, 'id': rule.id})
         except Exception as e:
@@ -790,8 +915,10 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
             rule.parameters = data.get('parameters', rule.parameters)
             rule.threat_score = data.get('threat_score', rule.threat_score)
             rule.updated_at = datetime.now()
+            _bump_threat_rules_version(session)
             
             session.commit()
+            _reload_threat_rules()
             return jsonify({'success': True})
         except Exception as e:
             session.rollback()
@@ -812,7 +939,9 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
                 return jsonify({'error': '规则不存在'}), 404
             
             session.delete(rule)
+            _bump_threat_rules_version(session)
             session.commit()
+            _reload_threat_rules()
             return jsonify({'success': True})
         except Exception as e:
             session.rollback()
@@ -835,7 +964,9 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
             
             rule.enabled = data.get('enabled', not rule.enabled)
             rule.updated_at = datetime.now()
+            _bump_threat_rules_version(session)
             session.commit()
+            _reload_threat_rules()
             return jsonify({'success': True, 'enabled': rule.enabled})
         except Exception as e:
             session.rollback()
@@ -843,6 +974,34 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
         finally:
             session.close()
     
+    @app.route('/api/rules/threat/status')
+    @require_auth
+    def get_threat_rules_status():
+        """当前生效的威胁检测规则集：版本、加载时间、各字段特征数和无效特征"""
+        from core.threat_rules import THREAT_RULES_VERSION
+        
+        stats = threat_detector.get_rules_stats()
+        stats['database_version'] = db.get_rule_version(THREAT_RULES_VERSION)
+        return jsonify(stats)
+    
+    @app.route('/api/rules/threat/reload', methods=['POST'])
+    @require_auth
+    def reload_threat_rules():
+        """从数据库重新编译威胁检测规则（直接修改数据库后使用）"""
+        session = db.get_session()
+        try:
+            # 递增版本，分片工作进程也会重新加载
+            _bump_threat_rules_version(session)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            return jsonify({'error': str(e)}), 400
+        finally:
+            session.close()
+        
+        threat_detector.refresh_rules(force=True)
+        return jsonify(threat_detector.get_rules_stats())
+    
     # 自定义规则API
     @app.route('/api/rules/custom')
     @require_auth
@@ -1088,5 +1247,52 @@ def create_app(config, db, firewall, threat_detector, identity_chain_mgr,
         except Exception as e:
             return jsonify({'error': str(e)}), 500
     
+    # ==================== 白名单/黑名单 ====================
+    
+    @app.route('/api/firewall/<any(whitelist, blacklist):list_type>')
+    @require_auth
+    def api_list_entries(list_type):
+        """获取数据库中的白名单/黑名单条目和编译后的名单统计"""
+        return jsonify({
+            'entries': firewall.list_entries(list_type),
+            'stats': firewall.get_list_stats()
+        })
+    
+    @app.route('/api/firewall/<any(whitelist, blacklist):list_type>', methods=['POST'])
+    @require_auth
+    def api_add_list_entry(list_type):
+        """添加白名单/黑名单条目（IP或CIDR，立即生效）"""
+        data = request.json or {}
+        entry = data.get('ip') or data.get('cidr')
+        note = data.get('description') if list_type == 'whitelist' else data.get('reason')
+        
+        if not entry:
+            return jsonify({'success': False, 'message': 'IP地址不能为空'}), 400
+        
+        try:
+            value = firewall.add_list_entry(list_type, entry, note)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if audit_logger:
+            if list_type == 'whitelist':
+                audit_logger.log_whitelist_add(value, note or '', 'web_admin')
+            else:
+                audit_logger.log_blacklist_add(value, note or '', 'web_admin')
+        return jsonify({'success': True, 'entry': value, 'stats': firewall.get_list_stats()})
+    
+    @app.route('/api/firewall/<any(whitelist, blacklist):list_type>/<path:entry>', methods=['DELETE'])
+    @require_auth
+    def api_remove_list_entry(list_type, entry):
+        """删除白名单/黑名单条目（CIDR直接写在路径中，如 /api/firewall/whitelist/10.0.0.0/8）"""
+        success = firewall.remove_list_entry(list_type, entry)
+        return jsonify({'success': success, 'stats': firewall.get_list_stats()})
+    
+    @app.route('/api/firewall/lists/reload', methods=['POST'])
+    @require_auth
+    def api_reload_lists():
+        """从配置文件和数据库重新编译白名单/黑名单"""
+        return jsonify(firewall.reload_lists())
+    
     return app
 